@@ -0,0 +1,29 @@
+import subprocess
+import typing
+
+
+class ContainerRun(subprocess.CompletedProcess):
+    # Result of a `docker run`, usable everywhere a CompletedProcess is expected
+    # exit_code is None for detached containers, those are still running
+    def __init__(self,
+                 args: typing.List[str],
+                 container: str,
+                 exit_code: typing.Optional[int],
+                 wall_time: float,
+                 stdout: typing.Union[bytes, str, None] = None,
+                 detached: bool = False):
+        super().__init__(args, exit_code if exit_code is not None else 0, stdout)
+        self.container = container
+        self.exit_code = exit_code
+        self.wall_time = wall_time
+        self.detached = detached
+
+    @property
+    def logs(self) -> typing.Optional[str]:
+        # Captured output, only set when the run was started with stdout=subprocess.PIPE
+        if isinstance(self.stdout, bytes):
+            return self.stdout.decode('utf-8', errors='replace')
+        return self.stdout
+
+    def __str__(self):
+        return '{s.container}: exit code {s.exit_code} after {s.wall_time:.1f}s'.format(s=self)
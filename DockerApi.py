@@ -0,0 +1,162 @@
+import http.client
+import json
+import os
+import socket
+import subprocess
+import threading
+import typing
+import urllib.parse
+
+DEFAULT_SOCKET = '/var/run/docker.sock'
+
+
+class DockerApiError(subprocess.CalledProcessError):
+    # Raised for failed API calls, a CalledProcessError so callers handle it like a failed `docker` command
+    def __init__(self, method: str, path: str, status: int, message: str):
+        super().__init__(1, [method, path], output=message)
+        self.status = status
+        self.message = message
+
+    def __str__(self):
+        return 'Docker API {cmd[0]} {cmd[1]} failed ({status}): {message}'.format(cmd=self.cmd, status=self.status,
+                                                                              message=self.message)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: typing.Optional[float] = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+def socket_from_environment() -> str:
+    host = os.environ.get('DOCKER_HOST', '')
+    if host.startswith('unix://'):
+        return host[len('unix://'):]
+    return DEFAULT_SOCKET
+
+
+class DockerApi:
+    # Minimal client of the Docker Engine API over the unix socket
+    # Every thread keeps its own persistent connection, a connection closed by the daemon is reopened once
+    def __init__(self, socket_path: str = None, timeout: typing.Optional[float] = None):
+        self.socket_path = socket_path if socket_path is not None else socket_from_environment()
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> UnixHTTPConnection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = UnixHTTPConnection(self.socket_path, self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def request(self,
+                method: str,
+                path: str,
+                params: typing.Dict[str, str] = None,
+                body: typing.Any = None) -> (int, bytes):
+        url = path
+        if params:
+            url = '{path}?{query}'.format(path=path, query=urllib.parse.urlencode(params))
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        for attempt in (0, 1):
+            conn = self._connection()
+            try:
+                conn.request(method, url, body=data, headers=headers)
+                response = conn.getresponse()
+                content = response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # idle keep-alive connection closed by the daemon
+                self.close()
+                if attempt:
+                    raise
+                continue
+            if response.will_close:
+                self.close()
+            return response.status, content
+
+    def call(self,
+             method: str,
+             path: str,
+             params: typing.Dict[str, str] = None,
+             body: typing.Any = None,
+             accept: typing.Sequence[int] = (200, 201, 204, 304)) -> typing.Any:
+        # Parsed JSON response, raises DockerApiError for unexpected statuses
+        status, content = self.request(method, path, params, body)
+        if status not in accept:
+            try:
+                message = json.loads(content.decode('utf-8')).get('message', '')
+            except ValueError:
+                message = content.decode('utf-8', errors='replace')
+            raise DockerApiError(method, path, status, message)
+        if not content:
+            return None
+        try:
+            return json.loads(content.decode('utf-8'))
+        except ValueError:
+            # streamed responses (pull) are a sequence of JSON objects
+            return [json.loads(line) for line in content.decode('utf-8').splitlines() if line.strip()]
+
+    @staticmethod
+    def _quote(ident: str) -> str:
+        return urllib.parse.quote(ident, safe='')
+
+    def inspect_container(self, ident: str) -> dict:
+        return self.call('GET', '/containers/{id}/json'.format(id=self._quote(ident)))
+
+    def inspect_image(self, ident: str) -> dict:
+        return self.call('GET', '/images/{id}/json'.format(id=self._quote(ident)))
+
+    def inspect_network(self, ident: str) -> dict:
+        return self.call('GET', '/networks/{id}'.format(id=self._quote(ident)))
+
+    def inspect(self, ident: str) -> dict:
+        # Same lookup order as `docker inspect` without --type
+        try:
+            return self.inspect_container(ident)
+        except DockerApiError as err:
+            if err.status != 404:
+                raise
+        return self.inspect_image(ident)
+
+    def image_exists(self, ident: str) -> bool:
+        status, _ = self.request('GET', '/images/{id}/json'.format(id=self._quote(ident)))
+        return status == 200
+
+    def remove_container(self, ident: str, force: bool = False) -> None:
+        self.call('DELETE', '/containers/{id}'.format(id=self._quote(ident)), {'force': '1' if force else '0'})
+
+    def remove_network(self, ident: str) -> None:
+        self.call('DELETE', '/networks/{id}'.format(id=self._quote(ident)))
+
+    def wait_container(self, ident: str) -> int:
+        return self.call('POST', '/containers/{id}/wait'.format(id=self._quote(ident)))['StatusCode']
+
+    def pull_image(self, name: str) -> None:
+        # without a tag the daemon would pull every tag of the image, the cli pulls latest
+        params = {'fromImage': name}
+        if '@' not in name and ':' not in name.rsplit('/', 1)[-1]:
+            params['tag'] = 'latest'
+        messages = self.call('POST', '/images/create', params)
+        if isinstance(messages, dict):
+            messages = [messages]
+        for message in messages or []:
+            if 'error' in message:
+                raise DockerApiError('POST', '/images/create', 500, message['error'])
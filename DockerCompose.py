@@ -3,6 +3,8 @@ from typing import Dict, Union, List
 
 from DockerService import DockerService, MainDocker
 from Meta import Meta
+from ServerData import ServerData
+from resources import auto_resources
 from exportable_compose_part import ExportableComposePart
 
 
@@ -29,8 +31,16 @@ class DockerCompose(ExportableComposePart):
         if data_dict:
             self.version = data_dict['version']  # type: str
             self.networks = data_dict['networks']
-            self.services, self.main_docker = load_dckr(data_dict['services'])
             self.meta = Meta(data_dict['x-meta'])
+            # replicas are exported from their docker, not loaded as dockers of their own
+            replicas = {r for n in data_dict['services'] for r in self.get_replica_names(n)}
+            # dockers have their own x-meta, replicas do not
+            clashes = sorted(r for r in replicas if r in self.meta.dockerData)
+            if clashes:
+                raise ValueError('Dockers {clashes} have the name of a replica of another docker'
+                                 .format(clashes=', '.join(clashes)))
+            self.services, self.main_docker = load_dckr({n: d for n, d in data_dict['services'].items()
+                                                         if n not in replicas})
         else:
             if not network_name or not network_port:
                 raise ValueError('Both data_dict and nework_name/port are empty')
@@ -52,14 +62,69 @@ class DockerCompose(ExportableComposePart):
         return {
             "version": self.version,
             "networks": self.networks,
-            "services": {n: d.export_data_dict() for n, d in self.services.items()},
+            "services": {
+                **{n: d.export_data_dict() for n, d in self.services.items()},
+                **{r: d.export_replica_data_dict(r) for n, d in self.services.items()
+                   for r in self.get_replica_names(n)},
+            },
             "x-meta": self.meta.export_data_dict(),
         }
 
     def add_server(self, path: List[str], server_name: str, server_port: int):
+        replicas = self.meta.get_replicas(server_name)
         for p in path:
-            self.main_docker.add_server(p, server_name, server_port)
-            self.meta.add_location(p, server_name, server_port)
+            self.main_docker.add_server(p, server_name, server_port, replicas)
+            self.meta.add_location(p, server_name, server_port, replicas)
+
+    def set_replicas(self, server_name: str, replicas: int):
+        # Runs the docker in `replicas` containers (see ServerData.replica_names)
+        if replicas < 1:
+            raise ValueError('A docker needs at least one replica')
+        if self.main_docker is not None and server_name == self.main_docker.get_fullname() and replicas > 1:
+            raise ValueError('The main docker cannot be replicated')
+        taken = [r for r in ServerData.replica_names(server_name, replicas)[1:] if r in self.services]
+        if taken:
+            raise ValueError('Replica names {taken} are used by other dockers'.format(taken=', '.join(taken)))
+        self.meta.set_replicas(server_name, replicas)
+        if self.main_docker is not None:
+            self.main_docker.set_replicas(server_name, replicas)
+
+    def set_resources(self, name: str, resources: Dict[str, Union[str, int, float]]):
+        # Stores the resource profile of a docker and applies it to its service (and replicas)
+        self.meta.set_resources(name, resources)
+        self.services[name].set_resources(resources)
+
+    def auto_resources(self, cores: int, memory: int) -> Dict[str, Dict[str, Union[str, int, float]]]:
+        # Sizes the resources of every docker of the group from the host cores and memory
+        services = []
+        for name in self.services:
+            if self.main_docker is not None and name == self.main_docker.get_fullname():
+                kind = 'proxy'
+            elif self.meta.dockerData.get(name, {}).get('compile-script') is not None:
+                kind = 'backend'
+            else:
+                kind = 'service'
+            services.append((name, kind, self.meta.get_replicas(name)))
+        profiles = auto_resources(services, cores, memory)
+        for name, profile in profiles.items():
+            self.set_resources(name, profile)
+        return profiles
+
+    def get_replica_names(self, name: str) -> List[str]:
+        # The additional containers of a docker, without the docker itself
+        return ServerData.replica_names(name, self.meta.get_replicas(name))[1:]
+
+    def get_replica_owner(self, name: str) -> typing.Optional[str]:
+        # The docker of which name is a replica
+        return next((n for n in self.services if name in self.get_replica_names(n)), None)
+
+    def get_all_container_names(self) -> List[str]:
+        # Names of all containers of the compose file, replicas included
+        names = []
+        for name, dckr in self.services.items():
+            names.append(dckr.get_fullname())
+            names.extend(self.get_replica_names(name))
+        return names
 
     def get_docker(self, name) -> typing.Optional[DockerService]:
         return self.services.get(name)
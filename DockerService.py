@@ -1,7 +1,9 @@
 import typing
 
+from RouteIndex import RouteIndex
 from ServerData import ServerData
 from exportable_compose_part import ExportableComposePart
+from resources import COMPOSE_KEYS, compose_resources
 # from pathlib import Path
 
 # PathLike = typing.Union[str, bytes, Path]
@@ -81,6 +83,10 @@ class DockerService(ExportableComposePart):
         except KeyError:
             return None
 
+    def fingerprint_data(self) -> typing.Optional[dict]:
+        # The settings that require recreating the container when changed
+        return self.export_data_dict()
+
     def export_data_dict(self) -> typing.Optional[dict]:
         d = dict(self._dataDict)
         if self.ports is not None and len(self.ports):
@@ -116,6 +122,33 @@ class DockerService(ExportableComposePart):
         self._build_ports()
         self._build_environment()
 
+    def set_resources(self, resources: typing.Dict[str, typing.Union[str, int, float]]) -> None:
+        # Replaces the resource limits of the service (see resources.py)
+        for key in COMPOSE_KEYS:
+            self._dataDict.pop(key, None)
+        ulimits = {k: v for k, v in self._dataDict.pop('ulimits', {}).items() if k != 'nofile'}
+        data = compose_resources(resources)
+        ulimits.update(data.pop('ulimits', {}))
+        if ulimits:
+            data['ulimits'] = ulimits
+        self._dataDict.update(data)
+
+    def export_replica_data_dict(self, replica_name: str) -> dict:
+        # Service definition of an additional container of this docker, running the same image
+        d = self.export_data_dict()
+        d['container_name'] = replica_name
+        # reached through the proxy, published host ports can only be bound once
+        d.pop('ports', None)
+        if 'image' in d:
+            # built once by the service itself
+            d.pop('build', None)
+            depends_on = d.get('depends_on', [])
+            if isinstance(depends_on, dict):
+                d['depends_on'] = {**depends_on, self.get_fullname(): {'condition': 'service_started'}}
+            else:
+                d['depends_on'] = [*depends_on, self.get_fullname()]
+        return d
+
     @classmethod
     def generate_empty(cls, base: str, name: str, yaml: dict = None, listenport: int = None, internalport: int = None):
         data_dict = {
@@ -142,10 +175,12 @@ class DockerService(ExportableComposePart):
 
 class MainDocker(DockerService):
     # Specific docker for the main (nginx/reverse proxy) docker
+    SITES_ENABLED = '/etc/nginx/sites-enabled'
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         servers = self._getServerEnvironmentVariable()
-        self._serverList = list(MainDocker._extract_dynamic_servers(servers))
+        self._routes = RouteIndex(MainDocker._extract_dynamic_servers(servers))
 
     def _getServerEnvironmentVariable(self) -> str:
         s = self.get_environment_variable('DYNAMIC_SERVER')
@@ -154,6 +189,7 @@ class MainDocker(DockerService):
     def merge_data(self, data):
         super().merge_data(data)
         self.set_environment_variable('DYNAMIC_SERVER', self._str_servlist())
+        self.add_sites_enabled_volume()
 
     @staticmethod
     def _extract_dynamic_servers(servers: str) -> typing.Generator[ServerData, typing.Any, None]:
@@ -161,26 +197,20 @@ class MainDocker(DockerService):
         return (ServerData(*server.split(':')) for server in serverList if server)
 
     def _str_servlist(self):
-        return ";".join(str(server) for server in self._serverList)
+        return ";".join(str(server) for server in self._routes)
 
-    def add_server(self, path: str, server_name: str, server_port: int) -> None:
-        new_data = ServerData(path, server_name, server_port)
-        try:
-            ind, v = next((ind, v) for ind, v in enumerate(self._serverList) if v.is_more_generic(new_data))
-            if v.path == new_data.path:
-                raise ValueError('{path} already inside path'.format(path=new_data.path))
-            self._serverList.insert(ind, new_data)
-            self.set_environment_variable('DYNAMIC_SERVER', self._str_servlist())
-        except StopIteration:
-            self._serverList.append(new_data)
+    def add_server(self, path: str, server_name: str, server_port: int, replicas: int = 1) -> None:
+        self._routes.add(ServerData(path, server_name, server_port, replicas))
+        self.set_environment_variable('DYNAMIC_SERVER', self._str_servlist())
+
+    def set_replicas(self, server_name: str, replicas: int) -> None:
+        for server in self._routes.get_server_routes(server_name):
+            server.replicas = replicas
+        self.set_environment_variable('DYNAMIC_SERVER', self._str_servlist())
 
     def remove_server(self, server_name: str) -> None:
-        print(len(self._serverList))
-        for ind, v in enumerate(self._serverList):
-            if v.name == server_name:
-                del self._serverList[ind]
+        self._routes.remove_server(server_name)
         self.set_environment_variable('DYNAMIC_SERVER', self._str_servlist())
-        print(len(self._serverList))
 
     def export_data_dict(self) -> typing.Optional[dict]:
         dat = self._str_servlist()
@@ -188,6 +218,30 @@ class MainDocker(DockerService):
         d['environment']['DYNAMIC_SERVER'] = dat
         return d
 
+    def fingerprint_data(self) -> typing.Optional[dict]:
+        # Routes are applied by reloading nginx, not by recreating the container
+        d = super().fingerprint_data()
+        d['environment'] = {k: v for k, v in d['environment'].items() if k != 'DYNAMIC_SERVER'}
+        return d
+
+    def sites_enabled_volume(self) -> typing.Optional[str]:
+        source = self.get_source_path()
+        if source is None:
+            return None
+        return '{source}/sites-enabled:{target}:ro'.format(source=source.rstrip('/'), target=self.SITES_ENABLED)
+
+    def has_sites_enabled_volume(self) -> bool:
+        return any(isinstance(v, str) and v.split(':')[1:2] == [self.SITES_ENABLED]
+                   for v in self._dataDict.get('volumes', []))
+
+    def add_sites_enabled_volume(self) -> bool:
+        # Mounts the generated nginx sites into the container, returns whether the volume was added
+        volume = self.sites_enabled_volume()
+        if volume is None or self.has_sites_enabled_volume():
+            return False
+        self._dataDict['volumes'] = [*self._dataDict.get('volumes', []), volume]
+        return True
+
     def __str__(self) -> str:
         return str(self.export_data_dict())
 
@@ -200,4 +254,5 @@ class MainDocker(DockerService):
         if 'environment' not in dckr._dataDict:
             dckr._dataDict['environment'] = {}
         dckr._dataDict['environment']['DYNAMIC_SERVER'] = ''
+        dckr.add_sites_enabled_volume()
         return dckr
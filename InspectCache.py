@@ -0,0 +1,50 @@
+import typing
+
+from docker_util import docker_inspect_all
+
+
+class InspectCache:
+    # State of the containers of a project and their networks, inspected once for a whole command
+    # All containers are fetched in one bulk inspect, their networks in a second one
+    # Answers reflect the moment of loading, removals done through `forget` are taken into account
+    def __init__(self,
+                 containers: typing.Dict[str, dict],
+                 networks: typing.Dict[str, dict]):
+        self.containers = containers
+        self.networks = networks
+        self._removed = set()  # type: typing.Set[str]
+
+    @classmethod
+    def load(cls, container_names: typing.Iterable[str]) -> 'InspectCache':
+        containers = {c['Name'].lstrip('/'): c for c in docker_inspect_all(*container_names)}
+        network_names = sorted({n for c in containers.values()
+                                for n in (c.get('NetworkSettings', {}).get('Networks') or {})})
+        networks = {n['Name']: n for n in docker_inspect_all(*network_names, object_type='network')}
+        return cls(containers, networks)
+
+    def exists(self, name: str) -> bool:
+        return name in self.containers and name not in self._removed
+
+    def get_status(self, name: str) -> typing.Optional[str]:
+        if not self.exists(name):
+            return None
+        return self.containers[name]['State'].get('Status')
+
+    def get_exit_code(self, name: str) -> typing.Optional[int]:
+        if not self.exists(name):
+            return None
+        return self.containers[name]['State'].get('ExitCode')
+
+    def get_networks_from_container(self, name: str) -> typing.List[str]:
+        if name not in self.containers:
+            return []
+        return list(self.containers[name].get('NetworkSettings', {}).get('Networks') or {})
+
+    def get_containers_in_network(self, network: str) -> typing.List[str]:
+        # Names of the containers still attached to the network
+        attached = (self.networks.get(network, {}).get('Containers') or {}).values()
+        return [c['Name'] for c in attached if c.get('Name') not in self._removed]
+
+    def forget(self, *names: str) -> None:
+        # Marks containers as removed
+        self._removed.update(names)
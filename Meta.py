@@ -1,13 +1,16 @@
-from functools import cmp_to_key
+from functools import partial
 from pathlib import Path
 from typing import Dict, Union, Optional, List, Callable, TypeVar
 
+from RouteIndex import RouteIndex
 from ServerData import ServerData
 from compile import default_clone, compile_javascript
 from exportable_compose_part import ExportableComposePart
 
 P = Union[str, Dict[str, 'P']]
 
+FRONTEND_CODE_TYPES = ('react', 'nginx', 'frontend')
+
 
 class Meta(ExportableComposePart):
     def export_data_dict(self) -> Union[str, int, dict, None]:
@@ -19,8 +22,8 @@ class Meta(ExportableComposePart):
         self.main = main_name if main_name is not None else data_dict['main']
         t = data_dict.get('locations', None)
         all_locs = t if t is not None else {}
-        self.locations = {path: ServerData(path, *loc.split(':'))
-                          for path, loc in all_locs.items()}  # type: Dict[str, ServerData]
+        self.locations = RouteIndex(ServerData(path, *loc.split(':'))
+                                    for path, loc in all_locs.items())
         self.dockerData = data_dict.get('docker_data', {})  # type: Dict[str, P]
 
     def get_build_environment(self, docker_name: str):
@@ -36,14 +39,113 @@ class Meta(ExportableComposePart):
             self.dockerData[docker_name]['environment'] = v
         v[variable] = value
 
+    def set_node_version(self, docker_name: str, node_version: str):
+        # node version used to build the code of the docker
+        if docker_name not in self.dockerData:
+            self.dockerData[docker_name] = {}
+        self.dockerData[docker_name]['node_version'] = node_version
+
+    def get_node_version(self, docker_name: str) -> Optional[str]:
+        try:
+            return self.dockerData[docker_name].get('node_version')
+        except KeyError:
+            return None
+
+    def set_replicas(self, docker_name: str, replicas: int):
+        # number of containers of the docker, the routes to it are balanced over all of them
+        if docker_name not in self.dockerData:
+            self.dockerData[docker_name] = {}
+        if replicas > 1:
+            self.dockerData[docker_name]['replicas'] = replicas
+        else:
+            self.dockerData[docker_name].pop('replicas', None)
+        for loc in self.locations.get_server_routes(docker_name):
+            loc.replicas = replicas
+
+    def get_replicas(self, docker_name: str) -> int:
+        try:
+            return self.dockerData[docker_name].get('replicas', 1)
+        except KeyError:
+            return 1
+
+    def set_resources(self, docker_name: str, resources: Dict[str, Union[str, int, float]]):
+        # resource profile of the docker (see resources.py), also written into its service definition
+        if docker_name not in self.dockerData:
+            self.dockerData[docker_name] = {}
+        if resources:
+            self.dockerData[docker_name]['resources'] = dict(resources)
+        else:
+            self.dockerData[docker_name].pop('resources', None)
+
+    def get_resources(self, docker_name: str) -> Dict[str, Union[str, int, float]]:
+        try:
+            return self.dockerData[docker_name].get('resources', {})
+        except KeyError:
+            return {}
+
+    def set_redis_settings(self, docker_name: str, settings: Dict[str, Union[str, dict]]):
+        # redis profile of the docker (see redis_profiles.py)
+        if docker_name not in self.dockerData:
+            self.dockerData[docker_name] = {}
+        self.dockerData[docker_name]['redis'] = dict(settings)
+
+    def get_redis_settings(self, docker_name: str) -> Dict[str, Union[str, dict]]:
+        try:
+            return self.dockerData[docker_name].get('redis', {})
+        except KeyError:
+            return {}
+
+    def set_proxy_settings(self, docker_name: str, settings: Dict[str, Union[str, int]]):
+        # nginx proxy settings of the routes to the docker (see nginx_util.DEFAULT_PROXY_SETTINGS)
+        if docker_name not in self.dockerData:
+            self.dockerData[docker_name] = {}
+        self.dockerData[docker_name]['proxy'] = dict(settings)
+
+    def get_proxy_settings(self, docker_name: str) -> Dict[str, Union[str, int]]:
+        try:
+            return self.dockerData[docker_name].get('proxy', {})
+        except KeyError:
+            return {}
+
+    def set_git_state(self, docker_name: str, branch: Optional[str], commit: Optional[str],
+                      short_commit: Optional[str] = None, tag: Optional[str] = None):
+        # git state at the last add/update, allows listing without inspecting the repositories
+        if docker_name not in self.dockerData:
+            self.dockerData[docker_name] = {}
+        self.dockerData[docker_name]['git'] = {
+            'branch': branch,
+            'commit': commit,
+            'short_commit': short_commit,
+            'tag': tag,
+        }
+
+    def get_git_state(self, docker_name: str) -> Dict[str, Optional[str]]:
+        try:
+            return self.dockerData[docker_name].get('git', {})
+        except KeyError:
+            return {}
+
+    def set_fingerprint(self, docker_name: str, fingerprint: Dict[str, Optional[str]]):
+        # inputs of the docker at its last successful `docker-compose up`
+        if docker_name not in self.dockerData:
+            self.dockerData[docker_name] = {}
+        self.dockerData[docker_name]['fingerprint'] = dict(fingerprint)
+
+    def get_fingerprint(self, docker_name: str) -> Dict[str, Optional[str]]:
+        try:
+            return self.dockerData[docker_name].get('fingerprint', {})
+        except KeyError:
+            return {}
+
     def export_meta(self):
         export = {
             'main': self.main,
             'docker_data': self.dockerData
         }
         if self.locations is not None:
-            export['locations'] = {path: '{loc.name}:{loc.port}'.format(loc=loc) for path, loc in
-                                   self.locations.items()}
+            export['locations'] = {loc.path: '{loc.name}:{loc.port}'.format(loc=loc) +
+                                   (':{loc.replicas}'.format(loc=loc) if loc.replicas > 1 else '')
+                                   for loc in self.locations}
         return export
 
     def set_docker_code_type(self, docker_name: str, code_type: str):
@@ -51,19 +153,15 @@ class Meta(ExportableComposePart):
             self.dockerData[docker_name] = {}
         self.dockerData[docker_name]['compile-script'] = code_type
 
-    def add_location(self, path: str, name: str, port: int):
-        self.locations[path] = ServerData(path, name, port)
+    def add_location(self, path: str, name: str, port: int, replicas: int = 1):
+        self.locations.add(ServerData(path, name, port, replicas), replace=True)
 
     def remove_all_by_server(self, server_name: str):
-        rem = [path for (path, loc) in self.locations.items() if loc.name == server_name]
-        for path in rem:
-            del self.locations[path]
+        self.locations.remove_server(server_name)
 
     def get_sorted_locations(self) -> List[ServerData]:
-        s = sorted(self.locations.values(),
-                   key=cmp_to_key(lambda l, r: 1 if l.is_more_generic(r) else -1)
-                   )
-        return s
+        # most specific path first
+        return self.locations.sorted()
 
     def get_compile_script(self, docker_name: str) -> Optional[Callable[[Path, Optional[Dict[str, str]]], Path]]:
         try:
@@ -75,6 +173,12 @@ class Meta(ExportableComposePart):
                 'frontend': compile_javascript,
                 'backend': compile_javascript,
             }  # type: Dict[str, Callable[[Path], Path]]
-            return s[self.dockerData[docker_name]['compile-script']]
+            code_type = self.dockerData[docker_name]['compile-script']
+            script = s[code_type]
         except KeyError:
-            return default_clone
+            code_type = None
+            script = default_clone
+        if code_type in FRONTEND_CODE_TYPES or docker_name == self.main:
+            # static files, compressed once at build time instead of by the proxy on every request
+            return partial(script, precompress=True)
+        return script
@@ -0,0 +1,36 @@
+import typing
+
+
+class RepoState:
+    # Snapshot of the git state of the code of a service
+    # Fields are None when git could not determine them
+    def __init__(self,
+                 branch: typing.Optional[str] = None,
+                 full_sha: typing.Optional[str] = None,
+                 short_sha: typing.Optional[str] = None,
+                 latest_tag: typing.Optional[str] = None,
+                 remote_url: typing.Optional[str] = None):
+        self.branch = branch
+        self.full_sha = full_sha
+        self.short_sha = short_sha
+        self.latest_tag = latest_tag
+        self.remote_url = remote_url
+
+    @classmethod
+    def from_output(cls, output: typing.Optional[str]) -> 'RepoState':
+        # Parses `key=value` lines as printed by the snapshot script in git_util
+        values = {}  # type: typing.Dict[str, str]
+        for line in (output if output is not None else '').splitlines():
+            line = line.strip()
+            if '=' not in line:
+                continue
+            k, v = line.split('=', 1)
+            values[k] = v
+        return cls(branch=values.get('branch'),
+                   full_sha=values.get('sha'),
+                   short_sha=values.get('short_sha'),
+                   latest_tag=values.get('tag'),
+                   remote_url=values.get('remote'))
+
+    def __str__(self):
+        return '{s.branch}:{s.short_sha}:{s.latest_tag}'.format(s=self)
@@ -0,0 +1,130 @@
+import typing
+
+from ServerData import ServerData
+
+
+class _RouteNode:
+    __slots__ = ('children', 'server')
+
+    def __init__(self):
+        self.children = {}  # type: typing.Dict[str, _RouteNode]
+        self.server = None  # type: typing.Optional[ServerData]
+
+
+class RouteIndex:
+    # Reverse proxy routes (url path -> server) stored in a trie of path segments
+    # Adding, removing and matching a path costs O(depth); removing a server costs O(depth) per path it serves
+    # Iterating gives the routes most specific first: a route always comes before every route that is a prefix of it,
+    # siblings are ordered in reverse, so `/apiv2` comes before `/api` as well.
+    def __init__(self, servers: typing.Iterable[ServerData] = ()):
+        self._root = _RouteNode()
+        self._by_name = {}  # type: typing.Dict[str, typing.Set[str]]
+        self._size = 0
+        self._order = None  # type: typing.Optional[typing.List[ServerData]]
+        for server in servers:
+            # stored routes are loaded as they are, a later duplicate wins
+            self.add(server, replace=True)
+
+    @staticmethod
+    def split(path: str) -> typing.List[str]:
+        return [segment for segment in path.split('/') if segment]
+
+    def _find(self, path: str) -> typing.Optional[_RouteNode]:
+        node = self._root
+        for segment in self.split(path):
+            node = node.children.get(segment)
+            if node is None:
+                return None
+        return node
+
+    def add(self, server: ServerData, replace: bool = False) -> None:
+        # Raises ValueError when the path (ignoring duplicate and trailing slashes) is already routed
+        node = self._root
+        for segment in self.split(server.path):
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = _RouteNode()
+            node = child
+        if node.server is not None:
+            if not replace:
+                raise ValueError('{path} already inside path'.format(path=server.path))
+            self._by_name[node.server.name].discard(node.server.path)
+            if not self._by_name[node.server.name]:
+                del self._by_name[node.server.name]
+        else:
+            self._size += 1
+        node.server = server
+        self._by_name.setdefault(server.name, set()).add(server.path)
+        self._order = None
+
+    def get(self, path: str) -> typing.Optional[ServerData]:
+        node = self._find(path)
+        return node.server if node is not None else None
+
+    def remove(self, path: str) -> typing.Optional[ServerData]:
+        # Removes the route of path, nodes left without routes are pruned
+        stack = [(None, self._root)]  # type: typing.List[typing.Tuple[typing.Optional[str], _RouteNode]]
+        for segment in self.split(path):
+            child = stack[-1][1].children.get(segment)
+            if child is None:
+                return None
+            stack.append((segment, child))
+        node = stack[-1][1]
+        server = node.server
+        if server is None:
+            return None
+        node.server = None
+        self._size -= 1
+        self._by_name[server.name].discard(server.path)
+        if not self._by_name[server.name]:
+            del self._by_name[server.name]
+        while len(stack) > 1 and stack[-1][1].server is None and not stack[-1][1].children:
+            segment, _ = stack.pop()
+            del stack[-1][1].children[segment]
+        self._order = None
+        return server
+
+    def remove_server(self, name: str) -> typing.List[ServerData]:
+        # Removes every route to the server called name
+        return [self.remove(path) for path in sorted(self._by_name.get(name, ()))]
+
+    def get_server_routes(self, name: str) -> typing.List[ServerData]:
+        # Every route to the server called name
+        return [self.get(path) for path in sorted(self._by_name.get(name, ()))]
+
+    def match(self, path: str) -> typing.Optional[ServerData]:
+        # The route with the longest (segment) prefix of path
+        node = self._root
+        found = node.server
+        for segment in self.split(path):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            if node.server is not None:
+                found = node.server
+        return found
+
+    def sorted(self) -> typing.List[ServerData]:
+        if self._order is None:
+            order = []
+            # iterative post-order walk: children (reverse sorted) before their parent
+            stack = [(self._root, False)]
+            while stack:
+                node, expanded = stack.pop()
+                if expanded:
+                    if node.server is not None:
+                        order.append(node.server)
+                    continue
+                stack.append((node, True))
+                stack.extend((node.children[k], False) for k in sorted(node.children))
+            self._order = order
+        return list(self._order)
+
+    def __iter__(self) -> typing.Iterator[ServerData]:
+        return iter(self.sorted())
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, path: str) -> bool:
+        return self.get(path) is not None
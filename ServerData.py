@@ -1,15 +1,24 @@
-import re
+import typing
 
 
 class ServerData:
     # Utility class to handle server data in docker services
-    def __init__(self, path: str, name: str, port: int):
+    # A server with replicas is served by the containers `name`, `name-2` ... `name-<replicas>`
+    def __init__(self, path: str, name: str, port: int, replicas: int = 1):
         self.path = path
         self.name = name
         self.port = port
+        self.replicas = int(replicas)
+
+    @staticmethod
+    def replica_names(name: str, replicas: int) -> typing.List[str]:
+        return [name] + ['{name}-{i}'.format(name=name, i=i) for i in range(2, replicas + 1)]
+
+    def get_endpoints(self) -> typing.List[str]:
+        return ServerData.replica_names(self.name, self.replicas)
 
     def __str__(self):
+        if self.replicas > 1:
+            return '{path}:{name}:{port}:{replicas}'.format(path=self.path, name=self.name, port=self.port,
+                                                            replicas=self.replicas)
         return '{path}:{name}:{port}'.format(path=self.path, name=self.name, port=self.port)
-
-    def is_more_generic(self, other_data: 'ServerData'):
-        return re.match(self.path, other_data.path) is not None
@@ -0,0 +1,353 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing
+from pathlib import Path
+
+from tabulate import tabulate
+
+
+# Measures the commands of the manager (create, add, update, reload, ls) on synthetic projects without docker
+# `sudo`, `docker` and `docker-compose` are replaced by stand-ins (benchmarks/fake_docker.py) with configurable
+# latencies, git runs on the host (`--git-backend host`) against local repositories.
+# Every command runs in a process of its own, like on the command line. Reported per command: wall time,
+# interpreter startup and imports, time spent in python and waiting on subprocesses, the number of subprocesses
+# and a breakdown over the phases of main.py (subprocess time of a phase is summed over its threads).
+# Run from the repository root: `python -m benchmarks.commands --services 1 10 100 500`
+
+COMMANDS = ('create', 'add', 'update', 'reload', 'ls')
+ROOT = Path(__file__).resolve().parent.parent
+
+# functions of main.py (and util.load) timed as phase, everything else of a command is `other`
+PHASES = (
+    ('parse_input', 'parse'),
+    ('create_helper', 'command'),
+    ('add_helper', 'command'),
+    ('update_helper', 'command'),
+    ('reload_helper', 'command'),
+    ('list_docker_helper', 'command'),
+    ('write', 'write'),
+    ('compose_up_changed', 'launch'),
+    ('plan_compose_up', 'plan'),
+    ('docker_compose_up', 'compose up'),
+    ('refresh_reverse_proxy', 'proxy refresh'),
+)
+
+
+def call_kind(argv: typing.Union[str, typing.Sequence[str]]) -> str:
+    # `docker inspect`, `docker-compose up`, `git (host)`... of the arguments of a subprocess
+    argv = argv.split() if isinstance(argv, str) else [str(a) for a in argv]
+    if argv[:1] == ['sudo']:
+        argv = argv[1:]
+    if not argv:
+        return 'unknown'
+    tool = os.path.basename(argv[0])
+    words = [a for a in argv[1:] if not a.startswith('-')]
+    if tool == 'sh':
+        # the host git backend runs its git commands as shell scripts
+        return 'git (host)'
+    if tool == 'docker' and words[:1] in (['image'], ['network'], ['container']):
+        return 'docker {words}'.format(words=' '.join(words[:2]))
+    if tool in ('docker', 'docker-compose'):
+        return '{tool} {command}'.format(tool=tool, command=words[0] if words else '')
+    return tool
+
+
+class Recorder:
+    # Attributes the time of a command to the phase the main thread is in, and every subprocess
+    # (of any thread) to the phase the main thread was in when it started
+    def __init__(self, start: float):
+        self.start = start
+        self.switched = start
+        self.stack = ['other']
+        self.phases = {}  # type: typing.Dict[str, float]
+        self.calls = []  # type: typing.List[typing.List[typing.Union[str, float]]]
+        self.lock = threading.Lock()
+
+    def switch(self, now: float) -> None:
+        phase = self.stack[-1]
+        self.phases[phase] = self.phases.get(phase, 0) + now - self.switched
+        self.switched = now
+
+    def wrap(self, module: typing.Any, attribute: str, phase: str) -> None:
+        original = getattr(module, attribute)
+
+        def wrapper(*args, **kwargs):
+            if threading.current_thread() is not threading.main_thread():
+                return original(*args, **kwargs)
+            self.switch(time.perf_counter())
+            self.stack.append(phase)
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.switch(time.perf_counter())
+                self.stack.pop()
+
+        setattr(module, attribute, wrapper)
+
+    def wrap_subprocess(self) -> None:
+        # check_output and call go through subprocess.run as well
+        original = subprocess.run
+
+        def run(*args, **kwargs):
+            phase = self.stack[-1]
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                with self.lock:
+                    self.calls.append([phase, call_kind(kwargs.get('args', args[0] if args else [])),
+                                       start - self.start, end - self.start])
+
+        subprocess.run = run
+
+
+def run_child(result_file: Path, argv: typing.List[str]) -> None:
+    # Runs main.py with argv inside this process and writes the measurements to result_file
+    start = time.perf_counter()
+    import main as manager
+    import util
+    imported = time.perf_counter()
+
+    recorder = Recorder(imported)
+    recorder.wrap_subprocess()
+    recorder.wrap(util, 'load', 'load')
+    for attribute, phase in PHASES:
+        recorder.wrap(manager, attribute, phase)
+
+    sys.argv = ['main.py', *argv]
+    output = io.StringIO()
+    error = None
+    try:
+        with contextlib.redirect_stdout(output):
+            manager.main()
+    except BaseException as err:
+        error = '{name}: {err}'.format(name=type(err).__name__, err=err)
+    finished = time.perf_counter()
+    recorder.switch(finished)
+    with open(result_file.as_posix(), 'w') as f:
+        json.dump({
+            'import': imported - start,
+            'run': finished - imported,
+            'phases': recorder.phases,
+            'calls': recorder.calls,
+            'error': error,
+            'output': output.getvalue() if error is not None else '',
+        }, f)
+
+
+def write_shims(bin_dir: Path) -> None:
+    # sudo runs the command as is, docker and docker-compose are the stand-ins
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    scripts = {'sudo': '#!/bin/sh\nexec "$@"\n'}
+    for tool in ('docker', 'docker-compose'):
+        scripts[tool] = '#!{python} -I\n' \
+                        'import sys\n' \
+                        'sys.path.insert(0, {root!r})\n' \
+                        'from benchmarks.fake_docker import main\n' \
+                        'main({tool!r})\n'.format(python=sys.executable, root=ROOT.as_posix(), tool=tool)
+    for name, script in scripts.items():
+        (bin_dir / name).write_text(script)
+        (bin_dir / name).chmod(0o755)
+
+
+def make_repository(location: Path, files: typing.Dict[str, str]) -> str:
+    # Bare repository with a `production` branch and a tag, returns its url
+    work = location.with_name(location.name + '-work')
+    work.mkdir(parents=True)
+    for fname, contents in files.items():
+        (work / fname).write_text(contents)
+    git = ['git', '-c', 'user.name=bench', '-c', 'user.email=bench@localhost']
+    subprocess.run([*git, 'init', '-q', '-b', 'production'], cwd=work.as_posix(), check=True)
+    subprocess.run([*git, 'add', '.'], cwd=work.as_posix(), check=True)
+    subprocess.run([*git, 'commit', '-q', '-m', 'initial'], cwd=work.as_posix(), check=True)
+    subprocess.run([*git, 'tag', 'v1.0.0'], cwd=work.as_posix(), check=True)
+    subprocess.run([*git, 'clone', '-q', '--bare', work.as_posix(), location.as_posix()], check=True)
+    shutil.rmtree(work.as_posix())
+    return 'file://' + location.as_posix()
+
+
+def environment(directory: Path, bin_dir: Path, args: argparse.Namespace) -> typing.Dict[str, str]:
+    # Caches and the state of the stand-ins live in directory, so every project size starts cold
+    return {
+        'PATH': bin_dir.as_posix() + os.pathsep + os.environ.get('PATH', ''),
+        'MANAGER_FAKE_STATE': (directory / 'docker').as_posix(),
+        'MANAGER_FAKE_LATENCY': str(args.latency),
+        'MANAGER_FAKE_BUILD_LATENCY': str(args.build_latency),
+        'MANAGER_FAKE_UP_LATENCY': str(args.up_latency),
+        'MANAGER_GIT_BACKEND': 'host',
+        'MANAGER_DOCKER_BACKEND': 'cli',
+        'MANAGER_GIT_MIRRORS': (directory / 'git-mirrors').as_posix(),
+        'MANAGER_BUILD_CACHE': (directory / 'build-cache').as_posix(),
+        'MANAGER_DEPS_CACHE': (directory / 'deps-cache').as_posix(),
+        'MANAGER_COMPOSE_CACHE': (directory / 'compose-cache').as_posix(),
+        'MANAGER_CONTEXT_HASHES': (directory / 'context-hashes').as_posix(),
+    }
+
+
+def populate(directory: Path, services: int, url: str) -> None:
+    # Adds `services` backends to the group created in directory, as if they were added and started one by one
+    # The repository modules are imported here, after the environment points their caches to the benchmark
+    import main as manager
+    import util
+    from DockerService import DockerService
+    from benchmarks.fake_docker import start_services
+    from builders import make_node_dockerfile
+    from commands.build_helper import build_reverse_proxy
+    from compose_fingerprint import plan_compose_up
+    from git_util import get_repo_state
+
+    basename = directory.parts[-1]
+    compose = util.load(directory / 'docker-compose.yml', '{basename}.nginx'.format(basename=basename))
+    checkout = directory.parent / 'checkout'
+    subprocess.run(['git', 'clone', '-q', '--depth', '1', '--branch', 'production', url, checkout.as_posix()],
+                   check=True)
+    for i in range(services):
+        name = 'service{i}'.format(i=i)
+        fullname = '{basename}.{name}'.format(basename=basename, name=name)
+        (directory / fullname).mkdir()
+        make_node_dockerfile(directory, fullname, '18', quiet=True)
+        shutil.copytree(checkout.as_posix(), (directory / fullname / 'javascript').as_posix(), symlinks=True)
+        state = get_repo_state(directory, fullname)
+        compose.add_server(['/api/{name}'.format(name=name)], fullname, 1337)
+        compose.services[fullname] = DockerService.generate_empty(basename, name, {'environment': [
+            'GIT_BRANCH={branch}'.format(branch=state.branch),
+            'GIT_COMMIT={commit}'.format(commit=state.full_sha),
+        ]})
+        compose.meta.set_docker_code_type(fullname, 'node')
+        compose.meta.set_node_version(fullname, '18')
+        compose.meta.set_git_state(fullname, state.branch, state.full_sha, state.short_sha, state.latest_tag)
+    shutil.rmtree(checkout.as_posix())
+    build_reverse_proxy(compose, directory, 'portal', quiet=True)
+    _, _, fingerprints = plan_compose_up(compose, directory, None)
+    for name, fingerprint in fingerprints.items():
+        compose.meta.set_fingerprint(name, fingerprint)
+    manager.write(directory / 'docker-compose.yml', compose)
+    start_services(directory)
+
+
+def command_arguments(command: str, directory: Path, urls: typing.Dict[str, str]) -> typing.List[str]:
+    common = [directory.as_posix(), '-q', '--git-backend', 'host', '--docker-backend', 'cli']
+    return common + {
+        'create': ['create', urls['frontend'], '--branch', 'production'],
+        'add': ['add', 'added', urls['backend'], '--branch', 'production'],
+        'update': ['update', 'service0'],
+        'reload': ['reload', 'service0', '-e', 'BENCHMARK_RELOAD=1'],
+        'ls': ['ls'],
+    }[command]
+
+
+def run_command(command: str, directory: Path, urls: typing.Dict[str, str], env: typing.Dict[str, str]) -> dict:
+    with tempfile.NamedTemporaryFile(suffix='.json') as result_file:
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-m', 'benchmarks.commands', '--child', result_file.name,
+                               *command_arguments(command, directory, urls)],
+                              cwd=ROOT.as_posix(), env={**os.environ, **env},
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        wall = time.perf_counter() - start
+        try:
+            result = json.load(result_file)
+        except ValueError:
+            result = {'error': 'exited with {code}'.format(code=proc.returncode)}
+    if result['error'] is not None:
+        raise RuntimeError('{command} failed: {error}\n{output}{child}'.format(
+            command=command, error=result['error'], output=result.get('output', ''), child=proc.stdout))
+    result['wall'] = wall
+    return result
+
+
+def subprocess_time(calls: typing.Sequence[typing.Sequence]) -> float:
+    # Time at least one subprocess was running, concurrent calls are counted once
+    total = 0.0
+    end = None
+    for _, _, call_start, call_end in sorted(calls, key=lambda c: c[2]):
+        if end is None or call_start > end:
+            total += call_end - call_start
+            end = call_end
+        elif call_end > end:
+            total += call_end - end
+            end = call_end
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the commands against stand-in docker executables')
+    parser.add_argument('--services', type=int, nargs='+', default=[1, 10, 100, 500],
+                        help='Number of backends of the synthetic projects')
+    parser.add_argument('--commands', nargs='+', choices=COMMANDS, default=list(COMMANDS))
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds of every docker/docker-compose call')
+    parser.add_argument('--build-latency', type=float, default=0.1,
+                        help='Seconds of a build: docker build, attached docker run and per service built by up')
+    parser.add_argument('--up-latency', type=float, default=0.05, help='Seconds per service started by up')
+    parser.add_argument('--calls', action='store_true', default=False, help='Also list the subprocesses by kind')
+    args = parser.parse_args()
+
+    rows = []
+    phase_rows = []
+    call_rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp).resolve()
+        bin_dir = tmp / 'bin'
+        write_shims(bin_dir)
+        urls = {
+            'frontend': make_repository(tmp / 'repositories' / 'frontend.git', {
+                'package.json': '{"name": "frontend", "scripts": {"build": "true"}}\n',
+                'index.html': '<html><body>frontend</body></html>\n',
+            }),
+            'backend': make_repository(tmp / 'repositories' / 'backend.git', {
+                'package.json': '{"name": "backend", "scripts": {"build": "true"}}\n',
+                'index.js': 'module.exports = {};\n',
+            }),
+        }
+        for count in args.services:
+            directory = tmp / str(count) / 'benchproject'
+            env = environment(tmp / str(count), bin_dir, args)
+            os.environ.update(env)
+            results = {'create': run_command('create', directory, urls, env)}
+            populate(directory, count, urls['backend'])
+            for command in args.commands:
+                if command != 'create':
+                    results[command] = run_command(command, directory, urls, env)
+
+            for command in args.commands:
+                result = results[command]
+                waiting = subprocess_time(result['calls'])
+                rows.append([count, command, '{t:.3f}'.format(t=result['wall']),
+                             '{t:.3f}'.format(t=result['wall'] - result['run']),
+                             '{t:.3f}'.format(t=result['run'] - waiting), '{t:.3f}'.format(t=waiting),
+                             len(result['calls'])])
+                for phase, seconds in sorted(result['phases'].items(), key=lambda p: -p[1]):
+                    calls = [c for c in result['calls'] if c[0] == phase]
+                    phase_rows.append([count, command, phase, '{t:.1f}'.format(t=seconds * 1000), len(calls),
+                                       '{t:.1f}'.format(t=sum(c[3] - c[2] for c in calls) * 1000)])
+                kinds = {}  # type: typing.Dict[str, typing.List[float]]
+                for _, kind, call_start, call_end in result['calls']:
+                    kinds.setdefault(kind, []).append(call_end - call_start)
+                for kind, durations in sorted(kinds.items()):
+                    call_rows.append([count, command, kind, len(durations),
+                                      '{t:.1f}'.format(t=sum(durations) * 1000)])
+
+    print(tabulate(rows, headers=['services', 'command', 'wall (s)', 'startup (s)', 'python (s)',
+                                  'subprocesses (s)', 'subprocesses']))
+    print()
+    print(tabulate(phase_rows, headers=['services', 'command', 'phase', 'time (ms)', 'subprocesses',
+                                        'subprocess time (ms)']))
+    if args.calls:
+        print()
+        print(tabulate(call_rows, headers=['services', 'command', 'call', 'count', 'time (ms)']))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        run_child(Path(sys.argv[2]), sys.argv[3:])
+    else:
+        main()
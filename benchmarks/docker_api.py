@@ -0,0 +1,111 @@
+import argparse
+import http.server
+import json
+import os
+import socketserver
+import tempfile
+import threading
+import time
+import typing
+
+from tabulate import tabulate
+
+import docker_util
+
+
+# Measures the per-call overhead of the docker backends
+# The api backend is measured against a fake Docker Engine served on a temporary unix socket,
+# the cli backend (`--cli`) needs a real docker and a container to inspect (`--container`).
+# Run from the repository root: `python -m benchmarks.docker_api --calls 200`
+
+
+FAKE_CONTAINER = {
+    'Id': 'f' * 64,
+    'Name': '/bench.container',
+    'State': {'Status': 'running', 'Running': True, 'ExitCode': 0},
+    'Mounts': [{'Destination': '/git'}],
+    'NetworkSettings': {'Networks': {'bench_default': {}}},
+}
+FAKE_NETWORK = {'Name': 'bench_default', 'Containers': {'f' * 64: {'Name': 'bench.container'}}}
+
+
+class FakeEngineHandler(http.server.BaseHTTPRequestHandler):
+    # Answers the few endpoints used by docker_util, keeping connections alive like the real daemon
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status: int, data: typing.Any = None):
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path.startswith('/containers/') and path.endswith('/json'):
+            self.send_json(200, FAKE_CONTAINER)
+        elif path.startswith('/networks/'):
+            self.send_json(200, FAKE_NETWORK)
+        else:
+            self.send_json(404, {'message': 'No such object'})
+
+    def do_DELETE(self):
+        self.send_json(204)
+
+    def do_POST(self):
+        self.send_json(200, {'StatusCode': 0})
+
+
+class FakeEngine(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def start_fake_engine(socket_path: str) -> FakeEngine:
+    server = FakeEngine(socket_path, FakeEngineHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_backend(backend: str, container: str, calls: int) -> typing.List[typing.Any]:
+    docker_util.set_docker_backend(backend)
+    start = time.perf_counter()
+    for _ in range(calls):
+        docker_util.get_status(container)
+    status_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(calls):
+        docker_util.get_networks_from_container(container)
+    networks_time = time.perf_counter() - start
+    return [backend, calls,
+            '{t:.2f}'.format(t=status_time / calls * 1000),
+            '{t:.2f}'.format(t=networks_time / calls * 1000)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--cli', action='store_true', help='Also measure the cli backend against the real docker')
+    parser.add_argument('--container', default='bench.container', help='Container inspected by the cli backend')
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = os.path.join(directory, 'docker.sock')
+        server = start_fake_engine(socket_path)
+        try:
+            docker_util.set_docker_backend('api', socket_path)
+            rows.append(bench_backend('api', 'bench.container', args.calls))
+        finally:
+            server.shutdown()
+            server.server_close()
+    if args.cli:
+        rows.append(bench_backend('cli', args.container, max(1, args.calls // 10)))
+    print(tabulate(rows, headers=['backend', 'calls', 'status ms/call', 'networks ms/call']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import sys
+import time
+import typing
+from pathlib import Path
+
+
+# Stand-in for the docker and docker-compose command line tools, used by benchmarks.commands
+# The commands of the manager run against it without a docker daemon: containers and images are files in
+# $MANAGER_FAKE_STATE, every call sleeps a configurable latency (seconds):
+#   MANAGER_FAKE_LATENCY:        every call
+#   MANAGER_FAKE_BUILD_LATENCY:  `docker build`, attached `docker run` (builds, git) and per service of `up --build`
+#   MANAGER_FAKE_UP_LATENCY:     per service started by `docker-compose up`
+# Every call also costs the startup of the interpreter, about what the docker cli itself costs.
+# benchmarks.commands writes the `sudo`, `docker` and `docker-compose` executables calling main() into a bin
+# directory in front of PATH.
+
+
+def _latency(name: str) -> float:
+    return float(os.environ.get(name, '0') or 0)
+
+
+def _state_dir(kind: str) -> Path:
+    location = Path(os.environ['MANAGER_FAKE_STATE']) / kind
+    location.mkdir(parents=True, exist_ok=True)
+    return location
+
+
+def _entry(kind: str, ident: str) -> Path:
+    return _state_dir(kind) / hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+
+def _object_id(ident: str) -> str:
+    return 'sha256:' + hashlib.sha256(ident.encode('utf-8')).hexdigest()
+
+
+def _now() -> str:
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000000000Z', time.gmtime())
+
+
+def _store(kind: str, ident: str, data: dict) -> None:
+    # written atomically, commands inspect while other threads start containers
+    location = _entry(kind, ident)
+    tmp = location.with_name('{name}.{pid}'.format(name=location.name, pid=os.getpid()))
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp.as_posix(), location.as_posix())
+
+
+def _load(kind: str, ident: str) -> typing.Optional[dict]:
+    try:
+        return json.loads(_entry(kind, ident).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def start_container(name: str, image: str, mounts: typing.Iterable[str] = ()) -> None:
+    _store('containers', name, {
+        'Id': _object_id(name + _now()),
+        'Name': '/' + name,
+        'Image': _object_id(image),
+        'State': {'Status': 'running', 'Running': True, 'ExitCode': 0, 'StartedAt': _now()},
+        'Mounts': [{'Destination': m} for m in mounts],
+        'NetworkSettings': {'Networks': {}},
+    })
+    store_image(image)
+
+
+def store_image(image: str) -> None:
+    data = {'Id': _object_id(image), 'RepoTags': [image], 'Created': _now()}
+    _store('images', image, data)
+    _store('images', data['Id'], data)
+
+
+def _volume_target(volume: typing.Union[str, dict]) -> typing.Optional[str]:
+    if isinstance(volume, dict):
+        return volume.get('target')
+    parts = volume.split(':')
+    return parts[1] if len(parts) > 1 else parts[0]
+
+
+def _options(args: typing.Sequence[str],
+             value_flags: typing.Sequence[str] = (),
+             interspersed: bool = False) -> (typing.Dict[str, typing.List[str]], typing.List[str]):
+    # `--key=value` and `-k value` (value_flags) options and the remaining arguments
+    # Flags are kept as options without value, options stop at the first argument unless interspersed
+    options = {}  # type: typing.Dict[str, typing.List[str]]
+    rest = []
+    it = iter(args)
+    for arg in it:
+        if arg.startswith('-') and (interspersed or not rest):
+            key, _, value = arg.lstrip('-').partition('=')
+            if arg in value_flags:
+                value = next(it, '')
+            options.setdefault(key, []).append(value)
+        else:
+            rest.append(arg)
+    return options, rest
+
+
+def inspect(args: typing.Sequence[str], object_type: str = None) -> int:
+    options, idents = _options(args, interspersed=True)
+    object_type = options.get('type', [object_type or 'container'])[-1]
+    found = []
+    missing = False
+    for ident in idents:
+        data = _load({'container': 'containers', 'image': 'images', 'network': 'networks'}[object_type], ident)
+        if data is None and object_type == 'network':
+            data = {'Name': ident, 'Containers': {}}
+        if data is None:
+            print('Error: No such object: {ident}'.format(ident=ident), file=sys.stderr)
+            missing = True
+        else:
+            found.append(data)
+    if 'format' in options:
+        # the repository is on the path of the executables, the templates are rendered like docker_util does
+        from docker_util import render_go_template
+        for data in found:
+            print(render_go_template(options['format'][-1], data))
+    else:
+        print(json.dumps(found, indent=4))
+    return 1 if missing else 0
+
+
+def run(args: typing.Sequence[str]) -> int:
+    options, rest = _options(args, ('-e',))
+    image = rest[0] if rest else 'unknown'
+    if 'd' in options or 'detach' in options:
+        name = options.get('name', ['fake-{id}'.format(id=os.getpid())])[-1]
+        start_container(name, image, (_volume_target(v) for v in options.get('volume', [])))
+        print(_object_id(name)[7:])
+    else:
+        time.sleep(_latency('MANAGER_FAKE_BUILD_LATENCY'))
+    return 0
+
+
+def docker(args: typing.List[str]) -> int:
+    options, rest = _options(args)
+    if not rest:
+        return 0
+    command, args = rest[0], rest[1:]
+    if command in ('image', 'network', 'container') and args:
+        if args[0] == 'inspect':
+            return inspect(args[1:], command)
+        if command == 'network' and args[0] == 'ls':
+            return 0
+        command, args = args[0], args[1:]
+    if command == 'inspect':
+        return inspect(args)
+    if command == 'run':
+        return run(args)
+    if command == 'build':
+        options, _ = _options(args[1:], ('-t',), interspersed=True)
+        time.sleep(_latency('MANAGER_FAKE_BUILD_LATENCY'))
+        tag = options.get('t', ['fake-image'])[-1]
+        store_image(tag)
+        print(_object_id(tag))
+        return 0
+    if command == 'exec':
+        options, rest = _options(args, ('-e',))
+        if not rest or _load('containers', rest[0]) is None:
+            print('Error: No such container: {name}'.format(name=rest[0] if rest else ''), file=sys.stderr)
+            return 1
+        if rest[1:3] == ['redis-cli', 'ping']:
+            print('PONG')
+        return 0
+    if command == 'rm':
+        missing = False
+        for name in (a for a in args if not a.startswith('-')):
+            try:
+                os.remove(_entry('containers', name).as_posix())
+            except FileNotFoundError:
+                missing = True
+        return 1 if missing else 0
+    if command == 'wait':
+        for _ in args:
+            print(0)
+        return 0
+    # pull, network create/rm...
+    return 0
+
+
+def start_services(directory: Path, names: typing.Sequence[str] = ()) -> typing.List[str]:
+    # Starts the named services (all when none are named) of the docker-compose.yml in directory
+    import yaml
+    with open((directory / 'docker-compose.yml').as_posix(), 'r') as f:
+        services = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader)).get('services', {})
+    names = list(names) or list(services)
+    for name in names:
+        service = services.get(name, {})
+        start_container(service.get('container_name', name),
+                        service.get('image', '{project}_{name}'.format(project=directory.name, name=name)),
+                        (_volume_target(v) for v in service.get('volumes', [])))
+    return names
+
+
+def docker_compose(args: typing.List[str]) -> int:
+    # Only `up`, from ./docker-compose.yml
+    options, rest = _options(args)
+    if not rest or rest[0] != 'up':
+        return 0
+    options, names = _options(rest[1:])
+    names = start_services(Path.cwd(), names)
+    time.sleep((_latency('MANAGER_FAKE_UP_LATENCY') +
+                (_latency('MANAGER_FAKE_BUILD_LATENCY') if 'build' in options else 0)) * len(names))
+    return 0
+
+
+def main(tool: str) -> None:
+    time.sleep(_latency('MANAGER_FAKE_LATENCY'))
+    args = sys.argv[1:]
+    sys.exit(docker_compose(args) if tool == 'docker-compose' else docker(args))
+
+
+if __name__ == '__main__':
+    main(sys.argv.pop(1))
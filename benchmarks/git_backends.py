@@ -0,0 +1,93 @@
+import argparse
+import subprocess
+import tempfile
+import time
+import typing
+from pathlib import Path
+
+from tabulate import tabulate
+
+import git_util
+
+
+# Compares the git backends on a synthetic project with many services
+# Run from the repository root: `python -m benchmarks.git_backends --services 20 run exec host`
+
+
+def make_project(directory: Path, services: int) -> typing.List[str]:
+    # Creates `services` service directories each containing a small git repository in `javascript`
+    names = []
+    basename = directory.parts[-1]
+    for i in range(services):
+        fullname = '{basename}.service{i}'.format(basename=basename, i=i)
+        location = directory / fullname / 'javascript'
+        location.mkdir(parents=True)
+        subprocess.run(['git', 'init', '-q', '-b', 'production'], cwd=location.as_posix(), check=True)
+        (location / 'index.js').write_text('module.exports = {i};\n'.format(i=i))
+        subprocess.run(['git', 'add', '.'], cwd=location.as_posix(), check=True)
+        subprocess.run(['git', '-c', 'user.name=bench', '-c', 'user.email=bench@localhost',
+                        'commit', '-q', '-m', 'initial'], cwd=location.as_posix(), check=True)
+        subprocess.run(['git', 'tag', 'v{i}'.format(i=i)], cwd=location.as_posix(), check=True)
+        subprocess.run(['git', 'remote', 'add', 'origin', 'ssh://git@example.com/service{i}.git'.format(i=i)],
+                       cwd=location.as_posix(), check=True)
+        names.append(fullname)
+    return names
+
+
+def bench_backend(backend: str, directory: Path, names: typing.List[str]) -> typing.List[typing.Any]:
+    git_util.set_git_backend(backend)
+    start = time.perf_counter()
+    for name in names:
+        # what `ls` asks per service
+        git_util.get_current_branch_name(directory, name)
+        git_util.get_current_short_commit_sha(directory, name)
+    ls_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for name in names:
+        # what `add`/`update` ask per service after loading the code
+        git_util.get_current_branch_name(directory, name)
+        git_util.get_latest_tag(directory, name)
+        git_util.get_current_full_commit_sha(directory, name)
+    add_time = time.perf_counter() - start
+    calls = 5 * len(names)
+
+    start = time.perf_counter()
+    for name in names:
+        # all of the above in a single invocation
+        git_util.get_repo_state(directory, name)
+    state_time = time.perf_counter() - start
+    return [backend, '{t:.3f}'.format(t=ls_time), '{t:.3f}'.format(t=add_time),
+            '{t:.1f}'.format(t=1000 * (ls_time + add_time) / calls), '{t:.3f}'.format(t=state_time)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark git backends')
+    # checked after parsing: python 3.11 validates the default (or empty list) of `nargs='*'` against choices
+    parser.add_argument('backends', nargs='*', default=None,
+                        help='Backends to compare: {backends} (default: all)'
+                        .format(backends=', '.join(git_util.GIT_BACKENDS)))
+    parser.add_argument('--services', type=int, default=20, help='Number of services in the synthetic project')
+    args = parser.parse_args()
+    unknown = [b for b in args.backends or [] if b not in git_util.GIT_BACKENDS]
+    if unknown:
+        parser.error('invalid backends {unknown} (choose from {backends})'
+                     .format(unknown=', '.join(unknown), backends=', '.join(git_util.GIT_BACKENDS)))
+    if not args.backends:
+        args.backends = list(git_util.GIT_BACKENDS)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp).resolve() / 'benchproject'
+        names = make_project(directory, args.services)
+        data = []
+        try:
+            for backend in args.backends:
+                data.append(bench_backend(backend, directory, names))
+        finally:
+            if 'exec' in args.backends:
+                git_util.stop_git_worker(directory)
+    print(tabulate(data, headers=['backend', 'ls (s)', 'add/update (s)', 'per call (ms)', 'snapshot (s)']))
+
+
+if __name__ == "__main__":
+    main()
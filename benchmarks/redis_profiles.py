@@ -0,0 +1,54 @@
+import argparse
+import shutil
+import tempfile
+import typing
+from pathlib import Path
+
+from tabulate import tabulate
+
+import redis_profiles
+from resources import format_size, host_resources
+
+
+# Smoke test of the generated redis configurations: starts redis with each profile (or the configuration of a group)
+# and runs redis-benchmark against it, reporting requests per second and the settings redis actually runs with.
+# Needs docker. Run from the repository root: `python -m benchmarks.redis_profiles --profiles cache session`
+# or for an existing group: `python -m benchmarks.redis_profiles --group dockers/testproject/testproject.redis`
+
+
+def render_profile(directory: Path, profile: str, memory_limit: int, cores: int) -> Path:
+    redis_dir = directory / profile
+    shutil.copytree('redis-template', redis_dir.as_posix())
+    settings = redis_profiles.get_redis_settings({'profile': profile})
+    redis_profiles.write_redis_conf(redis_dir, redis_profiles.redis_directives(settings, memory_limit, cores))
+    return redis_dir
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profiles', nargs='+', choices=list(redis_profiles.REDIS_PROFILES),
+                        default=list(redis_profiles.REDIS_PROFILES))
+    parser.add_argument('--group', type=Path, help='Redis directory of a group, instead of the profiles')
+    parser.add_argument('--memory', default=None, help='Memory limit of the container (default as generated)')
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    cores, memory = host_resources()
+    memory_limit = redis_profiles.default_memory_limit(memory)
+    rows = []  # type: typing.List[typing.List[typing.Union[str, float]]]
+    with tempfile.TemporaryDirectory() as directory:
+        if args.group is not None:
+            targets = [(args.group.name, args.group)]
+        else:
+            targets = [(p, render_profile(Path(directory), p, memory_limit, cores)) for p in args.profiles]
+        for name, redis_dir in targets:
+            results = redis_profiles.smoke_test(redis_dir, args.requests, args.memory or format_size(memory_limit))
+            rows.append([name, *(results.get(t, '') for t in ('SET', 'GET', 'INCR', 'LPUSH')),
+                         results['maxmemory'], results['maxmemory-policy'], results['appendonly'],
+                         results['io-threads']])
+    print(tabulate(rows, headers=['profile', 'SET/s', 'GET/s', 'INCR/s', 'LPUSH/s', 'maxmemory', 'policy',
+                                  'appendonly', 'io-threads']))
+
+
+if __name__ == '__main__':
+    main()
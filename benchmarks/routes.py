@@ -0,0 +1,102 @@
+import argparse
+import random
+import re
+import time
+import typing
+from functools import cmp_to_key
+
+from tabulate import tabulate
+
+from RouteIndex import RouteIndex
+from ServerData import ServerData
+
+
+# Compares the route index with the previous list based route handling for 1k - 10k routes
+# The previous implementation inserts with a linear scan of regex matches and sorts with cmp_to_key,
+# it is only measured up to --legacy-max routes since inserting is quadratic.
+# Run from the repository root: `python -m benchmarks.routes --routes 1000 5000 10000`
+
+
+def make_routes(count: int, seed: int = 0) -> typing.List[ServerData]:
+    rnd = random.Random(seed)
+    words = ['api', 'v1', 'v2', 'users', 'orders', 'static', 'admin', 'reports', 'files', 'search']
+    paths = set()
+    while len(paths) < count:
+        depth = rnd.randint(1, 4)
+        paths.add('/' + '/'.join('{w}{n}'.format(w=rnd.choice(words), n=rnd.randint(0, 30)) for _ in range(depth)))
+    return [ServerData(path, 'service{i}'.format(i=i % 50), 1337) for i, path in enumerate(sorted(paths))]
+
+
+def legacy_is_more_generic(server: ServerData, other: ServerData) -> bool:
+    return re.match(server.path, other.path) is not None
+
+
+def legacy_add(servers: typing.List[ServerData], new_data: ServerData) -> None:
+    try:
+        ind, v = next((ind, v) for ind, v in enumerate(servers) if legacy_is_more_generic(v, new_data))
+        if v.path == new_data.path:
+            raise ValueError('{path} already inside path'.format(path=new_data.path))
+        servers.insert(ind, new_data)
+    except StopIteration:
+        servers.append(new_data)
+
+
+def bench_index(routes: typing.List[ServerData]) -> typing.Tuple[float, float, float]:
+    start = time.perf_counter()
+    index = RouteIndex()
+    for route in routes:
+        index.add(route)
+    add_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index.sorted()
+    sort_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(50):
+        index.remove_server('service{i}'.format(i=i))
+    remove_time = time.perf_counter() - start
+    return add_time, sort_time, remove_time
+
+
+def bench_legacy(routes: typing.List[ServerData]) -> typing.Tuple[float, float, float]:
+    start = time.perf_counter()
+    servers = []  # type: typing.List[ServerData]
+    for route in routes:
+        legacy_add(servers, route)
+    add_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sorted(servers, key=cmp_to_key(lambda l, r: 1 if legacy_is_more_generic(l, r) else -1))
+    sort_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(50):
+        name = 'service{i}'.format(i=i)
+        servers = [s for s in servers if s.name != name]
+    remove_time = time.perf_counter() - start
+    return add_time, sort_time, remove_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--routes', type=int, nargs='+', default=[1000, 5000, 10000])
+    parser.add_argument('--legacy-max', type=int, default=1000)
+    args = parser.parse_args()
+
+    rows = []
+    for count in args.routes:
+        routes = make_routes(count)
+        random.Random(1).shuffle(routes)
+        implementations = [('index', bench_index)]
+        if count <= args.legacy_max:
+            implementations.append(('legacy', bench_legacy))
+        for name, bench in implementations:
+            add_time, sort_time, remove_time = bench(routes)
+            rows.append([count, name, '{t:.1f}'.format(t=add_time * 1000), '{t:.1f}'.format(t=sort_time * 1000),
+                         '{t:.1f}'.format(t=remove_time * 1000)])
+    print(tabulate(rows, headers=['routes', 'implementation', 'add all (ms)', 'sort (ms)', 'remove 50 servers (ms)']))
+
+
+if __name__ == '__main__':
+    main()
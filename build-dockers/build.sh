@@ -0,0 +1,55 @@
+#!/bin/sh
+# Builds the project mounted in /javascript into /javascript/build
+# The node_modules trees (development and production) are restored from /deps-cache
+# when the lockfile, node version and platform did not change, instead of installing them again.
+# The outcome per install is written to /javascript/.deps-cache-report as `<stage> <hit|miss|none> [key]`
+set -e
+
+DEPS_CACHE=/deps-cache
+REPORT=/javascript/.deps-cache-report
+
+if [ -f /etc/alpine-release ]; then platform=alpine; else platform=debian; fi
+echo "building from $platform"
+rm -f "$REPORT"
+
+deps_key() {
+    { cat package-lock.json; node -v; uname -m; echo "$platform"; echo "$1"; } | sha256sum | cut -d ' ' -f 1
+}
+
+# install_deps <stage> <npm command...>
+install_deps() {
+    stage=$1
+    shift
+    if [ ! -d "$DEPS_CACHE" ] || [ ! -f package-lock.json ]; then
+        "$@"
+        echo "$stage none" >> "$REPORT"
+        return
+    fi
+    key=$(deps_key "$stage")
+    entry="$DEPS_CACHE/$key"
+    if [ -d "$entry/node_modules" ]; then
+        rm -rf node_modules
+        cp -a "$entry/node_modules" node_modules
+        touch "$entry/manager-last-used"
+        echo "$stage hit $key" >> "$REPORT"
+    else
+        "$@"
+        tmp="$DEPS_CACHE/$key.tmp-$$"
+        rm -rf "$tmp"
+        mkdir -p "$tmp"
+        { cp -a node_modules "$tmp/node_modules" && touch "$tmp/manager-last-used" && [ ! -d "$entry" ] && mv "$tmp" "$entry"; } || rm -rf "$tmp"
+        echo "$stage miss $key" >> "$REPORT"
+    fi
+}
+
+chown -R node:node "/root/.npm"
+chown -R node:node .
+rm -rf node_modules
+install_deps dev npm install --legacy-peer-deps --silent
+echo build install success
+npm run build
+rm -rf node_modules
+cd build
+echo build complete
+install_deps production npm ci --legacy-peer-deps --silent --omit=dev
+echo production install success
@@ -0,0 +1,154 @@
+import collections
+import getpass
+import hashlib
+import json
+import os
+import shutil
+import threading
+import typing
+import uuid
+from pathlib import Path
+
+import cache_util
+import git_metadata
+import util
+
+# Host-wide cache of build output (`javascript/build`), keyed by everything that determines the build:
+# the commit, the build environment and the builder image definition.
+# Identical builds in different groups therefore only run once.
+# Set MANAGER_BUILD_CACHE to an empty string to disable the cache.
+
+cache_root = os.environ.get('MANAGER_BUILD_CACHE', './build-cache')
+# Least recently used builds are removed once all builds together exceed this size
+cache_budget = int(os.environ.get('MANAGER_BUILD_CACHE_BUDGET', str(20 * 1024 ** 3)))
+
+# node_modules trees installed by the builder, keyed by lockfile, node version and platform (see build-dockers/build.sh)
+# Set MANAGER_DEPS_CACHE to an empty string to disable the cache.
+deps_cache_root = os.environ.get('MANAGER_DEPS_CACHE', './deps-cache')
+deps_cache_budget = int(os.environ.get('MANAGER_DEPS_CACHE_BUDGET', str(20 * 1024 ** 3)))
+DEPS_REPORT_FNAME = '.deps-cache-report'
+
+deps_cache_stats = collections.Counter()  # type: typing.Counter[str]
+_stats_lock = threading.Lock()
+
+
+def get_cache_root() -> typing.Optional[Path]:
+    if not cache_root:
+        return None
+    return Path(cache_root).resolve()
+
+
+def file_hash(fname: Path) -> str:
+    h = hashlib.sha256()
+    with open(fname.as_posix(), 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def build_key(source: Path,
+              environment_variables: typing.Dict[str, str],
+              builder_files: typing.Sequence[Path],
+              node_version: str = None,
+              precompress: str = None) -> typing.Optional[str]:
+    # None when the build cannot be identified (no commit found)
+    # builder_files are the files the builder image is made from (Dockerfile, build script)
+    # precompress names the precompressed formats added to the build, if any
+    commit = git_metadata.get_full_commit_sha(source)
+    if commit is None:
+        return None
+    data = {
+        'commit': commit,
+        'environment': {str(k): str(v) for k, v in environment_variables.items()},
+        'builder': [file_hash(f) for f in builder_files],
+        'node_version': node_version,
+    }
+    if precompress is not None:
+        # only part of the key when set, so keys of earlier builds stay valid
+        data['precompress'] = precompress
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    # hardlinks keep restoring cheap, cached files are never modified in place
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def restore_build(key: str, dest: Path) -> bool:
+    # Replaces dest with the cached build, returns whether the build was cached
+    root = get_cache_root()
+    if root is None:
+        return False
+    entry = root / key
+    with cache_util.lock_entry(entry):
+        if not (entry / 'build').is_dir():
+            return False
+        if dest.exists():
+            shutil.rmtree(dest.as_posix())
+        shutil.copytree((entry / 'build').as_posix(), dest.as_posix(), symlinks=True, copy_function=_link_or_copy)
+        cache_util.mark_used(entry)
+    return True
+
+
+def store_build(key: str, build: Path, quiet: bool = False) -> None:
+    root = get_cache_root()
+    if root is None:
+        return
+    entry = root / key
+    with cache_util.lock_entry(entry):
+        if not (entry / 'build').is_dir():
+            tmp = root / '{key}.tmp-{id}'.format(key=key, id=uuid.uuid4().hex)
+            try:
+                shutil.copytree(build.as_posix(), (tmp / 'build').as_posix(), symlinks=True)
+                cache_util.mark_used(tmp)
+                if entry.exists():
+                    shutil.rmtree(entry.as_posix())
+                os.rename(tmp.as_posix(), entry.as_posix())
+            finally:
+                shutil.rmtree(tmp.as_posix(), ignore_errors=True)
+        cache_util.mark_used(entry)
+    cache_util.evict_lru(root, cache_budget, keep=[entry], quiet=quiet)
+
+
+def get_deps_cache_root() -> typing.Optional[Path]:
+    if not deps_cache_root:
+        return None
+    root = Path(deps_cache_root).resolve()
+    root.mkdir(parents=True, exist_ok=True)
+    return root
+
+
+def collect_deps_report(source: Path, quiet: bool = False) -> typing.List[typing.List[str]]:
+    # Reads (and removes) the dependency cache report the builder left in the source directory
+    # Counts hits/misses and makes newly stored trees removable by the current user
+    report = source / DEPS_REPORT_FNAME
+    try:
+        with open(report.as_posix(), 'r') as f:
+            lines = [line.split() for line in f if line.strip()]
+        os.remove(report.as_posix())
+    except FileNotFoundError:
+        return []
+    root = get_deps_cache_root()
+    stored = []
+    with _stats_lock:
+        for line in lines:
+            deps_cache_stats[line[1]] += 1
+            if line[1] == 'miss' and len(line) > 2 and root is not None:
+                stored.append(root / line[2])
+    for entry in stored:
+        if entry.exists():
+            util.chown_as_sudo(entry, getpass.getuser(), str(os.getegid()), '-R')
+    if root is not None:
+        cache_util.evict_lru(root, deps_cache_budget, keep=stored, quiet=quiet)
+    if not quiet:
+        print('Dependency cache: {result}'.format(result=', '.join('{0} {1}'.format(*line) for line in lines)))
+    return lines
+
+
+def format_deps_cache_stats() -> str:
+    with _stats_lock:
+        return 'Dependency cache: {hit} hits, {miss} misses'.format(hit=deps_cache_stats['hit'],
+                                                                    miss=deps_cache_stats['miss'])
@@ -1,6 +1,9 @@
+import json
 import os
 import re
+import shlex
 import shutil
+import typing
 from pathlib import Path
 
 from util import test_location
@@ -18,6 +21,7 @@ def make_node_dockerfile(base_dir: Path,
     with open('node-template/Dockerfile-nodejs', 'r') as infile, open(location.as_posix(), 'w+') as outfile:
         for line in infile:
             outfile.write(convert_dockerfile_command(line, node_version))
+    make_dockerignore(base_dir / name)
     return base_dir / name
 
 
@@ -37,17 +41,96 @@ def make_nginx_dockerfile(base_dir: Path,
     if test_location(nginx_dir, overwrite, quiet or no_overwrite):
         shutil.rmtree(nginx_dir)
     shutil.copytree('nginx-template', nginx_dir.as_posix())
+    make_dockerignore(nginx_dir)
     return nginx_dir
 
 
 def make_redis_dockerfile(base_dir: Path,
                           name: str,
-                          redis_version: str = '1.7.18',
+                          redis_version: str = None,
                           overwrite: bool = False,
                           no_overwrite: bool = False,
                           quiet: bool = False) -> Path:
+    # redis_version replaces the version of the template image, redis.conf is rendered by configure_redis
     redis_dir = base_dir / name
     if test_location(redis_dir, overwrite, quiet or no_overwrite):
         shutil.rmtree(redis_dir)
     shutil.copytree('redis-template', redis_dir.as_posix())
+    if redis_version is not None:
+        dockerfile = redis_dir / 'Dockerfile'
+        with open(dockerfile.as_posix(), 'r') as f:
+            lines = f.readlines()
+        with open(dockerfile.as_posix(), 'w') as f:
+            f.writelines(re.sub(r'^(\s*FROM\s+redis:)[^-\s]+', r'\g<1>' + redis_version, line, flags=re.IGNORECASE)
+                         for line in lines)
+    make_dockerignore(redis_dir)
     return redis_dir
+
+
+def remove_sites_enabled_copy(nginx_dir: Path) -> bool:
+    # Groups created before the generated sites were mounted copy them into the image
+    # Removes that copy (and updates the .dockerignore), returns whether the Dockerfile changed
+    dockerfile = nginx_dir / 'Dockerfile'
+    try:
+        with open(dockerfile.as_posix(), 'r') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return False
+    kept = [line for line in lines if not re.match(r'^\s*COPY\s+sites-enabled\b', line, re.IGNORECASE)]
+    if len(kept) == len(lines):
+        return False
+    with open(dockerfile.as_posix(), 'w') as f:
+        f.writelines(kept)
+    make_dockerignore(nginx_dir)
+    return True
+
+
+def dockerfile_sources(dockerfile: Path) -> typing.Optional[typing.List[str]]:
+    # Context paths used by the COPY/ADD instructions of a Dockerfile
+    # None when the whole context is used
+    with open(dockerfile.as_posix(), 'r') as f:
+        text = re.sub(r'\\\s*\n', ' ', f.read())
+    sources = []
+    for line in text.splitlines():
+        m = re.match(r'^\s*(COPY|ADD)\s+(.*)$', line, re.IGNORECASE)
+        if m is None:
+            continue
+        args = m.group(2).strip()
+        flags = []
+        while args.startswith('--'):
+            flag, _, args = args.partition(' ')
+            flags.append(flag)
+            args = args.strip()
+        if any(flag.startswith('--from') for flag in flags):
+            # copies from another stage or image, not from the context
+            continue
+        try:
+            paths = json.loads(args) if args.startswith('[') else shlex.split(args)
+        except ValueError:
+            return None
+        for src in paths[:-1]:
+            if re.match(r'^[a-z]+://', src):
+                continue
+            src = os.path.normpath(src).lstrip('/')
+            if src in ('.', ''):
+                return None
+            sources.append(src)
+    return sources
+
+
+def make_dockerignore(location: Path, dockerfile: str = 'Dockerfile') -> typing.Optional[Path]:
+    # Limits the build context to what the Dockerfile copies
+    # The rest of the service directory (git checkout, sources, node_modules, backups) is not send to docker
+    sources = dockerfile_sources(location / dockerfile)
+    fname = location / '.dockerignore'
+    if sources is None:
+        if fname.exists():
+            os.remove(fname.as_posix())
+        return None
+    with open(fname.as_posix(), 'w+') as f:
+        f.write('# generated from {dockerfile}, only the files it copies are part of the build context\n'
+                .format(dockerfile=dockerfile))
+        f.write('*\n')
+        for src in sources:
+            f.write('!{src}\n'.format(src=src))
+    return fname
@@ -0,0 +1,91 @@
+import contextlib
+import fcntl
+import os
+import shutil
+import threading
+import typing
+from pathlib import Path
+
+# Helpers for the host-wide caches (git mirrors, builds) stored as one directory per entry
+# Entries are locked while used and the least recently used entries are removed when a cache exceeds its budget
+
+LAST_USED_FNAME = 'manager-last-used'
+
+_thread_locks = {}  # type: typing.Dict[str, threading.Lock]
+_thread_locks_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def lock_entry(location: Path, blocking: bool = True):
+    # Exclusive use of a cache entry, across threads and across concurrently running commands
+    # Yields False when not blocking and the entry is in use
+    with _thread_locks_lock:
+        thread_lock = _thread_locks.setdefault(location.as_posix(), threading.Lock())
+    if not thread_lock.acquire(blocking):
+        yield False
+        return
+    try:
+        location.parent.mkdir(parents=True, exist_ok=True)
+        with open('{location}.lock'.format(location=location.as_posix()), 'a+') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    finally:
+        thread_lock.release()
+
+
+def mark_used(location: Path) -> None:
+    (location / LAST_USED_FNAME).touch()
+
+
+def last_used(location: Path) -> float:
+    try:
+        return (location / LAST_USED_FNAME).stat().st_mtime
+    except FileNotFoundError:
+        return 0
+
+
+def directory_size(location: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(location.as_posix()):
+        for f in files:
+            try:
+                total += os.lstat(os.path.join(root, f)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def evict_lru(root: Path,
+              budget: int,
+              keep: typing.Iterable[Path] = (),
+              quiet: bool = False) -> typing.List[Path]:
+    # Removes the least recently used entries of a cache until it fits in the budget
+    # Entries in `keep` and entries that are in use are never removed
+    if not root.is_dir():
+        return []
+    keep = {p.resolve() for p in keep}
+    entries = [p for p in root.iterdir() if p.is_dir()]
+    sizes = {p: directory_size(p) for p in entries}
+    total = sum(sizes.values())
+    removed = []
+    for entry in sorted(entries, key=last_used):
+        if total <= budget:
+            break
+        if entry.resolve() in keep:
+            continue
+        with lock_entry(entry, blocking=False) as locked:
+            if not locked:
+                continue
+            if not quiet:
+                print('Removing unused cache entry {entry}'.format(entry=entry))
+            shutil.rmtree(entry.as_posix(), ignore_errors=True)
+        total -= sizes[entry]
+        removed.append(entry)
+    return removed
@@ -2,9 +2,14 @@ import typing
 from pathlib import Path
 from DockerCompose import DockerCompose
 from DockerService import DockerService
+from RepoState import RepoState
 from builders import make_node_dockerfile, make_nginx_dockerfile
 from commands.build_helper import build_reverse_proxy
-from git_util import load_git, get_current_branch_name, get_latest_tag, get_current_full_commit_sha
+from compile import prewarm_builder_images
+from git_util import load_git, get_repo_state
+from nginx_util import get_proxy_settings, set_cache_time
+from resources import get_resource_settings
+from util import pop_deploy_replicas
 
 
 # PathLike = typing.Union[str, bytes, Path]
@@ -24,12 +29,17 @@ def add(compose: DockerCompose,
         no_overwrite: bool = False,
         quiet: bool = False,
         version: str = None,
-        server_type: str = 'node') -> typing.List[typing.Optional[DockerService]]:
+        server_type: str = 'node',
+        proxy_cache: str = None,
+        replicas: int = None) -> typing.List[typing.Optional[DockerService]]:
     # Adds a new backend docker to an existing server group
     # branch can be anything from a branch, a tag or a git SHA code
     # The default update behaviour is based on the branch type given:
     # if previous was a branch it will be the latest commit to that branch
     # if previous was a tag/sha it will be that specific tag/sha
+    # proxy_cache caches the responses of the backend for that time (`off` to disable), see nginx_util.set_cache_time
+    # resource limits are given with the `resources` key of the yaml (see resources.py)
+    # replicas (or `deploy.replicas` in the yaml) runs the backend in that many containers, balanced by the proxy
     if new_environment_vars is None:
         new_environment_vars = []
 
@@ -41,11 +51,24 @@ def add(compose: DockerCompose,
 
     if version[0] == 'v':
         version = version[1:]
+    proxy = get_proxy_settings(yaml.pop('proxy', None) if yaml else None)
+    if proxy_cache is not None:
+        proxy = set_cache_time(proxy, proxy_cache)
+    limits = get_resource_settings(yaml.pop('resources', None) if yaml else None)
+    yaml_replicas = pop_deploy_replicas(yaml)
+    if replicas is None:
+        replicas = yaml_replicas
     basename = base_dir.parts[-1]
     fullname = '{basename}.{name}'.format(basename=basename, name=name)
     if fullname in compose.services:
         if not overwrite and not no_overwrite:
             raise ValueError("Docker already existing, do you wish to update instead?")
+    owner = compose.get_replica_owner(fullname)
+    if owner is not None:
+        raise ValueError('{fullname} is the name of a replica of {owner}'.format(fullname=fullname, owner=owner))
+
+    node_version = version if server_type == 'node' else None
+    prewarm_builder_images([node_version])
 
     location = base_dir / fullname
     if not quiet:
@@ -62,18 +85,14 @@ def add(compose: DockerCompose,
     if not quiet:
         print('loading from git....')
     location_git = None
-    actual_branch = None
-    latest_tag = None
-    commit = None
+    state = RepoState()
     try:
         location_git, retcode = load_git(base_dir, fullname, git_settings, overwrite, no_overwrite, quiet)
-        actual_branch = get_current_branch_name(base_dir, fullname)
-        latest_tag = get_latest_tag(base_dir, fullname)
-        commit = get_current_full_commit_sha(base_dir, fullname)
+        state = get_repo_state(base_dir, fullname)
         try:
             dckr_data = compose.services[fullname]
-            dckr_data.set_environment_variable('GIT_BRANCH', actual_branch if actual_branch else "")
-            dckr_data.set_environment_variable('GIT_LATEST_TAG', latest_tag if latest_tag else "")
+            dckr_data.set_environment_variable('GIT_BRANCH', state.branch if state.branch else "")
+            dckr_data.set_environment_variable('GIT_LATEST_TAG', state.latest_tag if state.latest_tag else "")
         except KeyError:
             pass
     except ValueError:
@@ -82,7 +101,12 @@ def add(compose: DockerCompose,
     else:
         if retcode is not None and (retcode.returncode != 0 and retcode.returncode != 127):
             raise ValueError("Git failed, creation failed")
+    actual_branch = state.branch
+    latest_tag = state.latest_tag
+    commit = state.full_sha
 
+    compose.meta.set_proxy_settings(fullname, proxy)
+    compose.set_replicas(fullname, replicas if replicas is not None else compose.meta.get_replicas(fullname))
     if compose.main_docker is not None:
         try:
             compose.add_server(url_path, fullname, port)
@@ -133,6 +157,12 @@ def add(compose: DockerCompose,
 
         compose.services[fullname] = new_data
         compose.meta.set_docker_code_type(fullname, server_type)
+    if limits:
+        compose.set_resources(fullname, limits)
+    if node_version is not None:
+        compose.meta.set_node_version(fullname, node_version)
+    if commit is not None:
+        compose.meta.set_git_state(fullname, actual_branch, commit, state.short_sha, latest_tag)
 
     if build_env is not None:
         for env in build_env:
@@ -145,7 +175,7 @@ def add(compose: DockerCompose,
     environment = compose.meta.get_build_environment(fullname)
 
     if scr is not None:
-        scr(location_git, environment)
+        scr(location_git, environment, node_version=compose.meta.get_node_version(fullname))
     else:
         if not quiet:
             print('unknown code, left as is')
@@ -6,8 +6,9 @@ from typing import Sequence, Optional, List, Dict, Union
 from DockerCompose import DockerCompose
 from DockerService import DockerService
 from builders import make_nginx_dockerfile, make_redis_dockerfile
-from commands.build_helper import build_reverse_proxy
-from git_util import load_git, get_current_branch_name, get_latest_tag, get_current_full_commit_sha
+from commands.build_helper import build_reverse_proxy, configure_redis
+from compile import prewarm_builder_images
+from git_util import load_git, stop_git_worker, get_repo_state
 
 
 def create(directory: Path,
@@ -17,9 +18,11 @@ def create(directory: Path,
            run_env: Union[Sequence[str], str] = None,
            overwrite: bool = False,
            yaml: dict = None,
-           quiet: bool = False) -> (DockerCompose, List[Optional[DockerService]]):
+           quiet: bool = False,
+           redis_profile: str = None) -> (DockerCompose, List[Optional[DockerService]]):
     # Create a new server group
     # Always adds an nginx frontend
+    # redis_profile selects the redis configuration of the group (see redis_profiles.py), the template by default
     if run_env is None:
         run_env = []
     if git_settings is None:
@@ -31,10 +34,14 @@ def create(directory: Path,
     base = directory.parts[:-1]
     fullname = "{name}.nginx".format(name=name)
 
+    prewarm_builder_images([None])
+
     print("copying files....")
     if directory.exists() and os.listdir(directory.as_posix()):
         if overwrite:
             print('removing dir')
+            # the git worker has the old directory mounted
+            stop_git_worker(directory)
             shutil.rmtree(directory.as_posix())
         else:
             raise ValueError('Directory not empty')
@@ -68,11 +75,16 @@ def create(directory: Path,
     if not quiet:
         print("generating compose file....")
     compose = DockerCompose(network_name=name, network_port=port, yaml=yaml)
+    if redis_profile is not None:
+        configure_redis(compose, directory, "{name}.redis".format(name=name), {'profile': redis_profile}, quiet)
 
+    state = get_repo_state(directory, fullname)
+    actual_branch = state.branch
+    latest_tag = state.latest_tag
+    commit = state.full_sha
 
-    actual_branch = get_current_branch_name(directory, fullname)
-    latest_tag = get_latest_tag(directory, fullname)
-    commit = get_current_full_commit_sha(directory, fullname)
+    if commit is not None:
+        compose.meta.set_git_state(fullname, actual_branch, commit, state.short_sha, latest_tag)
 
     if build_env is not None:
         for env in build_env:
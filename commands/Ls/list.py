@@ -1,4 +1,5 @@
-import os
+import concurrent.futures
+import datetime
 import sys
 import typing
 from pathlib import Path
@@ -8,47 +9,136 @@ from tabulate import tabulate
 
 from DockerCompose import DockerCompose
 from DockerService import DockerService
+from docker_util import docker_inspect_all
 from git_util import get_current_short_commit_sha, get_current_branch_name
+from nginx_util import get_proxy_settings, read_cache_statistics
 from util import load
 
 
+def parse_docker_time(value: typing.Optional[str]) -> typing.Optional[datetime.datetime]:
+    # docker reports RFC 3339 timestamps with nanoseconds, python only handles microseconds
+    if not value or value.startswith('0001-'):
+        return None
+    date, _, fraction = value.rstrip('Z').partition('.')
+    try:
+        t = datetime.datetime.strptime(date, '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        return None
+    return t.replace(microsecond=int((fraction + '000000')[:6]) if fraction.isdigit() else 0,
+                     tzinfo=datetime.timezone.utc)
+
+
+def format_age(since: typing.Optional[datetime.datetime], now: datetime.datetime) -> str:
+    if since is None:
+        return ""
+    seconds = int((now - since).total_seconds())
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size:
+            return '{n}{unit}'.format(n=seconds // size, unit=unit)
+    return '{n}s'.format(n=max(seconds, 0))
+
+
+def get_container_states(names: typing.Sequence[str]) -> typing.Dict[str, typing.List[str]]:
+    # [state, uptime, image age] per container, using a single inspect for all containers and one for all images
+    now = datetime.datetime.now(datetime.timezone.utc)
+    containers = {c['Name'].lstrip('/'): c for c in docker_inspect_all(*names)}
+    images = {i['Id']: i for i in docker_inspect_all(*{c['Image'] for c in containers.values()}, object_type='image')}
+    states = {}
+    for name in names:
+        c = containers.get(name)
+        if c is None:
+            states[name] = ['missing', "", ""]
+            continue
+        running = c['State'].get('Running', False)
+        image = images.get(c['Image'], {})
+        states[name] = [
+            c['State'].get('Status', ""),
+            format_age(parse_docker_time(c['State'].get('StartedAt')), now) if running else "",
+            format_age(parse_docker_time(image.get('Created')), now),
+        ]
+    return states
+
+
+def get_repository_state(base_dir: Path, name: str) -> typing.List[str]:
+    branch = None
+    sha = None
+    try:
+        branch = get_current_branch_name(base_dir, name)
+        sha = get_current_short_commit_sha(base_dir, name)
+    except CalledProcessError:
+        pass
+    return [branch if branch is not None else "", sha if sha is not None else ""]
+
+
+def get_cached_repository_state(compose: DockerCompose, name: str) -> typing.List[str]:
+    # git state as recorded in x-meta during the last add/update
+    state = compose.meta.get_git_state(name)
+    branch = state.get('branch')
+    sha = state.get('short_commit') or (state.get('commit') or "")[:7]
+    return [branch if branch is not None else "", sha]
+
+
+def get_cache_rows(compose: DockerCompose) -> typing.List[typing.List[str]]:
+    # [route, name, requests, hit ratio] for every route with response caching
+    routes = [loc for loc in compose.meta.get_sorted_locations()
+              if get_proxy_settings(compose.meta.get_proxy_settings(loc.name))['cache'] is not None]
+    if not routes or compose.main_docker is None:
+        return []
+    statistics = read_cache_statistics(compose.main_docker.get_fullname())
+    rows = []
+    for loc in routes:
+        requests, hits = statistics.get(loc.path, (0, 0))
+        ratio = '{ratio:.1%}'.format(ratio=hits / requests) if requests else ""
+        rows.append([loc.path, loc.name, str(requests), ratio])
+    return rows
+
+
 def list_dockers(compose: DockerCompose,
-                 base_dir: Path) -> None:
+                 base_dir: Path,
+                 cached: bool = False,
+                 jobs: int = 8) -> None:
     # list all dockers which belong to a group
     # Together with the branch/tag/sha used for building
-    # as well as the actual git sha for the server
-    names = compose.get_all_docker_names()
-    data: typing.List[typing.List[str]] = []
-    for name in names:
+    # as well as the actual git sha for the server and the state of its container
+    # Repositories and containers are inspected concurrently, with `cached` the repositories are not inspected at all
+    # Routes with response caching are listed with their cache hit ratio
+    names = []  # type: typing.List[str]
+    # replicas show the repository of their docker
+    sources = {}  # type: typing.Dict[str, str]
+    for name in compose.get_all_docker_names():
         docker = compose.get_docker(name)  # type: typing.Optional[DockerService]
         if docker is not None:
-            branch = ""
-            sha = ""
-            name = docker.get_fullname()
-            sys.stdout.write("\033[K")
-            print(f'Checking repository for {name} ...', end='\r')
-            try:
-                branch = get_current_branch_name(base_dir, name)
-            except CalledProcessError:
-                pass
-            try:
-                os.remove('./tmp/git-cid')
-            except FileNotFoundError:
-                pass
-            try:
-                sha = get_current_short_commit_sha(base_dir, name)
-            except CalledProcessError:
-                pass
-            d = [name, branch if branch is not None else "", sha if sha is not None else ""]
-            data.append(d)
-            #print(len(f'Checking repository for {name} ...')*' ', end='\r')
+            names.append(docker.get_fullname())
+            for replica in compose.get_replica_names(name):
+                names.append(replica)
+                sources[replica] = docker.get_fullname()
+
+    if not cached:
+        sys.stdout.write("\033[K")
+        print('Checking repositories ...', end='\r')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        container_states = pool.submit(get_container_states, names)
+        cache_rows = pool.submit(get_cache_rows, compose)
+        primaries = [name for name in names if name not in sources]
+        if cached:
+            repository = {name: get_cached_repository_state(compose, name) for name in primaries}
+        else:
+            repository = dict(zip(primaries, pool.map(lambda n: get_repository_state(base_dir, n), primaries)))
+        repositories = [repository[sources.get(name, name)] for name in names]
+        states = container_states.result()
+
+    data: typing.List[typing.List[str]] = [[name, *repository, *states[name]]
+                                           for name, repository in zip(names, repositories)]
 
     sys.stdout.write("\033[K")
-    print(tabulate(data, headers=['name', 'branch', 'git sha']))
+    print(tabulate(data, headers=['name', 'branch', 'git sha', 'state', 'uptime', 'image age']))
+    if cache_rows.result():
+        print()
+        print(tabulate(cache_rows.result(), headers=['cached route', 'name', 'requests', 'hit ratio']))
 
 
 if __name__ == "__main__":
     test_directory = Path('/home/paul/webasupport/dockers/builder/dockers/allsports.test')
     rev_proxy = 'allsports.test.nginx'
     dckr_cmp = load((test_directory / 'docker-compose.yml').resolve(), rev_proxy)
-    list_dockers(dckr_cmp, test_directory.resolve())
\ No newline at end of file
+    list_dockers(dckr_cmp, test_directory.resolve())
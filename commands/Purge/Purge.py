@@ -1,9 +1,11 @@
 import os
+import subprocess
 from pathlib import Path
 
 from DockerCompose import DockerCompose
-from commands.Remove.Remove import remove_docker
-from docker_util import get_networks_from_container, get_containers_in_network, network_remove
+from InspectCache import InspectCache
+from docker_util import network_remove, docker_remove_all
+from git_util import stop_git_worker
 
 
 def purge(compose: DockerCompose,
@@ -15,22 +17,22 @@ def purge(compose: DockerCompose,
     if main_dckr is None:
         raise KeyError("Main docker is none, empty network?")
 
-    for dckr in list(compose.services.values()):
-        if dckr is main_dckr:
-            continue
-        fullname = dckr.get_fullname()
-        try:
-            remove_docker(fullname)
-        except FileNotFoundError as err:
-            print(err)
+    # One inspect for all containers and their networks, one removal for all containers
+    fullnames = compose.get_all_container_names()
+    state = InspectCache.load(fullnames)
+    networks = state.get_networks_from_container(main_dckr.get_fullname())
 
-    networks = get_networks_from_container(main_dckr.get_fullname())
-
-    remove_docker(main_dckr.get_fullname())
+    existing = [fullname for fullname in fullnames if state.exists(fullname)]
+    try:
+        docker_remove_all(*existing, forced=True)
+    except subprocess.CalledProcessError as err:
+        print(err)
+    state.forget(*existing)
+    stop_git_worker(base_dir)
 
     toremove = []
     for network in networks:
-        if forced or len(get_containers_in_network(network)) <= 0:
+        if forced or len(state.get_containers_in_network(network)) <= 0:
             toremove.append(network)
         else:
             print("Network {network} cannot be removed automatically;\n"
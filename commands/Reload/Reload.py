@@ -3,6 +3,11 @@ from typing import Sequence, Union, List, Optional
 
 from DockerCompose import DockerCompose
 from DockerService import DockerService
+from commands.build_helper import build_reverse_proxy, configure_redis
+from docker_util import docker_inspect_all, docker_remove_all
+from nginx_util import get_proxy_settings, set_cache_time
+from resources import get_resource_settings
+from util import pop_deploy_replicas
 
 
 def reload(compose: DockerCompose,
@@ -11,9 +16,16 @@ def reload(compose: DockerCompose,
            new_volumes: Union[Sequence[str], str] = None,
            new_environment_vars: Union[Sequence[str], str] = None,
            yaml: dict = None,
-           quiet: bool = False) -> List[Optional[DockerService]]:
+           quiet: bool = False,
+           proxy_cache: str = None,
+           replicas: int = None,
+           redis_profile: str = None) -> List[Optional[DockerService]]:
     # Reloads a docker int the network
     # Allowing new settings in yaml/environement/volumes without downloading and compiling code
+    # proxy_cache changes the cache time of the responses of the docker (`off` to disable caching)
+    # resources in the yaml replace the resource limits of the docker
+    # redis_profile (or `redis` in the yaml) renders the redis.conf of the redis docker of the group again
+    # replicas (or `deploy.replicas` in the yaml) scales the docker, the proxy is reloaded, not restarted
     basename = base_dir.parts[-1]
     fullname = '{basename}.{name}'.format(basename=basename, name=name)
     dckr = compose.get_docker(fullname)
@@ -25,6 +37,18 @@ def reload(compose: DockerCompose,
         print('Building docker-compose extension....')
     if yaml is None:
         yaml = {}
+    proxy = yaml.pop('proxy', None)
+    limits = yaml.pop('resources', None)
+    redis = yaml.pop('redis', None)
+    if redis_profile is not None:
+        redis = {**(redis if redis is not None else compose.meta.get_redis_settings(fullname)), 'profile': redis_profile}
+    if redis is not None and fullname != '{basename}.redis'.format(basename=basename):
+        raise ValueError('Only the redis docker of the group has a redis profile')
+    yaml_replicas = pop_deploy_replicas(yaml)
+    if replicas is None:
+        replicas = yaml_replicas
+    if proxy_cache is not None:
+        proxy = set_cache_time(proxy if proxy is not None else compose.meta.get_proxy_settings(fullname), proxy_cache)
 
     if new_volumes is not None and len(new_volumes) > 0:
         if 'volumes' not in yaml:
@@ -53,5 +77,27 @@ def reload(compose: DockerCompose,
             yaml['environment'] = []
 
     dckr.merge_data(yaml)
+    if limits is not None:
+        compose.set_resources(fullname, get_resource_settings(limits))
+    if redis is not None or (limits is not None and compose.meta.get_redis_settings(fullname)):
+        # maxmemory follows the memory limit
+        configure_redis(compose, base_dir, fullname, redis, quiet)
+
+    removed_replicas = []
+    if replicas is not None:
+        previous = compose.get_replica_names(fullname)
+        compose.set_replicas(fullname, replicas)
+        removed_replicas = previous[len(compose.get_replica_names(fullname)):]
+
+    if proxy is not None:
+        compose.meta.set_proxy_settings(fullname, get_proxy_settings(proxy))
+    if proxy is not None or removed_replicas:
+        # scaling down: the proxy stops using the replicas before they are removed
+        build_reverse_proxy(compose, base_dir, 'portal', quiet=quiet)
+    if removed_replicas:
+        if not quiet:
+            print('Removing replicas {names}....'.format(names=', '.join(removed_replicas)))
+        existing = [c['Name'].lstrip('/') for c in docker_inspect_all(*removed_replicas)]
+        docker_remove_all(*existing, forced=True)
 
     return [dckr]
@@ -59,6 +59,8 @@ def remove(compose: DockerCompose,
         print("removing docker {fullname}...".format(fullname=fullname))
     if dckr is not None:
         remove_docker(fullname)
+        for replica in compose.get_replica_names(fullname):
+            remove_docker(replica)
         remove_data(base_dir, dckr)
     clean_compose(compose, fullname, clean_path, quiet)
 
@@ -0,0 +1,57 @@
+import typing
+from pathlib import Path
+
+from tabulate import tabulate
+
+from DockerCompose import DockerCompose
+from DockerService import DockerService
+from commands.build_helper import configure_redis
+from resources import get_resource_settings, host_resources, RESOURCE_KEYS
+
+
+def print_resources(compose: DockerCompose) -> None:
+    rows = []
+    for name in compose.get_all_docker_names():
+        resources = compose.meta.get_resources(name)
+        rows.append([name, *(resources.get(key, "") for key in RESOURCE_KEYS)])
+    print(tabulate(rows, headers=['name', *RESOURCE_KEYS]))
+
+
+def resources(compose: DockerCompose,
+              base_dir: Path,
+              name: str = None,
+              settings: typing.Dict[str, str] = None,
+              clear: bool = False,
+              auto: bool = False,
+              quiet: bool = False) -> typing.List[DockerService]:
+    # Sets the resource limits of a docker (settings are merged with its current profile, clear removes them)
+    # With auto every docker of the group is sized from the cores and memory of the host
+    # Returns the dockers whose limits changed, their containers are recreated with the new limits
+    changed = []
+    if auto:
+        cores, memory = host_resources()
+        if not quiet:
+            print('Sizing resources for {cores} cores and {memory}MB of memory'
+                  .format(cores=cores, memory=memory // 1024 ** 2))
+        before = {n: compose.meta.get_resources(n) for n in compose.get_all_docker_names()}
+        profiles = compose.auto_resources(cores, memory)
+        changed.extend(compose.get_docker(n) for n, profile in profiles.items() if before[n] != profile)
+    if name is not None:
+        basename = base_dir.parts[-1]
+        fullname = '{basename}.{name}'.format(basename=basename, name=name)
+        dckr = compose.get_docker(fullname)
+        if dckr is None:
+            raise KeyError("Docker {fullname} not found".format(fullname=fullname))
+        current = {} if clear else compose.meta.get_resources(fullname)
+        profile = get_resource_settings({**current, **(settings or {})})
+        if profile != compose.meta.get_resources(fullname):
+            compose.set_resources(fullname, profile)
+            if dckr not in changed:
+                changed.append(dckr)
+    for dckr in changed:
+        if compose.meta.get_redis_settings(dckr.get_fullname()):
+            # maxmemory follows the memory limit
+            configure_redis(compose, base_dir, dckr.get_fullname(), quiet=quiet)
+    if not quiet:
+        print_resources(compose)
+    return changed
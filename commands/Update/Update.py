@@ -1,12 +1,66 @@
-import itertools
-import shutil
-import subprocess
+import concurrent.futures
 from pathlib import Path
-from typing import Sequence, Optional
+from typing import Sequence, Optional, List, Dict
 
 from DockerService import DockerService
-from git_util import load_git, update_git, get_current_branch_name, get_latest_tag, get_current_full_commit_sha
+from RepoState import RepoState
+from git_util import update_git, get_repo_state
 from DockerCompose import DockerCompose
+from compile import prewarm_builder_images
+
+
+def fetch_code(base_dir: Path,
+               fullname: str,
+               branch: Optional[str],
+               git_settings: Sequence[str],
+               quiet: bool = False,
+               clean: bool = False) -> RepoState:
+    # Loads the new code of a service from git, returns the resulting git state
+    if not quiet:
+        print('loading from git for {fullname}....'.format(fullname=fullname))
+    update_git(base_dir, fullname, branch, git_settings, quiet, clean)
+    return get_repo_state(base_dir, fullname)
+
+
+def set_build_environment(compose: DockerCompose,
+                          fullname: str,
+                          build_env=None):
+    if build_env is not None:
+        compose.meta.clear_build_environment(fullname)
+        for env in build_env:
+            k, v = env.split('=', 1)
+            compose.meta.set_build_environment_variable(fullname, k, v)
+
+
+def build_code(compose: DockerCompose,
+               base_dir: Path,
+               fullname: str,
+               quiet: bool = False):
+    # Compiles the (already loaded) code of a service
+    location = base_dir / fullname / 'javascript'
+    if not quiet:
+        print("Transpiling javascript for {fullname}....".format(fullname=fullname))
+    scr = compose.meta.get_compile_script(fullname)
+    environment = compose.meta.get_build_environment(fullname)
+
+    if scr is not None:
+        scr(location, environment, node_version=compose.meta.get_node_version(fullname))
+
+
+def apply_repo_state(compose: DockerCompose,
+                     fullname: str,
+                     state: RepoState) -> Optional[DockerService]:
+    dckr = compose.get_docker(fullname)  # type: Optional[DockerService]
+    if dckr is not None:
+        if state.full_sha is not None:
+            dckr.set_environment_variable('GIT_COMMIT', state.full_sha)
+        if state.branch is not None:
+            dckr.set_environment_variable('GIT_BRANCH', state.branch)
+        if state.latest_tag is not None:
+            dckr.set_environment_variable('GIT_LATEST_TAG', state.latest_tag)
+    if state.full_sha is not None:
+        compose.meta.set_git_state(fullname, state.branch, state.full_sha, state.short_sha, state.latest_tag)
+    return dckr
 
 
 def update(compose: DockerCompose,
@@ -15,7 +69,8 @@ def update(compose: DockerCompose,
            branch: Optional[str],
            git_settings: Sequence[str],
            build_env=None,
-           quiet: bool = False):
+           quiet: bool = False,
+           clean: bool = False):
     # updates a container in the network
     # branch can be anything from a branch, a tag or a git SHA code
     # Without branch the behaviour is based on previously given branch:
@@ -23,38 +78,78 @@ def update(compose: DockerCompose,
     # if previous was a tag/sha it will be that specific tag/sha
     basename = base_dir.parts[-1]
     fullname = '{basename}.{name}'.format(basename=basename, name=name)
-    location = base_dir / fullname / 'javascript'
 
-    if not quiet:
-        print('loading from git....')
-    update_git(base_dir, fullname, branch, git_settings, quiet)
+    state = fetch_code(base_dir, fullname, branch, git_settings, quiet, clean)
+    set_build_environment(compose, fullname, build_env)
+    build_code(compose, base_dir, fullname, quiet)
 
-    actual_branch = get_current_branch_name(base_dir, fullname)
-    latest_tag = get_latest_tag(base_dir, fullname)
-    commit = get_current_full_commit_sha(base_dir, fullname)
+    return [apply_repo_state(compose, fullname, state)]
 
-    if build_env is not None:
-        compose.meta.clear_build_environment(fullname)
-        for env in build_env:
-            k, v = env.split('=', 1)
-            compose.meta.set_build_environment_variable(fullname, k, v)
 
-    if not quiet:
-        print("Transpiling javascript....")
-    scr = compose.meta.get_compile_script(fullname)
-    environment = compose.meta.get_build_environment(fullname)
+def update_parallel(compose: DockerCompose,
+                    base_dir: Path,
+                    names: Sequence[str],
+                    branch: Optional[str],
+                    git_settings: Sequence[str],
+                    jobs: int = 1,
+                    fetch_jobs: int = 4,
+                    build_env=None,
+                    quiet: bool = False,
+                    clean: bool = False) -> List[DockerService]:
+    # Updates several containers of the network at once
+    # Git fetches and builds are pipelined: a service is build as soon as its code is loaded,
+    # while other services are still fetching. At most `jobs` builds run concurrently.
+    # Without branch the currently checked out branch of each service is followed
+    # On failure no new tasks are started, the finished services are still applied before raising
+    basename = base_dir.parts[-1]
+    fullnames = ['{basename}.{name}'.format(basename=basename, name=name) for name in names]
+    for fullname in fullnames:
+        set_build_environment(compose, fullname, build_env)
+    prewarm_builder_images(compose.meta.get_node_version(fullname) for fullname in fullnames)
 
-    if scr is not None:
-        scr(location, environment)
+    def fetch_task(fullname: str) -> RepoState:
+        return fetch_code(base_dir, fullname, branch, git_settings, quiet, clean)
 
-    dckr = compose.get_docker(fullname)  # type: Optional[DockerService]
-    if dckr is not None:
-        if commit is not None:
-            dckr.set_environment_variable('GIT_COMMIT', commit)
-        if actual_branch is not None:
-            dckr.set_environment_variable('GIT_BRANCH', actual_branch)
-        if latest_tag is not None:
-            dckr.set_environment_variable('GIT_LATEST_TAG', latest_tag)
+    def build_task(fullname: str, state: RepoState) -> RepoState:
+        build_code(compose, base_dir, fullname, quiet)
+        return state
+
+    states = {}  # type: Dict[str, RepoState]
+    errors = {}  # type: Dict[str, BaseException]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, fetch_jobs)) as fetch_pool, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as build_pool:
+        fetches = {fetch_pool.submit(fetch_task, fullname): fullname for fullname in fullnames}
+        builds = {}  # type: Dict[concurrent.futures.Future, str]
+        for future in concurrent.futures.as_completed(fetches):
+            fullname = fetches[future]
+            if future.cancelled():
+                continue
+            try:
+                state = future.result()
+            except Exception as err:
+                errors[fullname] = err
+                for f in fetches:
+                    f.cancel()
+                continue
+            if errors:
+                continue
+            builds[build_pool.submit(build_task, fullname, state)] = fullname
 
-    return [dckr]
+        for future in concurrent.futures.as_completed(builds):
+            fullname = builds[future]
+            if future.cancelled():
+                continue
+            try:
+                states[fullname] = future.result()
+            except Exception as err:
+                errors[fullname] = err
+                for f in builds:
+                    f.cancel()
 
+    dockers = [apply_repo_state(compose, fullname, states[fullname]) for fullname in fullnames
+               if fullname in states]
+    if errors:
+        for fullname, err in errors.items():
+            print('{fullname} failed: {err}'.format(fullname=fullname, err=err))
+        raise RuntimeError('Updating failed for {names}'.format(names=', '.join(errors.keys())))
+    return [d for d in dockers if d is not None]
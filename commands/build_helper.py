@@ -1,25 +1,91 @@
+import typing
 from pathlib import Path
 
 from DockerCompose import DockerCompose
-from nginx_util import build_nginx_configuration
+from builders import remove_sites_enabled_copy
+from docker_util import docker_inspect_all
+from nginx_util import build_nginx_configuration, can_hot_reload, get_proxy_settings, reload_nginx, rotate_cache_log
+from redis_profiles import get_redis_settings, memory_limit_of, redis_directives, write_redis_conf
+from resources import format_size, host_resources
 
 
 def build_reverse_proxy(compose: DockerCompose,
                         base_dir: Path,
                         portal_fname: str = 'portal',
                         overwrite: bool = False,
-                        quiet: bool = False, ):
+                        quiet: bool = False,
+                        replacing: typing.Collection[str] = (),
+                        restarted: typing.Collection[str] = ()):
+    # Generates the nginx sites of the main docker
+    # When the main docker is running with the sites mounted, nginx is reloaded instead of rebuilding the image
+    # nginx resolves upstream servers when loading its configuration, a recreated container can have a new address:
+    # replacing containers are proxied through the docker dns while they are recreated, nginx is reloaded when a
+    # restarted container is in an upstream block, even when the generated sites did not change
     if compose.main_docker is not None:
         if not quiet:
             print('Building main docker....')
+        fullname = compose.main_docker.get_fullname()
+        sites_enabled = base_dir / fullname / 'sites-enabled' / portal_fname
+        try:
+            previous = sites_enabled.read_text()
+        except FileNotFoundError:
+            previous = None
+
+        remove_sites_enabled_copy(base_dir / fullname)
+        compose.main_docker.add_sites_enabled_volume()
+        locations = compose.meta.get_sorted_locations()
+        names = sorted({loc.name for loc in locations})
+        endpoints = sorted({e for loc in locations for e in loc.get_endpoints()})
+        running = {c['Name'].lstrip('/') for c in docker_inspect_all(*endpoints) if c['State'].get('Running')} \
+            - set(replacing)
+        proxy_settings = {name: compose.meta.get_proxy_settings(name) for name in names}
         build_nginx_configuration(base_dir,
-                                  compose.main_docker.get_fullname(),
+                                  fullname,
                                   portal_fname,
-                                  compose.meta.get_sorted_locations(),
+                                  locations,
                                   overwrite,
-                                  quiet)
+                                  quiet,
+                                  proxy_settings=proxy_settings,
+                                  upstream_hosts=running)
+        upstream_hosts = {e for loc in locations if get_proxy_settings(proxy_settings[loc.name])['mode'] == 'upstream'
+                          for e in loc.get_endpoints() if e in running}
+        changed = any(name in upstream_hosts for name in restarted) or sites_enabled.read_text() != previous
+        cached = any(get_proxy_settings(settings)['cache'] is not None for settings in proxy_settings.values())
+        if previous is not None and (changed or cached) \
+                and can_hot_reload(fullname, compose.main_docker.SITES_ENABLED):
+            if changed and not reload_nginx(fullname, quiet):
+                # keep the running configuration and the generated file in line
+                sites_enabled.write_text(previous)
+                raise ValueError('nginx rejected the new configuration of {fullname}, it was not applied'
+                                 .format(fullname=fullname))
+            if cached:
+                # `ls` only reads the cache log, it is kept small by the commands changing the group
+                rotate_cache_log(fullname)
         if not quiet:
             print('Building main docker.... complete!')
     else:
         if not quiet:
             print("Main docker not found")
+
+
+def configure_redis(compose: DockerCompose,
+                    base_dir: Path,
+                    fullname: str,
+                    settings: dict = None,
+                    quiet: bool = False) -> bool:
+    # Renders the redis.conf of a redis docker from its profile (settings replace the stored profile)
+    # A profile without a memory limit of the docker gives the docker the default limit
+    # Returns whether redis.conf changed, the image is rebuilt with it on the next start
+    if settings is not None:
+        compose.meta.set_redis_settings(fullname, get_redis_settings(settings))
+    settings = get_redis_settings(compose.meta.get_redis_settings(fullname))
+    cores, memory = host_resources()
+    limits = compose.meta.get_resources(fullname)
+    limit = memory_limit_of(limits, memory)
+    if settings['profile'] != 'default' and not limits.get('mem_limit'):
+        compose.set_resources(fullname, {**limits, 'mem_limit': format_size(limit)})
+    changed = write_redis_conf(base_dir / fullname, redis_directives(settings, limit, cores))
+    if changed and not quiet:
+        print('Generated redis.conf of {fullname} with profile {profile}'
+              .format(fullname=fullname, profile=settings['profile']))
+    return changed
@@ -1,15 +1,26 @@
 import getpass
+import hashlib
 import os
 import shutil
 import subprocess
+import tempfile
+import threading
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Iterable, Optional
 
-import tail
-from docker_util import wait_for_finish, get_exit_code, docker_build, docker_run, docker_remove
+import build_cache
+import cache_util
+from docker_util import docker_build, docker_run, docker_image_exists
+from precompress import brotli_available, precompress_directory
+from resources import builder_limits
 import util
 from shutil import copyfile
 
+_rsa_lock = threading.Lock()
+
+BUILDER_IMAGE = 'spiderweb-builder'
+DEFAULT_NODE_VERSION = '18'
+
 
 def copy_rsa_keys(build_dir: str= './build-dockers/'):
     home = Path.home().resolve()
@@ -27,65 +38,144 @@ def copy_rsa_keys(build_dir: str= './build-dockers/'):
         copyfile(in_known_hosts_fname.resolve().as_posix(), out_known_hosts_fname.resolve().as_posix())
 
 
-def compile_javascript(source: Path, environment_variables: Dict[str, str] = None, ubuntu: bool = False) -> Path:
+def builder_dockerfile(ubuntu: bool = False) -> Path:
+    dockerfilename = './build-dockers/Dockerfile-build'
+    if not ubuntu:
+        dockerfilename += '-alpine'
+    return Path(dockerfilename)
+
+
+def builder_files(ubuntu: bool = False, build_dir: str = './build-dockers/') -> List[Path]:
+    # Everything the builder image is made from: Dockerfile, build script and the ssh material
+    ssh_dir = Path(build_dir + 'local/ssh')
+    ssh_files = sorted(p for p in ssh_dir.iterdir() if p.is_file()) if ssh_dir.is_dir() else []
+    return [builder_dockerfile(ubuntu), Path(build_dir + 'build.sh'), *ssh_files]
+
+
+def builder_tag(node_version: str = None, ubuntu: bool = False) -> str:
+    # The tag changes with the builder definition, so an existing tag is always up to date
+    if node_version is None:
+        node_version = DEFAULT_NODE_VERSION
+    h = hashlib.sha256(node_version.encode('utf-8'))
+    for f in builder_files(ubuntu):
+        h.update(f.name.encode('utf-8'))
+        h.update(build_cache.file_hash(f).encode('utf-8'))
+    return '{image}:node{node_version}-{fingerprint}'.format(image=BUILDER_IMAGE,
+                                                           node_version=node_version,
+                                                           fingerprint=h.hexdigest()[:12])
+
+
+def ensure_builder_image(node_version: str = None, ubuntu: bool = False) -> str:
+    # Builds the builder image for a node version, unless an image with the same fingerprint exists
+    if node_version is None:
+        node_version = DEFAULT_NODE_VERSION
+    with _rsa_lock:
+        copy_rsa_keys()
+        # copy rsa keys if not existing (dockerfile refers to this directory)
+        # note copy, not link a volume to prevent ownership problems with concurrent builds
+    tag = builder_tag(node_version, ubuntu)
+    # the lock file sits next to the build cache entries (eviction only removes directories)
+    lock_dir = build_cache.get_cache_root() or Path(tempfile.gettempdir())
+    with cache_util.lock_entry(lock_dir / tag.replace(':', '-')):
+        if not docker_image_exists(tag):
+            print('Building builder image {tag}'.format(tag=tag))
+            docker_build(builder_dockerfile(ubuntu).resolve(), tag,
+                         **{'build-arg': 'NODE_VERSION={node_version}'.format(node_version=node_version)})
+    return tag
+
+
+def prewarm_builder_images(node_versions: Iterable[Optional[str]], ubuntu: bool = False) -> threading.Thread:
+    # Makes sure the builder images exist, in the background while other work (git) is done
+    node_versions = list(node_versions)
+
+    def warm():
+        for version in set(v if v is not None else DEFAULT_NODE_VERSION for v in node_versions):
+            try:
+                ensure_builder_image(version, ubuntu)
+            except (subprocess.CalledProcessError, OSError) as err:
+                # the build itself will try again and report
+                print('Prewarming builder for node {version} failed: {err}'.format(version=version, err=err))
+
+    thread = threading.Thread(target=warm, daemon=True)
+    thread.start()
+    return thread
+
+
+def compile_javascript(source: Path,
+                       environment_variables: Dict[str, str] = None,
+                       ubuntu: bool = False,
+                       node_version: str = None,
+                       precompress: bool = False) -> Path:
     # Given already downloaded git source
     # Runs the command `npm run build`
     # Project itself is responsible for building itself into `/build` directory
     # /build directory should include everything, node_modules for backend and html for static frontend
     # Project is given the RSA keys for the git repository as specified in the readme
+    # The builder runs with limits (resources.builder_limits), so builds cannot starve the running services
+    # With precompress (frontend code) `.gz`/`.br` siblings of the static files are added to /build
 
     print("Javascript build started")
     dest = source / 'build'
-    try:
-        os.remove('./tmp/cid')
-    except FileNotFoundError:
-        pass
+    if environment_variables is None:
+        environment_variables = {}
+
+    key = build_cache.build_key(source, environment_variables,
+                                [builder_dockerfile(ubuntu), Path('./build-dockers/build.sh')],
+                                node_version if node_version is not None else DEFAULT_NODE_VERSION,
+                                precompress_formats(precompress))
+    if key is not None and build_cache.restore_build(key, dest):
+        print("Javascript build restored from cache")
+        return dest
+
     if dest.exists():
         shutil.rmtree(dest.as_posix())
     dest.mkdir(parents=True)
-    if (source/"node_modules").exists():
-        shutil.rmtree((source/"node_modules").as_posix())
-
-    if environment_variables is None:
-        environment_variables = {}
+    # node_modules left over by an interrupted build is replaced inside the builder (build.sh), from the deps cache
+    # when the lockfile and node version did not change
 
     try:
-        copy_rsa_keys()
-        # copy rsa keys if not existing (dockerfile refers to this directory)
-        # note copy, not link a volume to prevent ownership problems with concurrent builds
+        image = ensure_builder_image(node_version, ubuntu)
 
-        dockerfilename = './build-dockers/Dockerfile-build'
-        if not ubuntu:
-            dockerfilename += '-alpine'
-        image = docker_build(Path(dockerfilename).resolve(),
-                             'spiderweb-builder')
-
-        code = docker_run(image, '-it',
-                          temporary=False,
-                          volume=[
-                              '{host}:/javascript'.format(host=source.resolve().as_posix()),
-                              '{home}/.npm:/home/node/.npm'.format(home=Path.home().resolve().as_posix()),
-                          ],
-                          environment=environment_variables,
-                          cidfile='./tmp/cid')
-        with open('./tmp/cid') as f:
-            docker_id = tail.tail(f, 1)
-        try:
-            wait_for_finish(docker_id, 1)
-            docker_remove(docker_id)
-            if get_exit_code(docker_id) != '0':
-                raise RuntimeError('Cannot build')
-        except subprocess.CalledProcessError:
-            pass
+        volumes = [
+            '{host}:/javascript'.format(host=source.resolve().as_posix()),
+            '{home}/.npm:/home/node/.npm'.format(home=Path.home().resolve().as_posix()),
+        ]
+        deps_cache = build_cache.get_deps_cache_root()
+        if deps_cache is not None:
+            volumes.append('{deps}:/deps-cache'.format(deps=deps_cache.as_posix()))
+
+        run = docker_run(image, '-it',
+                         volume=volumes,
+                         environment=environment_variables,
+                         fail_on_nonzero_exit=False,
+                         **builder_limits())
+        if run.exit_code != 0:
+            raise RuntimeError('Cannot build ({run})'.format(run=run))
+        print('Javascript build finished in {time:.1f}s'.format(time=run.wall_time))
     finally:
         usr = getpass.getuser()
         group = os.getegid()
         util.chown_as_sudo(source, usr, str(group), '-R')
+        build_cache.collect_deps_report(source)
 
+    if precompress:
+        precompress_directory(dest)
+    if key is not None:
+        build_cache.store_build(key, dest)
     return dest
 
 
-def default_clone(source: Path) -> Path:
+def precompress_formats(precompress: bool) -> Optional[str]:
+    # Part of the build key, a build cached before brotli was available does not contain `.br` files
+    if not precompress:
+        return None
+    return 'gzip+brotli' if brotli_available() else 'gzip'
+
+
+def default_clone(source: Path,
+                  environment_variables: Dict[str, str] = None,
+                  node_version: str = None,
+                  precompress: bool = False) -> Path:
     print("Default, clone all code")
     dest = source / 'build'
     if dest.exists():
@@ -94,4 +184,6 @@ def default_clone(source: Path) -> Path:
     shutil.copytree(source.as_posix(),
                     (source / 'build').as_posix(),
                     ignore=shutil.ignore_patterns('build/*', 'build'))
+    if precompress:
+        precompress_directory(dest)
     return dest
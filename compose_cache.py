@@ -0,0 +1,96 @@
+import hashlib
+import marshal
+import os
+import threading
+import typing
+import uuid
+from pathlib import Path
+
+import util
+
+# Cache of parsed docker-compose files, keyed by path, modification time and size
+# Entries are kept in memory and in ./tmp/compose-cache (or $MANAGER_COMPOSE_CACHE, set it empty to disable),
+# so repeated invocations on an unchanged compose file skip parsing the yaml.
+# Entries are stored with marshal: documents with values marshal cannot store are simply not cached.
+
+cache_root = os.environ.get('MANAGER_COMPOSE_CACHE', './tmp/compose-cache')
+
+_memory = {}  # type: typing.Dict[str, typing.Tuple[int, int, bytes]]
+_memory_lock = threading.Lock()
+
+
+def get_cache_root() -> typing.Optional[Path]:
+    if not cache_root:
+        return None
+    return Path(cache_root).resolve()
+
+
+def _entry_location(root: Path, path: str) -> Path:
+    return root / '{key}.marshal'.format(key=hashlib.sha1(path.encode('utf-8')).hexdigest())
+
+
+def _read_entry(path: str, mtime: int, size: int) -> typing.Optional[bytes]:
+    with _memory_lock:
+        entry = _memory.get(path)
+    if entry is not None and entry[:2] == (mtime, size):
+        return entry[2]
+    root = get_cache_root()
+    if root is None:
+        return None
+    try:
+        with open(_entry_location(root, path).as_posix(), 'rb') as f:
+            stored_path, stored_mtime, stored_size, data = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if (stored_path, stored_mtime, stored_size) != (path, mtime, size):
+        return None
+    with _memory_lock:
+        _memory[path] = (mtime, size, data)
+    return data
+
+
+def _write_entry(path: str, mtime: int, size: int, data: bytes) -> None:
+    with _memory_lock:
+        _memory[path] = (mtime, size, data)
+    root = get_cache_root()
+    if root is None:
+        return
+    location = _entry_location(root, path)
+    tmp = root / '{name}.tmp-{id}'.format(name=location.name, id=uuid.uuid4().hex)
+    try:
+        root.mkdir(parents=True, exist_ok=True)
+        with open(tmp.as_posix(), 'wb') as f:
+            marshal.dump((path, mtime, size, data), f)
+        os.replace(tmp.as_posix(), location.as_posix())
+    except OSError:
+        try:
+            os.remove(tmp.as_posix())
+        except OSError:
+            pass
+
+
+def _stat_key(filename: Path) -> (str, int, int):
+    path = filename.resolve().as_posix()
+    st = os.stat(path)
+    return path, st.st_mtime_ns, st.st_size
+
+
+def load_compose_data(filename: Path) -> dict:
+    # Parsed contents of a compose file, every call returns a new (mutable) copy
+    path, mtime, size = _stat_key(filename)
+    cached = _read_entry(path, mtime, size)
+    if cached is not None:
+        return marshal.loads(cached)
+    data = util.yaml_load(filename)
+    store_compose_data(filename, data)
+    return data
+
+
+def store_compose_data(filename: Path, data: dict) -> None:
+    # Registers the data just written to (or read from) filename
+    try:
+        dumped = marshal.dumps(data)
+    except ValueError:
+        return
+    path, mtime, size = _stat_key(filename)
+    _write_entry(path, mtime, size, dumped)
@@ -0,0 +1,243 @@
+import fnmatch
+import hashlib
+import json
+import marshal
+import os
+import typing
+from pathlib import Path
+
+import build_cache
+from DockerCompose import DockerCompose
+from DockerService import DockerService
+from docker_util import docker_inspect_all
+
+# Fingerprints of the inputs of a service, stored in x-meta after a successful `docker-compose up`:
+#   build:  the Dockerfile and every file of the build context docker would send (respecting .dockerignore)
+#   config: the service definition of the compose file (without settings applied otherwise, see fingerprint_data)
+# Only services whose build changed are rebuilt, services with only a changed config are recreated without build.
+# File digests are remembered by size/mtime/inode in ./tmp/context-hashes (or $MANAGER_CONTEXT_HASHES),
+# so unchanged files are not read again.
+
+hash_cache_root = os.environ.get('MANAGER_CONTEXT_HASHES', './tmp/context-hashes')
+
+
+def read_dockerignore(context: Path) -> typing.List[typing.Tuple[str, bool]]:
+    # (pattern, negated) pairs, later patterns win
+    patterns = []
+    try:
+        with open((context / '.dockerignore').as_posix(), 'r') as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return patterns
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        negated = line.startswith('!')
+        pattern = os.path.normpath(line.lstrip('!').strip()).lstrip('/')
+        patterns.append((pattern, negated))
+    return patterns
+
+
+def is_ignored(relative: str, patterns: typing.Sequence[typing.Tuple[str, bool]]) -> bool:
+    # A pattern matching a directory also excludes everything inside it
+    parts = relative.split('/')
+    prefixes = ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+    ignored = False
+    for pattern, negated in patterns:
+        if pattern.startswith('**/'):
+            # the directories (and the path) starting at any depth
+            candidates = ['/'.join(parts[i:j]) for i in range(len(parts)) for j in range(i + 1, len(parts) + 1)]
+            pattern = pattern[3:]
+        else:
+            candidates = prefixes
+        if any(fnmatch.fnmatchcase(c, pattern) for c in candidates):
+            ignored = not negated
+    return ignored
+
+
+def may_include_below(relative: str, patterns: typing.Sequence[typing.Tuple[str, bool]]) -> bool:
+    # Whether a negated pattern can match the directory or a path inside it
+    # Only the literal path segments in front of the first wildcard are compared (`*` also matches `/`)
+    parts = relative.split('/')
+    for pattern, negated in patterns:
+        if not negated:
+            continue
+        literal = []
+        for segment in pattern.split('/'):
+            if any(c in segment for c in '*?['):
+                break
+            literal.append(segment)
+        n = min(len(literal), len(parts))
+        if literal[:n] == parts[:n]:
+            return True
+    return False
+
+
+def context_files(context: Path, use_dockerignore: bool = True) -> typing.List[str]:
+    # Relative paths of the files docker would send as build context
+    # Ignored directories are not walked, unless a negated pattern can include something inside them
+    # (the generated .dockerignore is `*` followed by the copied paths)
+    patterns = read_dockerignore(context) if use_dockerignore else []
+    files = []
+    for root, dirs, names in os.walk(context.as_posix()):
+        rel_root = os.path.relpath(root, context.as_posix())
+        rel_root = '' if rel_root == '.' else rel_root + '/'
+        dirs[:] = [d for d in dirs
+                   if not is_ignored(rel_root + d, patterns) or may_include_below(rel_root + d, patterns)]
+        dirs.sort()
+        for name in sorted(names):
+            relative = rel_root + name
+            if not is_ignored(relative, patterns):
+                files.append(relative)
+    return files
+
+
+def context_size(context: Path, use_dockerignore: bool = True) -> int:
+    # Bytes of the build context, without use_dockerignore what would be send without a .dockerignore
+    size = 0
+    for relative in context_files(context, use_dockerignore):
+        try:
+            size += os.lstat((context / relative).as_posix()).st_size
+        except FileNotFoundError:
+            pass
+    return size
+
+
+def format_size(size: int) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return '{size:.0f}{unit}'.format(size=size, unit=unit)
+        size /= 1024
+    return '{size:.1f}GB'.format(size=size)
+
+
+def context_size_report(base_dir: Path, dckr: DockerService) -> typing.Optional[str]:
+    source = dckr.get_source_path()
+    if source is None or not (base_dir / source).is_dir():
+        return None
+    context = base_dir / source
+    return '{name}: build context {sent} (whole directory {total})'.format(
+        name=dckr.get_fullname(),
+        sent=format_size(context_size(context)),
+        total=format_size(context_size(context, False)))
+
+
+def _hash_cache_location(context: Path) -> typing.Optional[Path]:
+    if not hash_cache_root:
+        return None
+    key = hashlib.sha1(context.resolve().as_posix().encode('utf-8')).hexdigest()
+    return Path(hash_cache_root).resolve() / '{key}.marshal'.format(key=key)
+
+
+def _load_hash_cache(location: typing.Optional[Path]) -> dict:
+    if location is None:
+        return {}
+    try:
+        with open(location.as_posix(), 'rb') as f:
+            return marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return {}
+
+
+def _store_hash_cache(location: typing.Optional[Path], hashes: dict) -> None:
+    if location is None:
+        return
+    try:
+        location.parent.mkdir(parents=True, exist_ok=True)
+        tmp = location.with_name(location.name + '.tmp')
+        with open(tmp.as_posix(), 'wb') as f:
+            marshal.dump(hashes, f)
+        os.replace(tmp.as_posix(), location.as_posix())
+    except OSError:
+        pass
+
+
+def context_fingerprint(context: Path, dockerfile: str = 'Dockerfile') -> typing.Optional[str]:
+    if not context.is_dir():
+        return None
+    location = _hash_cache_location(context)
+    known = _load_hash_cache(location)
+    hashes = {}
+    h = hashlib.sha256()
+    files = context_files(context)
+    if dockerfile not in files and (context / dockerfile).is_file():
+        # docker always sends the Dockerfile, even when it is ignored
+        files.append(dockerfile)
+    for relative in files:
+        fname = context / relative
+        try:
+            st = os.stat(fname.as_posix())
+        except FileNotFoundError:
+            # dangling symlink
+            continue
+        stat_key = (st.st_size, st.st_mtime_ns, st.st_ino)
+        entry = known.get(relative)
+        if entry is not None and tuple(entry[:3]) == stat_key:
+            digest = entry[3]
+        else:
+            digest = build_cache.file_hash(fname)
+        hashes[relative] = (*stat_key, digest)
+        h.update('{path}\0{digest}\n'.format(path=relative, digest=digest).encode('utf-8'))
+    if hashes != known:
+        _store_hash_cache(location, hashes)
+    return h.hexdigest()
+
+
+def build_fingerprint(base_dir: Path, dckr: DockerService) -> typing.Optional[str]:
+    source = dckr.get_source_path()
+    if source is None:
+        return None
+    build = dckr.export_data_dict().get('build', {})
+    dockerfile = build.get('dockerfile', 'Dockerfile') if isinstance(build, dict) else 'Dockerfile'
+    return context_fingerprint(base_dir / source, dockerfile)
+
+
+def config_fingerprint(dckr: DockerService) -> str:
+    data = json.dumps(dckr.fingerprint_data(), sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def service_fingerprint(base_dir: Path, dckr: DockerService) -> typing.Dict[str, typing.Optional[str]]:
+    return {
+        'build': build_fingerprint(base_dir, dckr),
+        'config': config_fingerprint(dckr),
+    }
+
+
+def plan_compose_up(compose: DockerCompose,
+                    base_dir: Path,
+                    dockers: typing.Optional[typing.Sequence[typing.Optional[DockerService]]],
+                    force: bool = False) \
+        -> (typing.List[str], typing.List[str], typing.Dict[str, typing.Dict[str, typing.Optional[str]]]):
+    # Splits the services to bring up into (to rebuild, to recreate without build)
+    # With dockers None all services of the compose file are considered, an empty list considers none
+    # Services without a running container are always brought up, with force all considered services are rebuild
+    # Replicas are always recreated (after the rebuilds), they have no fingerprint of their own
+    if dockers is not None:
+        names = [d.get_fullname() for d in dockers if d is not None]
+    else:
+        names = list(compose.get_all_docker_names())
+    replicas = {name: compose.get_replica_names(name) for name in names}
+    # stopped and crashed containers are started again, like a plain `up -d` would
+    running = {c['Name'].lstrip('/')
+               for c in docker_inspect_all(*names, *(r for n in names for r in replicas[n]))
+               if c.get('State', {}).get('Running')}
+    rebuild = []
+    recreate = []
+    fingerprints = {}
+    for name in names:
+        dckr = compose.get_docker(name)
+        if dckr is None:
+            continue
+        new = service_fingerprint(base_dir, dckr)
+        old = compose.meta.get_fingerprint(name)
+        fingerprints[name] = new
+        if force or old.get('build') != new['build']:
+            rebuild.append(name)
+        elif old.get('config') != new['config'] or name not in running:
+            recreate.append(name)
+        # replicas run the image of their docker: recreated with it, or started when missing (scaling up)
+        changed = name in rebuild or name in recreate
+        recreate.extend(r for r in replicas[name] if changed or r not in running)
+    return rebuild, recreate, fingerprints
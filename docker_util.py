@@ -1,20 +1,117 @@
 import itertools
 import json
+import os
 import re
 import subprocess
 import time
 import typing
+import uuid
 from pathlib import Path
 
+from ContainerRun import ContainerRun
+from DockerApi import DockerApi
 from DockerService import DockerService
 
+# Backends for inspecting, removing and pulling:
+#   cli: `sudo docker ...` (original behaviour)
+#   api: the Docker Engine API over the unix socket ($DOCKER_HOST or /var/run/docker.sock), with persistent connections.
+#        The current user needs access to the socket.
+# Running and building containers always goes through the cli
+DOCKER_BACKENDS = ('cli', 'api')
+docker_backend = os.environ.get('MANAGER_DOCKER_BACKEND', 'cli')
+
+_docker_api = None  # type: typing.Optional[DockerApi]
+
+
+def set_docker_backend(backend: str, socket_path: str = None) -> None:
+    global docker_backend, _docker_api
+    if backend not in DOCKER_BACKENDS:
+        raise ValueError('Unknown docker backend {backend}'.format(backend=backend))
+    docker_backend = backend
+    if socket_path is not None:
+        _docker_api = DockerApi(socket_path)
+
+
+def get_docker_api() -> typing.Optional[DockerApi]:
+    # The API client when the api backend is active
+    global _docker_api
+    if docker_backend != 'api':
+        return None
+    if _docker_api is None:
+        _docker_api = DockerApi()
+    return _docker_api
+
+
+def _template_value(data: typing.Any, path: str) -> typing.Any:
+    for key in path.split('.'):
+        if key:
+            data = data.get(key) if isinstance(data, dict) else None
+    return data
+
+
+def _template_str(value: typing.Any) -> str:
+    # printed the way go templates print them
+    if value is None:
+        return '<no value>'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def render_go_template(go_template: str, data: typing.Any) -> str:
+    # Evaluates the subset of go templates used with `docker inspect --format` in this project:
+    # `{{.Field.Path}}`, `{{json .Field.Path}}` and `{{range .Field}}...{{end}}`
+    parts = re.split(r'{{\s*(.*?)\s*}}', go_template)
+
+    def render(start: int, dot: typing.Any) -> (str, int):
+        out = []
+        i = start
+        while i < len(parts):
+            if i % 2 == 0:
+                out.append(parts[i])
+                i += 1
+                continue
+            action = parts[i]
+            if action == 'end':
+                return ''.join(out), i + 1
+            if action.startswith('range '):
+                items = _template_value(dot, action[len('range '):].strip())
+                if isinstance(items, dict):
+                    items = [items[k] for k in sorted(items)]
+                end = None
+                for item in items or []:
+                    text, end = render(i + 1, item)
+                    out.append(text)
+                if end is None:
+                    _, end = render(i + 1, None)
+                i = end
+                continue
+            if action.startswith('json '):
+                out.append(json.dumps(_template_value(dot, action[len('json '):].strip()), separators=(',', ':')))
+            elif action.startswith('.'):
+                out.append(_template_str(_template_value(dot, action)))
+            else:
+                raise ValueError('Unsupported template action {action}'.format(action=action))
+            i += 1
+        return ''.join(out), i
+
+    return render(0, data)[0]
+
 
 def wait_for_finish(docker_ident: str, sleeptime=0.5) -> None:
-    status = get_status(docker_ident)
-    while status == 'running':
-        time.sleep(sleeptime)
-        status = get_status(docker_ident)
-    return
+    # sleeptime is no longer used, `docker wait` blocks until the container stopped
+    docker_wait(docker_ident)
+
+
+def docker_wait(*docker_idents: str) -> typing.List[int]:
+    # Blocks until all containers stopped, returns their exit codes
+    if not docker_idents:
+        return []
+    api = get_docker_api()
+    if api is not None:
+        return [api.wait_container(ident) for ident in docker_idents]
+    res = subprocess.check_output(['sudo', 'docker', 'wait', *docker_idents], universal_newlines=True)
+    return [int(code) for code in res.split()]
 
 
 def get_status(docker_ident: str) -> str:
@@ -22,6 +119,10 @@ def get_status(docker_ident: str) -> str:
 
 
 def docker_inspect(docker_ident: str, go_template: str = None) -> str:
+    api = get_docker_api()
+    if api is not None:
+        data = api.inspect(docker_ident)
+        return render_go_template(go_template, data) if go_template is not None else json.dumps([data], indent=4)
     cmd = ['sudo', 'docker', 'inspect', docker_ident]
     if go_template is not None:
         cmd.append('--format=\'{go_template}\''.format(go_template=go_template))
@@ -31,6 +132,10 @@ def docker_inspect(docker_ident: str, go_template: str = None) -> str:
 
 
 def docker_network_inspect(network_ident: str, go_template: str = None) -> str:
+    api = get_docker_api()
+    if api is not None:
+        data = api.inspect_network(network_ident)
+        return render_go_template(go_template, data) if go_template is not None else json.dumps([data], indent=4)
     cmd = ['sudo', 'docker', 'network', 'inspect', network_ident]
     if go_template is not None:
         cmd.append('--format=\'{go_template}\''.format(go_template=go_template))
@@ -39,6 +144,29 @@ def docker_network_inspect(network_ident: str, go_template: str = None) -> str:
     return m.group(1)
 
 
+def docker_inspect_all(*docker_idents: str, object_type: str = 'container') -> typing.List[dict]:
+    # Full inspect data of several objects in one call, missing objects are left out
+    if not docker_idents:
+        return []
+    api = get_docker_api()
+    if api is not None:
+        inspect = {'container': api.inspect_container, 'image': api.inspect_image,
+                   'network': api.inspect_network}[object_type]
+        found = []
+        for ident in docker_idents:
+            try:
+                found.append(inspect(ident))
+            except subprocess.CalledProcessError:
+                pass
+        return found
+    cmd = ['sudo', 'docker', 'inspect', '--type={object_type}'.format(object_type=object_type), *docker_idents]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    try:
+        return json.loads(proc.stdout)
+    except ValueError:
+        return []
+
+
 def get_exit_code(docker_ident: str) -> str:
     return docker_inspect(docker_ident, '{{.State.ExitCode}}')
 
@@ -56,6 +184,13 @@ def get_networks_from_container(container_ident: str) -> typing.KeysView[str]:
 
 
 def network_remove(*network_ids: str):
+    if not network_ids:
+        return
+    api = get_docker_api()
+    if api is not None:
+        for network_id in network_ids:
+            api.remove_network(network_id)
+        return
     cmd = ['sudo', 'docker', 'network', 'rm', *network_ids]
     subprocess.run(cmd, check=True)
 
@@ -73,16 +208,39 @@ def convert_kwargs(**kwargs: typing.Union[typing.List[str], str]) \
 
 
 def docker_pull(name: str):
+    api = get_docker_api()
+    if api is not None:
+        api.pull_image(name)
+        return
     subprocess.run(['sudo', 'docker', 'pull', '-q', name], check=True)
 
 
 def docker_remove(docker: str, forced: bool = False):
+    api = get_docker_api()
+    if api is not None:
+        api.remove_container(docker, forced)
+        return
     opt = []
     if forced:
         opt.append('-f')
     subprocess.run(['sudo', 'docker', 'rm', *opt, docker], check=True)
 
 
+def docker_remove_all(*dockers: str, forced: bool = False):
+    # Removes several containers with a single call
+    if not dockers:
+        return
+    api = get_docker_api()
+    if api is not None:
+        for docker in dockers:
+            api.remove_container(docker, forced)
+        return
+    opt = []
+    if forced:
+        opt.append('-f')
+    subprocess.run(['sudo', 'docker', 'rm', *opt, *dockers], check=True, stdout=subprocess.DEVNULL)
+
+
 def docker_run(docker_image: str,
                *args: str,
                temporary: bool = True,
@@ -91,11 +249,17 @@ def docker_run(docker_image: str,
                stdout: typing.Union[int, None, typing.IO] = None,
                fail_on_nonzero_exit: bool = True,
                **kwargs: typing.Union[str, typing.List[str]]) \
-        -> subprocess.CompletedProcess:
+        -> ContainerRun:
+    # Runs a container attached, so the exit code of `docker run` is the exit code of the container
+    # Containers are given a name, which identifies them afterwards without a cidfile
+    # Detached (`-d`) containers are returned right away, use docker_wait for their exit code
     if isinstance(docker_args, str):
         a = [docker_args]
     else:
         a = docker_args
+    detached = '-d' in args or '--detach' in args
+    if 'name' not in kwargs:
+        kwargs['name'] = 'manager-run-{id}'.format(id=uuid.uuid4().hex[:12])
     if temporary:
         args = itertools.chain(args, ['--rm'])
 
@@ -106,9 +270,44 @@ def docker_run(docker_image: str,
     all_args = ['sudo', 'docker', 'run',
                 *args, *build_envs, *converted_kwargs,
                 docker_image, *(a if a is not None else [])]
+    start = time.monotonic()
     proc = subprocess.run(args=all_args, check=fail_on_nonzero_exit, stdout=stdout)
-    # proc = subprocess.run(['echo', 'test'], check=fail_on_nonzero_exit, stdout=stdout)
-    return proc
+    return ContainerRun(all_args, kwargs['name'],
+                        None if detached and proc.returncode == 0 else proc.returncode,
+                        time.monotonic() - start, proc.stdout, detached)
+
+
+def docker_exec(container: str,
+                *args: str,
+                docker_args: typing.Optional[typing.Union[str, typing.List[str]]] = None,
+                environment: typing.Dict[str, str] = None,
+                stdout: typing.Union[int, None, typing.IO] = None,
+                fail_on_nonzero_exit: bool = True,
+                **kwargs: typing.Union[str, typing.List[str]]) \
+        -> subprocess.CompletedProcess:
+    # Runs a command inside an already running container
+    if isinstance(docker_args, str):
+        a = [docker_args]
+    else:
+        a = docker_args
+
+    envs = itertools.chain.from_iterable(['-e', '{k}={v}'.format(k=k, v=v)] for k, v in environment.items()) \
+        if environment is not None else []
+
+    converted_kwargs = convert_kwargs(**kwargs)
+    all_args = ['sudo', 'docker', 'exec',
+                *args, *envs, *converted_kwargs,
+                container, *(a if a is not None else [])]
+    return subprocess.run(args=all_args, check=fail_on_nonzero_exit, stdout=stdout)
+
+
+def docker_image_exists(image: str) -> bool:
+    api = get_docker_api()
+    if api is not None:
+        return api.image_exists(image)
+    proc = subprocess.run(['sudo', 'docker', 'image', 'inspect', image],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return proc.returncode == 0
 
 
 def docker_build(dockerfile_fname: Path, tag: str, *args: str, **kwargs: typing.Union[typing.List[str], str]) -> str:
@@ -127,11 +326,18 @@ def docker_build(dockerfile_fname: Path, tag: str, *args: str, **kwargs: typing.
     return image.group(1)
 
 
-def docker_compose_up(dockers: typing.List[DockerService], directory: Path):
+def docker_compose_up(dockers: typing.List[DockerService],
+                      directory: Path,
+                      build: bool = True,
+                      names: typing.Sequence[str] = None) -> int:
+    # Brings up the given dockers (or names), all dockers when both are empty
     settings = [
-        '--build', '-d', '--remove-orphans',
+        '--build' if build else '--no-build', '-d', '--remove-orphans',
     ]  # type: typing.List[str]
-    if dockers:
+    if names:
+        settings.extend(names)
+    elif dockers:
         settings.extend(docker.get_fullname() for docker in dockers if docker is not None)
     process = subprocess.run(['sudo', 'docker-compose', 'up', *settings],
                              cwd=directory.as_posix())
+    return process.returncode
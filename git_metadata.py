@@ -0,0 +1,199 @@
+import binascii
+import os
+import re
+import typing
+from pathlib import Path
+
+# In-process reader of the metadata inside a `.git` directory
+# Only handles the plain layout created by `git clone`; every function returns None when it cannot answer
+# with certainty (worktrees, submodules, unborn branches, custom abbrev lengths...), callers then fall back to git.
+
+SHA_PATTERN = re.compile(r'^[0-9a-f]{40}$')
+MIN_SHORT_SHA_LENGTH = 7
+
+
+def find_git_dir(location: Path) -> typing.Optional[Path]:
+    git_dir = location / '.git'
+    # a `.git` file (worktree/submodule) points elsewhere, leave those to git
+    if not git_dir.is_dir():
+        return None
+    return git_dir
+
+
+def _read_text(filename: Path) -> typing.Optional[str]:
+    try:
+        with open(filename.as_posix(), 'r') as f:
+            return f.read()
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return None
+
+
+def read_head(git_dir: Path) -> (typing.Optional[str], typing.Optional[str]):
+    # Returns (symbolic ref, sha) of HEAD, only one of both is set
+    head = _read_text(git_dir / 'HEAD')
+    if head is None:
+        return None, None
+    head = head.strip()
+    if head.startswith('ref:'):
+        return head[4:].strip(), None
+    if SHA_PATTERN.match(head):
+        return None, head
+    return None, None
+
+
+def read_packed_refs(git_dir: Path) -> typing.Dict[str, str]:
+    packed = _read_text(git_dir / 'packed-refs')
+    refs = {}  # type: typing.Dict[str, str]
+    if packed is None:
+        return refs
+    for line in packed.splitlines():
+        # comments (`# pack-refs with:`) and peeled tags (`^<sha>`) are not refs themselves
+        if not line or line[0] in '#^':
+            continue
+        sha, _, ref = line.partition(' ')
+        if SHA_PATTERN.match(sha):
+            refs[ref.strip()] = sha
+    return refs
+
+
+def resolve_ref(git_dir: Path, ref: str, depth: int = 5) -> typing.Optional[str]:
+    if depth <= 0 or '..' in ref:
+        return None
+    loose = _read_text(git_dir / ref)
+    if loose is not None:
+        loose = loose.strip()
+        if loose.startswith('ref:'):
+            return resolve_ref(git_dir, loose[4:].strip(), depth - 1)
+        return loose if SHA_PATTERN.match(loose) else None
+    return read_packed_refs(git_dir).get(ref)
+
+
+def get_branch_name(location: Path) -> typing.Optional[str]:
+    # Same as `git rev-parse --abbrev-ref HEAD`: the branch name, or HEAD when detached
+    git_dir = find_git_dir(location)
+    if git_dir is None:
+        return None
+    ref, sha = read_head(git_dir)
+    if sha is not None:
+        return 'HEAD'
+    if ref is None or not ref.startswith('refs/heads/'):
+        return None
+    if resolve_ref(git_dir, ref) is None:
+        # unborn branch, git itself fails on this
+        return None
+    return ref[len('refs/heads/'):]
+
+
+def get_full_commit_sha(location: Path) -> typing.Optional[str]:
+    git_dir = find_git_dir(location)
+    if git_dir is None:
+        return None
+    ref, sha = read_head(git_dir)
+    if sha is not None:
+        return sha
+    if ref is None:
+        return None
+    return resolve_ref(git_dir, ref)
+
+
+def _pack_index_files(git_dir: Path) -> typing.Optional[typing.List[Path]]:
+    pack_dir = git_dir / 'objects' / 'pack'
+    try:
+        names = os.listdir(pack_dir.as_posix())
+    except FileNotFoundError:
+        return []
+    except PermissionError:
+        return None
+    if 'multi-pack-index' in names:
+        return None
+    return [pack_dir / n for n in names if n.endswith('.idx')]
+
+
+def _read_pack_index(idx_fname: Path) -> typing.Optional[bytes]:
+    # Header and fanout table of a pack index (v2), None for unknown index formats
+    try:
+        with open(idx_fname.as_posix(), 'rb') as f:
+            header = f.read(8 + 256 * 4)
+    except (FileNotFoundError, PermissionError):
+        return None
+    if header[:8] != b'\377tOc\x00\x00\x00\x02' or len(header) != 8 + 256 * 4:
+        return None
+    return header[8:]
+
+
+def _packed_shas_with_prefix(idx_fname: Path, prefix: str) -> typing.Optional[typing.Set[str]]:
+    # Objects in a pack index whose sha starts with prefix
+    fanout = _read_pack_index(idx_fname)
+    if fanout is None:
+        return None
+    first = int(prefix[:2], 16)
+    start = int.from_bytes(fanout[(first - 1) * 4:first * 4], 'big') if first > 0 else 0
+    end = int.from_bytes(fanout[first * 4:(first + 1) * 4], 'big')
+    with open(idx_fname.as_posix(), 'rb') as f:
+        f.seek(8 + 256 * 4 + start * 20)
+        names = f.read((end - start) * 20)
+    shas = (binascii.hexlify(names[i:i + 20]).decode('ascii') for i in range(0, len(names), 20))
+    return {sha for sha in shas if sha.startswith(prefix)}
+
+
+def default_abbrev_length(git_dir: Path) -> typing.Optional[int]:
+    # git scales the default abbreviation with the (packed) object count: ceil(bits / 2), at least 7
+    idx_files = _pack_index_files(git_dir)
+    if idx_files is None:
+        return None
+    count = 0
+    for idx in idx_files:
+        fanout = _read_pack_index(idx)
+        if fanout is None:
+            return None
+        count += int.from_bytes(fanout[-4:], 'big')
+    return max(MIN_SHORT_SHA_LENGTH, (count.bit_length() + 1) // 2)
+
+
+def is_unique_prefix(git_dir: Path, sha: str, length: int) -> typing.Optional[bool]:
+    # Whether the first `length` characters of sha identify exactly one object (loose or packed)
+    # None if the object database could not be read
+    prefix = sha[:length]
+    found = set()  # type: typing.Set[str]
+    try:
+        found.update(prefix[:2] + n for n in os.listdir((git_dir / 'objects' / prefix[:2]).as_posix())
+                     if n.startswith(prefix[2:]))
+    except FileNotFoundError:
+        pass
+    except PermissionError:
+        return None
+    idx_files = _pack_index_files(git_dir)
+    if idx_files is None:
+        return None
+    for idx in idx_files:
+        packed = _packed_shas_with_prefix(idx, prefix)
+        if packed is None:
+            return None
+        found.update(packed)
+    if sha not in found:
+        return None
+    return len(found) == 1
+
+
+def get_short_commit_sha(location: Path) -> typing.Optional[str]:
+    # Same as `git rev-parse --short HEAD`
+    git_dir = find_git_dir(location)
+    if git_dir is None:
+        return None
+    config = _read_text(git_dir / 'config')
+    if config is None or re.search(r'^\s*abbrev\s*=', config, re.MULTILINE | re.IGNORECASE):
+        return None
+    sha = get_full_commit_sha(location)
+    if sha is None:
+        return None
+    length = default_abbrev_length(git_dir)
+    if length is None:
+        return None
+    while length < len(sha):
+        unique = is_unique_prefix(git_dir, sha, length)
+        if unique is None:
+            return None
+        if unique:
+            break
+        length += 1
+    return sha[:length]
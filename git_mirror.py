@@ -0,0 +1,81 @@
+import hashlib
+import os
+import re
+import typing
+from pathlib import Path
+
+import cache_util
+
+# Host-wide cache of bare mirrors of the remote repositories, shared by all projects
+# Clones are made from the (refreshed) local mirror instead of downloading from the remote again.
+# Set MANAGER_GIT_MIRRORS to an empty string to disable the cache.
+
+mirror_root = os.environ.get('MANAGER_GIT_MIRRORS', './git-mirrors')
+# Mirrors that have not been used the longest are removed once all mirrors together exceed this size
+mirror_budget = int(os.environ.get('MANAGER_GIT_MIRROR_BUDGET', str(10 * 1024 ** 3)))
+
+# git clone options that take a separate value
+_CLONE_VALUE_OPTIONS = {
+    '-b', '--branch', '--depth', '-o', '--origin', '-u', '--upload-pack', '--reference', '--reference-if-able',
+    '-c', '--config', '-j', '--jobs', '--shallow-since', '--shallow-exclude', '--filter', '--separate-git-dir',
+    '--template', '--server-option',
+}
+# git clone options making a shallow clone, a clone from a local path hardlinks all objects instead
+_SHALLOW_OPTIONS = {'--depth', '--shallow-since', '--shallow-exclude', '--shallow-submodules'}
+
+
+def get_mirror_root() -> typing.Optional[Path]:
+    if not mirror_root:
+        return None
+    return Path(mirror_root).resolve()
+
+
+def mirror_location(url: str) -> typing.Optional[Path]:
+    # Mirror directory of a remote, the readable part is only to help humans browsing the cache
+    root = get_mirror_root()
+    if root is None:
+        return None
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', url.rstrip('/').split('/')[-1])[:40]
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+    return root / '{name}-{key}'.format(name=name, key=key)
+
+
+def split_clone_url(git_settings: typing.Sequence[str]) -> (typing.Optional[str], typing.List[str]):
+    # Separates the repository url from the other `git clone` arguments
+    rest = []
+    url = None
+    it = iter(git_settings)
+    for arg in it:
+        if arg in _CLONE_VALUE_OPTIONS:
+            rest.append(arg)
+            value = next(it, None)
+            if value is not None:
+                rest.append(value)
+        elif url is None and not arg.startswith('-'):
+            url = arg
+        else:
+            rest.append(arg)
+    return url, rest
+
+
+def local_clone_settings(settings: typing.Sequence[str]) -> typing.List[str]:
+    # The clone options without the shallow ones, git ignores them for local clones (and warns about it)
+    # A full clone from the mirror costs no extra space, its objects are hardlinks into the mirror
+    rest = []
+    it = iter(settings)
+    for arg in it:
+        option = arg.split('=', 1)[0]
+        if option in _SHALLOW_OPTIONS:
+            if '=' not in arg and option in _CLONE_VALUE_OPTIONS:
+                next(it, None)
+        else:
+            rest.append(arg)
+    return rest
+
+
+def evict_mirrors(budget: int = None, keep: typing.Iterable[Path] = (), quiet: bool = False) -> typing.List[Path]:
+    # Removes the least recently used mirrors until the cache fits in the budget
+    root = get_mirror_root()
+    if root is None:
+        return []
+    return cache_util.evict_lru(root, mirror_budget if budget is None else budget, keep, quiet)
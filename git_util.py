@@ -2,39 +2,127 @@ import getpass
 import itertools
 import os
 import re
+import shlex
 import shutil
 import subprocess
 import tempfile
+import threading
 import typing
 from pathlib import Path
 from typing import Sequence, Optional
 
-import tail
-from docker_util import docker_run, wait_for_finish, docker_remove
+import cache_util
+import git_metadata
+import git_mirror
+from RepoState import RepoState
+from docker_util import docker_run, docker_exec, docker_inspect, docker_remove
 from util import test_location, chown_as_sudo
 
 
+GIT_IMAGE = 'bitnami/git'
+
+# Backends that can execute git commands:
+#   run:  a fresh git container per command (original behaviour)
+#   exec: a long-lived git worker container per project, commands are send through `docker exec`
+#   host: the git binary installed on the host itself
+GIT_BACKENDS = ('run', 'exec', 'host')
+git_backend = os.environ.get('MANAGER_GIT_BACKEND', 'exec')
+
+_running_workers = set()  # type: typing.Set[str]
+_worker_lock = threading.Lock()
+
+
+def set_git_backend(backend: str) -> None:
+    global git_backend
+    if backend not in GIT_BACKENDS:
+        raise ValueError('Unknown git backend {backend}'.format(backend=backend))
+    git_backend = backend
+
+
+def git_worker_name(project_dir: Path) -> str:
+    return '{basename}.git-worker'.format(basename=project_dir.resolve().parts[-1])
+
+
+def start_git_worker(project_dir: Path) -> str:
+    # Starts (or reuses) the git worker of a project
+    # The project directory is mounted on the same path inside the worker, so host paths can be used as workdir
+    name = git_worker_name(project_dir)
+    with _worker_lock:
+        if name in _running_workers:
+            return name
+        shared = [project_dir.resolve().as_posix()]
+        mirrors = git_mirror.get_mirror_root()
+        if mirrors is not None:
+            mirrors.mkdir(parents=True, exist_ok=True)
+            shared.append(mirrors.as_posix())
+        try:
+            state = docker_inspect(name, '{{.State.Running}}{{range .Mounts}} {{.Destination}}{{end}}').split()
+            # a worker missing one of the shared directories is replaced
+            running = state[0] == 'true' and all(s in state[1:] for s in shared)
+        except subprocess.CalledProcessError:
+            running = False
+        if not running:
+            try:
+                docker_remove(name, True)
+            except subprocess.CalledProcessError:
+                pass
+            docker_run(GIT_IMAGE, '-d',
+                       volume=[
+                           *('{s}:{s}'.format(s=s) for s in shared),
+                           '{home}/:/root/'.format(home=Path.home().resolve().as_posix()),
+                       ],
+                       docker_args=['sh', '-c', 'trap "exit 0" TERM; while true; do sleep 3600 & wait; done'],
+                       stdout=subprocess.DEVNULL,
+                       name=name,
+                       )
+        _running_workers.add(name)
+        return name
+
+
+def stop_git_worker(project_dir: Path) -> None:
+    name = git_worker_name(project_dir)
+    with _worker_lock:
+        _running_workers.discard(name)
+    try:
+        docker_remove(name, True)
+    except subprocess.CalledProcessError:
+        pass
+
+
 def git_docker_run(git_location: Path,
                    git_args: typing.Iterable[str],
                    nosafefix: bool = False,
                    get_output: bool = False) \
         -> (subprocess.CompletedProcess, typing.Union[str, None]):
+    # Runs git inside a new container (`run` backend)
+    return git_shell_run(git_location, "git " + ' '.join(git_args), nosafefix, get_output)
 
+
+def git_shell_run(git_location: Path,
+                  script: str,
+                  nosafefix: bool = False,
+                  get_output: bool = False) \
+        -> (subprocess.CompletedProcess, typing.Union[str, None]):
     if nosafefix:
-        docker_args = ['sh', '-c', "git config --global --add safe.directory /git && git " + ' '.join(git_args)]
+        docker_args = ['sh', '-c', "git config --global --add safe.directory /git && " + script]
     else:
-        docker_args = ['sh', '-c', "git " + ' '.join(git_args)]
+        docker_args = ['sh', '-c', script]
+
+    volumes = [
+        '{host}:/git'.format(host=git_location.resolve().as_posix()),
+        '{home}/:/root/'.format(home=Path.home().resolve().as_posix()),
+    ]
+    mirrors = git_mirror.get_mirror_root()
+    if mirrors is not None:
+        mirrors.mkdir(parents=True, exist_ok=True)
+        volumes.append('{mirrors}:{mirrors}'.format(mirrors=mirrors.as_posix()))
 
     output = None
     with tempfile.TemporaryFile() as out_file:
-        retcode = docker_run('bitnami/git', '-it',
+        retcode = docker_run(GIT_IMAGE, '-it',
                              '--workdir=/git',
-                             volume=[
-                                 '{host}:/git'.format(host=git_location.resolve().as_posix()),
-                                 '{home}/:/root/'.format(home=Path.home().resolve().as_posix()),
-                             ],
+                             volume=volumes,
                              docker_args=docker_args,
-                             cidfile='./tmp/git-cid',
                              stdout=out_file if get_output else None,
                              fail_on_nonzero_exit=False,
                              )
@@ -45,35 +133,94 @@ def git_docker_run(git_location: Path,
     return retcode, output
 
 
+def git_shell_exec(git_location: Path,
+                   script: str,
+                   project_dir: Path,
+                   get_output: bool = False) \
+        -> (subprocess.CompletedProcess, typing.Union[str, None]):
+    # Runs a shell script in the long-lived git worker of the project (`exec` backend)
+    worker = start_git_worker(project_dir)
+    output = None
+    with tempfile.TemporaryFile() as out_file:
+        retcode = docker_exec(worker,
+                              docker_args=['sh', '-c', script],
+                              environment={
+                                  # command line scoped config, does not touch the mounted ~/.gitconfig
+                                  'GIT_CONFIG_COUNT': '1',
+                                  'GIT_CONFIG_KEY_0': 'safe.directory',
+                                  'GIT_CONFIG_VALUE_0': '*',
+                              },
+                              stdout=out_file if get_output else None,
+                              fail_on_nonzero_exit=False,
+                              workdir=git_location.resolve().as_posix(),
+                              )
+        if get_output:
+            out_file.seek(0)
+            output = out_file.read().decode('utf-8').strip()
+    return retcode, output
+
+
+def git_shell_host(git_location: Path,
+                   script: str,
+                   get_output: bool = False) \
+        -> (subprocess.CompletedProcess, typing.Union[str, None]):
+    # Runs a shell script with the git installed on the host (`host` backend)
+    if not git_location.is_dir():
+        return subprocess.CompletedProcess(args=['sh', '-c', script], returncode=128), None
+    retcode = subprocess.run(['sh', '-c', script],
+                             cwd=git_location.resolve().as_posix(),
+                             stdout=subprocess.PIPE if get_output else None)
+    output = retcode.stdout.decode('utf-8').strip() if get_output else None
+    return retcode, output
+
+
+def git_shell(git_location: Path,
+              script: str,
+              project_dir: Path = None,
+              nosafefix: bool = False,
+              get_output: bool = False) \
+        -> (subprocess.CompletedProcess, typing.Union[str, None]):
+    # Runs a shell script (using git) inside `git_location` through the selected backend
+    # project_dir is the directory shared by all services of a project, one git worker exists per project
+    if git_backend == 'host':
+        return git_shell_host(git_location, script, get_output)
+    if git_backend == 'exec':
+        if project_dir is None:
+            project_dir = git_location
+        return git_shell_exec(git_location, script, project_dir, get_output)
+    return git_shell_run(git_location, script, nosafefix, get_output)
+
+
+def run_git(git_location: Path,
+            git_args: typing.Iterable[str],
+            project_dir: Path = None,
+            nosafefix: bool = False,
+            get_output: bool = False) \
+        -> (subprocess.CompletedProcess, typing.Union[str, None]):
+    return git_shell(git_location, "git " + ' '.join(git_args), project_dir, nosafefix, get_output)
+
+
 def load_git(base_dir: Path,
              name: str,
              git_settings: typing.Iterable[str],
              overwrite: bool = False,
              no_overwrite: bool = False,
              quiet: bool = False) -> (Path, subprocess.CompletedProcess):
-    try:
-        os.remove('./tmp/git-cid')
-    except FileNotFoundError:
-        pass
     location = base_dir / name / 'javascript'
     if test_location(location, overwrite, quiet or no_overwrite):
         shutil.rmtree(location.as_posix())
 
     settings = list(git_settings)
-    if all(re.fullmatch('--depth', elem) is None for elem in git_settings):
+    if all(re.fullmatch('--depth', elem) is None for elem in settings):
         settings.extend(['--depth', '1'])
 
     if not quiet:
         print('Loading git into {location}'.format(location=location))
     try:
-        retcode, _ = git_docker_run(base_dir / name, git_args=['clone', *settings, 'javascript'], nosafefix=True)
-        with open('./tmp/git-cid') as f:
-            docker_id = tail.tail(f, 1)
-        try:
-            wait_for_finish(docker_id, 1)
-            docker_remove(docker_id)
-        except subprocess.CalledProcessError:
-            pass
+        retcode = clone_from_mirror(base_dir, name, settings, quiet)
+        if retcode is None:
+            retcode, _ = run_git(base_dir / name, git_args=['clone', *settings, 'javascript'],
+                                 project_dir=base_dir, nosafefix=True)
     finally:
         usr = getpass.getuser()
         group = os.getegid()
@@ -81,14 +228,68 @@ def load_git(base_dir: Path,
     return location, retcode
 
 
+_refreshed_mirrors = set()  # type: typing.Set[str]
+
+
+def refresh_mirror(url: str, mirror: Path, project_dir: Path, quiet: bool = False) -> bool:
+    # Creates or fetches the mirror of url, at most once per run; the mirror must be locked by the caller
+    if mirror.as_posix() in _refreshed_mirrors:
+        return True
+    q = shlex.quote
+    existing = (mirror / 'HEAD').exists()
+    if existing:
+        if not quiet:
+            print('Refreshing git mirror {mirror}'.format(mirror=mirror))
+        script = "git -c safe.directory='*' fetch -q --prune origin"
+    else:
+        if not quiet:
+            print('Creating git mirror {mirror}'.format(mirror=mirror))
+        mirror.mkdir(parents=True, exist_ok=True)
+        script = "git -c safe.directory='*' clone -q --mirror {url} .".format(url=q(url))
+    try:
+        retcode, _ = git_shell(mirror, script, project_dir=project_dir)
+    finally:
+        chown_as_sudo(mirror, getpass.getuser(), str(os.getegid()), '-R')
+    if retcode.returncode != 0:
+        # a failed fetch (e.g. network) leaves the mirror usable for the next run, a failed clone leaves a partial one
+        if not existing:
+            shutil.rmtree(mirror.as_posix(), ignore_errors=True)
+        return False
+    _refreshed_mirrors.add(mirror.as_posix())
+    return True
+
+
+def clone_from_mirror(base_dir: Path,
+                      name: str,
+                      git_settings: typing.Sequence[str],
+                      quiet: bool = False) -> typing.Optional[subprocess.CompletedProcess]:
+    # Clones into `<base_dir>/<name>/javascript` from the local mirror of the repository
+    # The mirror is cloned by path, git then hardlinks its objects (copies them when the mirror is on another
+    # filesystem or mount, as in the git containers). The clone keeps the real remote as origin.
+    # None when no mirror could be used
+    url, settings = git_mirror.split_clone_url(git_settings)
+    mirror = git_mirror.mirror_location(url) if url is not None else None
+    if mirror is None:
+        return None
+    q = shlex.quote
+    with cache_util.lock_entry(mirror):
+        if not refresh_mirror(url, mirror, base_dir, quiet):
+            return None
+        cache_util.mark_used(mirror)
+        script = "git -c safe.directory='*' clone {settings} {mirror} javascript && " \
+                 "git -C javascript remote set-url origin {url}".format(
+                     settings=' '.join(q(s) for s in git_mirror.local_clone_settings(settings)),
+                     mirror=q(mirror.as_posix()),
+                     url=q(url))
+        retcode, _ = git_shell(base_dir / name, script, project_dir=base_dir)
+    git_mirror.evict_mirrors(keep=[mirror], quiet=quiet)
+    return retcode
+
+
 def clean_update(base_dir: Path,
                  name: str,
                  git_settings: typing.Sequence[str] = None,
                  quiet: bool = False):
-    try:
-        os.remove('./tmp/git-cid')
-    except FileNotFoundError:
-        pass
     location = base_dir / name / 'javascript'
     backup_location = base_dir / name / 'javascript_backup'
     url = None
@@ -125,18 +326,90 @@ def clean_update(base_dir: Path,
     return ret_code
 
 
+# Ref holding the commit that was checked out before the last incremental update
+PREVIOUS_REF = 'refs/manager/previous'
+
+
+def incremental_update_script(ref: str, fetch_args: typing.Sequence[str], url: typing.Optional[str] = None) -> str:
+    # Fetches only `ref` (branch, tag or sha) into the existing repository and checks it out in place
+    # Branches stay checked out as branch, tags and shas are detached, just like `git clone -b` does
+    # The previous commit is kept in PREVIOUS_REF and restored when anything fails
+    q = shlex.quote
+    fetch = 'git fetch -q {args} origin'.format(args=' '.join(q(a) for a in fetch_args))
+    update = (
+        '{{ {fetch} {branch_spec} 2>/dev/null && git checkout -q -f -B {ref} {remote_ref}; }} || '
+        '{{ {fetch} {tag_spec} 2>/dev/null && git checkout -q -f --detach {tag_ref}; }} || '
+        '{{ {fetch} {ref} && git checkout -q -f --detach FETCH_HEAD; }}'
+    ).format(fetch=fetch,
+             ref=q(ref),
+             branch_spec=q('+refs/heads/{ref}:refs/remotes/origin/{ref}'.format(ref=ref)),
+             remote_ref=q('refs/remotes/origin/{ref}'.format(ref=ref)),
+             tag_spec=q('+refs/tags/{ref}:refs/tags/{ref}'.format(ref=ref)),
+             tag_ref=q('refs/tags/{ref}'.format(ref=ref)))
+    set_url = 'git remote set-url origin {url} && '.format(url=q(url)) if url is not None else ''
+    return (
+        'old_sha=$(git rev-parse -q --verify HEAD) || exit 1; '
+        'old_branch=$(git symbolic-ref -q --short HEAD); '
+        'old_url=$(git remote get-url origin); '
+        'git update-ref {previous} "$old_sha" || exit 1; '
+        '{set_url}{update} && exit 0; '
+        'echo "Update failed, restoring $old_sha" >&2; '
+        'git remote set-url origin "$old_url"; '
+        'if [ -n "$old_branch" ]; then git checkout -q -f -B "$old_branch" "$old_sha"; '
+        'else git checkout -q -f --detach "$old_sha"; fi; '
+        'exit 1'
+    ).format(previous=PREVIOUS_REF, set_url=set_url, update=update)
+
+
+def incremental_update(base_dir: Path,
+                       name: str,
+                       branch: str,
+                       git_settings: typing.Sequence[str] = None,
+                       quiet: bool = False) -> subprocess.CompletedProcess:
+    # Updates the existing checkout in place, only downloading the objects of the requested ref
+    # git_settings may start with a new repository url, the remainder is passed to `git fetch`
+    location = base_dir / name / 'javascript'
+    settings = list(git_settings) if git_settings is not None else []
+    url = None
+    if settings and not settings[0].startswith('-'):
+        url = settings.pop(0)
+    if all(re.fullmatch('--depth', elem) is None for elem in settings):
+        settings.extend(['--depth', '1'])
+
+    if not quiet:
+        print('Updating git in {location} to {branch}'.format(location=location, branch=branch))
+    try:
+        retcode, _ = git_shell(location, incremental_update_script(branch, settings, url), project_dir=base_dir)
+    finally:
+        usr = getpass.getuser()
+        group = os.getegid()
+        chown_as_sudo(base_dir, usr, str(group), '-R')
+    if retcode.returncode != 0:
+        raise ValueError("Git failed")
+    return retcode
+
+
 def update_git(base_dir: Path,
                name: str,
                branch: str = None,
                git_settings: typing.Sequence[str] = None,
-               quiet: bool = False):
-    try:
-        os.remove('./tmp/git-cid')
-    except FileNotFoundError:
-        pass
+               quiet: bool = False,
+               clean: bool = False):
+    # Brings the code of a service to the latest commit of `branch` (or the currently checked out branch)
+    # By default the existing checkout is updated in place, `clean` re-clones the repository instead
     location = base_dir / name / 'javascript'
 
-    if branch is not None:
+    if branch is None:
+        branch = get_current_branch_name(base_dir, name)
+        if branch is None:
+            raise RuntimeError('Existing git not found')
+        if branch == 'HEAD':
+            # a tag or sha is checked out, which stays the same
+            if not quiet:
+                print('{location} is not following a branch, left as is'.format(location=location))
+            return subprocess.CompletedProcess(args=[], returncode=0)
+
+    if clean or not (location / '.git').exists():
         settings = ['-b', branch]
 
         if git_settings is not None:
@@ -144,136 +417,74 @@ def update_git(base_dir: Path,
 
         return clean_update(base_dir, name, settings, quiet)
 
-    settings = list(git_settings)
-    if all(re.fullmatch('--depth', elem) is None for elem in settings):
-        settings.extend(['--depth', '1'])
+    return incremental_update(base_dir, name, branch, git_settings, quiet)
 
-    if not quiet:
-        print('Loading git into {location}'.format(location=location))
-    try:
 
-        retcode, _ = git_docker_run(location, git_args=['fetch', 'origin', *settings], get_output=True)
+def git_output(base_dir: Path,
+               fullname: str,
+               git_args: typing.Iterable[str],
+               nosafefix: bool = False) -> typing.Optional[str]:
+    # Output of a git command inside the code of a service, None when git failed
+    location = base_dir / fullname / 'javascript'
+    proc, stdout = run_git(location, git_args=git_args, project_dir=base_dir, nosafefix=nosafefix, get_output=True)
+    if proc.returncode != 0:
+        return None
+    return stdout
 
-        with open('./tmp/git-cid') as f:
-            docker_id = tail.tail(f, 1)
-        try:
-            wait_for_finish(docker_id, 1)
-            docker_remove(docker_id)
-        except subprocess.CalledProcessError:
-            pass
-    finally:
-        usr = getpass.getuser()
-        group = os.getegid()
-        chown_as_sudo(base_dir, usr, str(group), '-R')
-    return retcode
 
+# The lookups below read the .git directory directly,
+# git itself is only used when that is inconclusive (worktrees, ambiguous abbreviations...)
 
 def get_current_branch_name(base_dir: Path, fullname: str) -> typing.Optional[str]:
-    try:
-        os.remove('./tmp/git-cid')
-    except FileNotFoundError:
-        pass
     location = base_dir / fullname / 'javascript'
-
-    proc, stdout = git_docker_run(location, git_args=['rev-parse', '--abbrev-ref', 'HEAD'], get_output=True)
-
-    if proc.returncode != 0:
-        res = None
-    elif stdout is not None:
-        res = stdout
-    else:
-        res = None
-
-    if proc.returncode == 0:
-        try:
-            os.remove('./tmp/git-cid')
-        except FileNotFoundError:
-            pass
-
-    return res
+    res = git_metadata.get_branch_name(location)
+    if res is not None or not (location / '.git').exists():
+        return res
+    return git_output(base_dir, fullname, ['rev-parse', '--abbrev-ref', 'HEAD'])
 
 
 def get_current_full_commit_sha(base_dir: Path, fullname: str) -> typing.Optional[str]:
-    try:
-        os.remove('./tmp/git-cid')
-    except FileNotFoundError:
-        pass
     location = base_dir / fullname / 'javascript'
-    proc, stdout = git_docker_run(location, git_args=['rev-parse', 'HEAD'], get_output=True)
-
-    if proc.returncode != 0:
-        res = None
-    elif stdout is not None:
-        res = stdout
-    else:
-        res = None
-
-    if proc.returncode == 0:
-        try:
-            os.remove('./tmp/git-cid')
-        except FileNotFoundError:
-            pass
-
-    return res
+    res = git_metadata.get_full_commit_sha(location)
+    if res is not None or not (location / '.git').exists():
+        return res
+    return git_output(base_dir, fullname, ['rev-parse', 'HEAD'])
 
 
 def get_current_short_commit_sha(base_dir: Path, fullname: str) -> typing.Optional[str]:
-    try:
-        os.remove('./tmp/git-cid')
-    except FileNotFoundError:
-        pass
     location = base_dir / fullname / 'javascript'
-    proc, stdout = git_docker_run(location, git_args=['rev-parse', '--short', 'HEAD'], get_output=True)
+    res = git_metadata.get_short_commit_sha(location)
+    if res is not None or not (location / '.git').exists():
+        return res
+    return git_output(base_dir, fullname, ['rev-parse', '--short', 'HEAD'])
 
-    if proc.returncode != 0:
-        res = None
-    elif stdout is not None:
-        res = stdout
-    else:
-        res = None
-
-    if proc.returncode == 0:
-        try:
-            os.remove('./tmp/git-cid')
-        except FileNotFoundError:
-            pass
 
+def get_latest_tag(base_dir: Path, fullname: str) -> typing.Optional[str]:
+    res = git_output(base_dir, fullname, ['describe', '--tags', '--always'])
+    if res is not None and res.startswith("fatal"):
+        res = ""
     return res
 
 
-def get_latest_tag(base_dir: Path, fullname: str) -> typing.Optional[str]:
-    try:
-        os.remove('./tmp/git-cid')
-    except FileNotFoundError:
-        pass
-    location = base_dir / fullname / 'javascript'
-    proc, stdout = git_docker_run(location, git_args=['describe', '--tags', '--always'], get_output=True)
+def get_remote_url(base_dir: Path, fullname: str) -> typing.Optional[str]:
+    return git_output(base_dir, fullname, ['remote', 'get-url', 'origin'], nosafefix=True)
 
-    if proc.returncode != 0:
-        res = None
-    elif stdout is not None:
-        res = stdout
-        if res is not None and res.startswith("fatal"):
-            res = ""
-    else:
-        res = None
 
-    return res
+# Prints every field of RepoState as `key=value`, fields git cannot determine are left out
+REPO_STATE_SCRIPT = (
+    'v=$(git rev-parse --abbrev-ref HEAD 2>/dev/null) && echo "branch=$v"; '
+    'v=$(git rev-parse HEAD 2>/dev/null) && echo "sha=$v"; '
+    'v=$(git rev-parse --short HEAD 2>/dev/null) && echo "short_sha=$v"; '
+    'v=$(git describe --tags --always 2>/dev/null) && echo "tag=$v"; '
+    'v=$(git remote get-url origin 2>/dev/null) && echo "remote=$v"; '
+    'true'
+)
 
 
-def get_remote_url(base_dir: Path, fullname: str) -> typing.Optional[str]:
-    try:
-        os.remove('./tmp/git-cid')
-    except FileNotFoundError:
-        pass
+def get_repo_state(base_dir: Path, fullname: str) -> RepoState:
+    # Branch, commit, tag and remote of the code of a service in a single git invocation
     location = base_dir / fullname / 'javascript'
-    proc, stdout = git_docker_run(location, git_args=['remote', 'get-url', 'origin'], get_output=True, nosafefix=True)
-
+    proc, stdout = git_shell(location, REPO_STATE_SCRIPT, project_dir=base_dir, nosafefix=True, get_output=True)
     if proc.returncode != 0:
-        res = None
-    elif stdout is not None:
-        res = stdout
-    else:
-        res = None
-
-    return res
+        return RepoState()
+    return RepoState.from_output(stdout)
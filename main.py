@@ -1,22 +1,29 @@
 import os
 import typing
 
-import yaml
 import argparse
 from pathlib import Path
 
+import build_cache
+import compose_cache
 import util
 from commands.Add.Add import add
+from commands.build_helper import build_reverse_proxy
 from commands.Create.Create import create
 from commands.Purge.Purge import purge
 from commands.Rebuild_portal.Rebuild import rebuild
 from commands.Reload.Reload import reload
 from commands.Remove.Remove import remove
-from commands.Update.Update import update
-from docker_util import docker_compose_up
-from git_util import get_current_branch_name
+from commands.Resources.Resources import resources
+from commands.Update.Update import update_parallel
+from compose_fingerprint import plan_compose_up, context_size_report
+from docker_util import docker_compose_up, set_docker_backend, DOCKER_BACKENDS, docker_backend
+from git_util import set_git_backend, GIT_BACKENDS, git_backend
+from redis_profiles import REDIS_PROFILES
+from resources import parse_resource_arguments
 
 from DockerCompose import DockerCompose
+from DockerService import DockerService
 import subprocess
 
 from commands.Ls.list import list_dockers
@@ -27,7 +34,8 @@ PathLike = typing.Union[str, bytes, Path]
 def write(filename: Path, data: DockerCompose):
     converted_data = data.export_data_dict()
     with open(filename.as_posix(), 'w+') as file:
-        yaml.safe_dump(converted_data, file)
+        util.yaml_dump(converted_data, file)
+    compose_cache.store_compose_data(filename, converted_data)
 
 
 class WritableDir(argparse.Action):
@@ -58,6 +66,16 @@ def parse_input() -> argparse.Namespace:
     parser.add_argument('-o', '--overwrite', help='Force overwriting existing docker', action='store_true',
                         dest='overwrite')
     parser.add_argument('--no-overwrite', help='Force continuation on existing docker', action='store_true')
+    parser.add_argument('--force-up', default=False, action='store_true',
+                        help='Rebuild and recreate the dockers of the command even when their inputs did not change')
+    parser.add_argument('--git-backend', choices=GIT_BACKENDS, default=git_backend,
+                        help='How git commands are executed: a container per command (run), '
+                             'a long-lived git worker per project (exec) or the git of the host (host). '
+                             'Defaults to $MANAGER_GIT_BACKEND or exec')
+    parser.add_argument('--docker-backend', choices=DOCKER_BACKENDS, default=docker_backend,
+                        help='How containers and networks are inspected, removed and pulled: '
+                             'through the docker cli (cli) or the Docker Engine API socket (api). '
+                             'Defaults to $MANAGER_DOCKER_BACKEND or cli')
 
     add = subparsers.add_parser('add', help='Add a container')
     add.add_argument('docker', help='New docker name')
@@ -66,6 +84,10 @@ def parse_input() -> argparse.Namespace:
     add.add_argument('--url-path', action='append', help='path to connect to the server')
     add.add_argument('--port', default=1337, help='Port docker uses internally')
     add.add_argument('--yaml', help='Yaml settings for service')
+    add.add_argument('--proxy-cache', metavar='TIME',
+                     help='Cache successful responses of the backend in the reverse proxy (e.g. 10m), off to disable')
+    add.add_argument('--replicas', type=int,
+                     help='Number of containers running the backend, balanced by the reverse proxy')
     add.add_argument('--server-type', choices=['node', 'nginx'], help='Server type to use', default='node')
     add.add_argument('--node-version', '--version', help='Server version to use', default='18')
     add.add_argument('-v', help='Volume for new docker container', action='append', dest='volumes')
@@ -90,6 +112,8 @@ def parse_input() -> argparse.Namespace:
     create.add_argument('-e', help='Environment variable for new docker container', action='append',
                         dest='environment_variables')
     create.add_argument('--yaml', help='Yaml settings for frontend service')
+    create.add_argument('--redis-profile', choices=list(REDIS_PROFILES),
+                        help='Redis configuration of the group, the template by default')
 
     remove = subparsers.add_parser('remove', help='Remove a container')
     remove.add_argument('docker', help='Docker name')
@@ -100,21 +124,40 @@ def parse_input() -> argparse.Namespace:
     update.add_argument('--git', help='Git repository')
     update.add_argument('--branch',
                         help='branch or tag from where to clone, if not given same branch as existing code is used')
+    update.add_argument('--clean', action='store_true', default=False,
+                        help='Clone the code again instead of updating the existing checkout in place')
+    update.add_argument('-j', '--jobs', type=int, default=1, help='Number of builds running concurrently')
+    update.add_argument('--fetch-jobs', type=int, default=4, help='Number of git fetches running concurrently')
 
     reload = subparsers.add_parser('reload', help='Reload settings')
     reload.add_argument('docker', help='Docker container name')
     reload.add_argument('--yaml', help='Yaml settings for docker service')
+    reload.add_argument('--proxy-cache', metavar='TIME',
+                        help='Cache successful responses of the backend in the reverse proxy (e.g. 10m), off to disable')
+    reload.add_argument('--replicas', type=int,
+                        help='Number of containers running the backend, balanced by the reverse proxy')
+    reload.add_argument('--redis-profile', choices=list(REDIS_PROFILES),
+                        help='Redis configuration, for the redis docker of the group')
     reload.add_argument('-v', help='Volume for new docker container', action='append', dest='volumes')
     reload.add_argument('-e', help='Environment variable for new docker container', action='append',
                         dest='environment_variables')
     reload.add_argument('-f', '--forced', help='Force rebuilding of all dockers upon loading', action='store_true',
                         dest='forced')
 
+    resources_parser = subparsers.add_parser('resources', help='Show or set the resource limits of containers')
+    resources_parser.add_argument('docker', nargs='?', help='Docker container name')
+    resources_parser.add_argument('--set', action='append', default=[], dest='resources', metavar='KEY=VALUE',
+                                  help='Resource limit: cpus, cpuset, mem_limit, mem_reservation, pids_limit, nofile')
+    resources_parser.add_argument('--clear', action='store_true', default=False,
+                                  help='Remove the limits of the docker before setting new ones')
+    resources_parser.add_argument('--auto', action='store_true', default=False,
+                                  help='Size the limits of all containers from the host cores and memory')
+
     list_dockers = subparsers.add_parser('ls', help='List all containers')
+    list_dockers.add_argument('--cached', action='store_true', default=False,
+                              help='Use the git state recorded at the last add/update instead of reading the code')
 
     parsed = parser.parse_args()
-    basename = parsed.directory.parts[-1]
-    parsed.reverse_proxy = parsed.reverse_proxy if parsed.reverse_proxy else basename + '.nginx'
     if parsed.cmd == 'add':
         parsed.url_path = parsed.url_path if parsed.url_path else ['/api/{docker}'.format(docker=parsed.docker)]
 
@@ -126,6 +169,12 @@ def parse_input() -> argparse.Namespace:
                 parsed.port = v[1]
         if parsed.port is None:
             parsed.port = 80
+        if parsed.network is not None:
+            # the group is created in a directory of its own, starting its containers works on that directory
+            parsed.directory = parsed.directory / parsed.network
+            parsed.network = None
+    basename = parsed.directory.parts[-1]
+    parsed.reverse_proxy = parsed.reverse_proxy if parsed.reverse_proxy else basename + '.nginx'
     return parsed
 
 
@@ -135,30 +184,22 @@ def update_helper(comp: DockerCompose, args):
         git_args = [args.git]
 
     git_args.extend(['--depth', '1'])
-    dockers = set()
-    for name in args.docker:
-        print('==== {name} ===='.format(name=name))
-        if args.branch:
-            branch = args.branch
-        else:
-            basename = args.directory.parts[-1]
-            fullname = '{basename}.{name}'.format(basename=basename, name=name)
-            branch = get_current_branch_name(args.directory, fullname)
-            if branch is not None:
-                print('found branch: {branch}'.format(branch=branch))
-            else:
-                branch = 'production'
-        dockers.update(update(
+    try:
+        dockers = update_parallel(
             compose=comp,
             base_dir=args.directory,
-            name=name,
-            branch=branch,
+            names=args.docker,
+            branch=args.branch,
             git_settings=git_args,
+            jobs=args.jobs,
+            fetch_jobs=args.fetch_jobs,
             quiet=args.quiet,
-        ))
-    if len(dockers) > 0:
+            clean=args.clean,
+        )
+    finally:
+        # services that finished before a failure keep their new git state
         write(args.directory / 'docker-compose.yml', comp)
-    return list(dockers)
+    return dockers
 
 
 def add_helper(comp: DockerCompose, args: argparse.Namespace):
@@ -180,13 +221,15 @@ def add_helper(comp: DockerCompose, args: argparse.Namespace):
         version=args.node_version,
         server_type=args.server_type,
         build_env=args.build_environment_variables,
+        proxy_cache=args.proxy_cache,
+        replicas=args.replicas,
         quiet=args.quiet)
     write(args.directory / 'docker-compose.yml', comp)
     return dockers
 
 
 def create_helper(comp: DockerCompose, args):
-    n = args.directory if args.network is None else (args.directory / args.network)  # type: Path
+    n = args.directory  # type: Path
     n.mkdir(parents=True, exist_ok=True)
     n = n.resolve()
     git_args = [args.git, '--depth', '1']
@@ -201,6 +244,7 @@ def create_helper(comp: DockerCompose, args):
         build_env=args.build_environment_variables,
         yaml=util.yaml_load(Path(args.yaml)) if args.yaml else None,
         run_env=args.environment_variables,
+        redis_profile=args.redis_profile,
     )
     write(n / 'docker-compose.yml', comp)
     return dockers
@@ -225,6 +269,9 @@ def reload_helper(comp: DockerCompose, args):
         yaml=util.yaml_load(Path(args.yaml)) if args.yaml else None,
         new_volumes=args.volumes,
         new_environment_vars=args.environment_variables,
+        proxy_cache=args.proxy_cache,
+        replicas=args.replicas,
+        redis_profile=args.redis_profile,
         quiet=args.quiet)
     if dockers is not None:
         write(args.directory / 'docker-compose.yml', comp)
@@ -251,14 +298,84 @@ def purge_helper(comp: DockerCompose, args):
     return [comp.main_docker] if comp.main_docker is not None else None
 
 
+def resources_helper(comp: DockerCompose, args):
+    dockers = resources(
+        compose=comp,
+        base_dir=args.directory.resolve(),
+        name=args.docker,
+        settings=parse_resource_arguments(args.resources),
+        clear=args.clear,
+        auto=args.auto,
+        quiet=args.quiet)
+    if dockers:
+        write(args.directory / 'docker-compose.yml', comp)
+    return dockers
+
+
 def list_docker_helper(comp: DockerCompose, args):
     list_dockers(
         compose=comp,
-        base_dir=args.directory.resolve())
+        base_dir=args.directory.resolve(),
+        cached=args.cached)
+
+
+def refresh_reverse_proxy(comp: DockerCompose,
+                          args: argparse.Namespace,
+                          replacing: typing.Sequence[str] = (),
+                          restarted: typing.Sequence[str] = ()):
+    # Backends that just started can now be proxied through keepalive upstreams
+    # replacing are about to be recreated and go through the docker dns meanwhile, restarted were just recreated
+    # Only for main dockers that have their routes mounted, older groups are migrated by the commands changing routes
+    if comp.main_docker is not None and comp.main_docker.has_sites_enabled_volume():
+        build_reverse_proxy(comp, args.directory.resolve(), quiet=True, replacing=replacing, restarted=restarted)
+
+
+def compose_up_changed(dockers: typing.Optional[typing.List[DockerService]], args: argparse.Namespace):
+    # Runs `docker-compose up` only for the dockers whose inputs changed since their last successful start
+    # Changed builds are rebuild, changed settings only recreate the container
+    # None considers every docker of the group, an empty list means the command changed no docker
+    if dockers is not None and not any(d is not None for d in dockers):
+        return
+    filename = args.directory / 'docker-compose.yml'
+    comp = util.load(filename, args.reverse_proxy)
+    # `reload --forced` rebuilds all dockers
+    force = args.force_up or getattr(args, 'forced', False)
+    rebuild, recreate, fingerprints = plan_compose_up(comp, args.directory.resolve(), dockers, force)
+    if not rebuild and not recreate:
+        print('Docker containers up to date')
+        refresh_reverse_proxy(comp, args)
+        return
+    print('Docker containers updating')
+    if not args.quiet:
+        for name in rebuild:
+            report = context_size_report(args.directory.resolve(), comp.get_docker(name))
+            if report is not None:
+                print(report)
+    # the running proxy keeps the addresses of the containers being replaced until it is reloaded
+    refresh_reverse_proxy(comp, args, replacing=rebuild + recreate)
+    started = []
+    failed = []
+    for names, build in ((rebuild, True), (recreate, False)):
+        if names:
+            if docker_compose_up([], args.directory, build=build, names=names) == 0:
+                started.extend(names)
+            else:
+                failed.extend(names)
+    for name in started:
+        if name in fingerprints:
+            comp.meta.set_fingerprint(name, fingerprints[name])
+    # the proxy follows the containers that are running now, also when some failed to start
+    refresh_reverse_proxy(comp, args, restarted=started)
+    if started:
+        write(filename, comp)
+    if failed:
+        raise RuntimeError('docker-compose up failed for {names}'.format(names=', '.join(failed)))
 
 
 def main():
     args = parse_input()
+    set_git_backend(args.git_backend)
+    set_docker_backend(args.docker_backend)
     basename = args.directory.parts[-1]
     print('Working on group {basename}'.format(basename=basename))
     dat = util.load(args.directory / 'docker-compose.yml', args.reverse_proxy) if args.cmd != 'create' else None
@@ -272,14 +389,16 @@ def main():
         'rebuild-portal': rebuild_helper,
         'purge': purge_helper,
         'ls': list_docker_helper,
+        'resources': resources_helper,
     }
     dockers = cmd_dict[args.cmd](dat, args)
     no_change_list = ['purge', 'ls']
 
     # if command returned dockers the dockers will be rebuild as final step to release a new version
     if not args.no_launch and args.cmd not in no_change_list:
-        print('Docker containers updating')
-        docker_compose_up(dockers, args.directory)
+        compose_up_changed(dockers, args)
+    if sum(build_cache.deps_cache_stats.values()):
+        print(build_cache.format_deps_cache_stats())
     return
 
 
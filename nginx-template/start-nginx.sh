@@ -0,0 +1,15 @@
+#!/bin/sh
+# Starts nginx with the generated sites (bind mounted sites-enabled)
+# nginx resolves the servers of upstream blocks when it loads its configuration and does not start when one of them
+# is not running (stopped, or not started yet after a reboot). The sites then fall back to the variant that proxies
+# every backend through the docker dns, until the manager generates the sites again.
+SITES=/etc/nginx/sites-enabled
+if ! nginx -t -q 2>/dev/null; then
+    for fallback in "$SITES"/.dns/*; do
+        if [ -f "$fallback" ]; then
+            echo "Backends of $(basename "$fallback") not resolvable, proxying them through the docker dns"
+            cat "$fallback" > "$SITES/$(basename "$fallback")"
+        fi
+    done
+fi
+exec nginx -g 'daemon off;'
@@ -1,8 +1,104 @@
 import re
+import subprocess
 import typing
 from pathlib import Path
 
 from ServerData import ServerData
+from docker_util import docker_exec, docker_inspect
+
+
+# Proxy settings of a backend, set with the `proxy` key of the service yaml
+# mode upstream: an upstream block per backend with a pool of keepalive connections
+# mode variable: `proxy_pass $upstream`, resolved by the docker dns on each request, a new connection per request
+# balance: how requests are spread over the replicas of a backend, least_conn, round_robin, ip_hash or `hash <key>`
+# (optionally followed by `consistent`), replicas are only balanced in upstream mode
+DEFAULT_PROXY_SETTINGS = {
+    'mode': 'upstream',
+    'balance': 'least_conn',
+    'keepalive': 32,
+    'keepalive_timeout': '60s',
+    'buffering': 'on',
+    'connect_timeout': '5s',
+    'read_timeout': '60s',
+    'send_timeout': '60s',
+    'cache': None,
+}  # type: typing.Dict[str, typing.Union[str, int, dict, None]]
+
+# Response caching of a backend, opt-in with the `cache` key of the proxy settings (`cache: true` for these defaults)
+# valid: cache time per (space separated) status codes
+# use_stale/background_update: serve a stale response while it is refreshed in the background
+# bypass: requests (and responses) with any of these values set are never served from or stored in the cache
+# max_size/inactive/keys_zone: bounds of the on-disk cache (one zone per backend) and its shared memory
+DEFAULT_CACHE_SETTINGS = {
+    'valid': {'200 301 302': '10m', '404': '1m'},
+    'key': '$scheme$request_method$host$request_uri',
+    'methods': 'GET HEAD',
+    'min_uses': 1,
+    'lock': 'on',
+    'lock_timeout': '5s',
+    'use_stale': 'error timeout updating http_500 http_502 http_503 http_504',
+    'background_update': 'on',
+    # responses to requests with a cookie are usually personal (sessions), even without `Cache-Control: private`
+    'bypass': '$http_authorization $http_cookie',
+    'max_size': '1g',
+    'inactive': '60m',
+    'keys_zone': '10m',
+}  # type: typing.Dict[str, typing.Union[str, int, dict]]
+
+# Directory in sites-enabled with the sites proxying every backend through the docker dns
+# A dot directory is not matched by the `include sites-enabled/*` of nginx.conf
+DNS_FALLBACK_DIR = '.dns'
+CACHE_LOG = '/var/log/nginx/proxy-cache.log'
+# counts per route and cache status folded from the cache log by rotate_cache_log
+CACHE_TOTALS = '/var/log/nginx/proxy-cache.totals'
+CACHE_LOCK = '/var/log/nginx/proxy-cache.lock'
+CACHE_LOG_FORMAT = 'manager_cache'
+CACHE_HIT_STATES = ('HIT', 'STALE', 'UPDATING', 'REVALIDATED')
+
+
+def get_proxy_settings(settings: typing.Optional[dict]) -> typing.Dict[str, typing.Union[str, int]]:
+    if not settings:
+        return dict(DEFAULT_PROXY_SETTINGS)
+    unknown = set(settings) - set(DEFAULT_PROXY_SETTINGS)
+    if unknown:
+        raise ValueError('Unknown proxy settings {unknown}'.format(unknown=', '.join(sorted(unknown))))
+    if settings.get('mode', 'upstream') not in ('upstream', 'variable'):
+        raise ValueError('Proxy mode should be upstream or variable')
+    balance = str(settings.get('balance', 'least_conn')).split()
+    if not balance or balance[0] not in ('least_conn', 'round_robin', 'ip_hash', 'hash') \
+            or (balance[0] == 'hash') != (len(balance) > 1) or balance[2:] not in ([], ['consistent']):
+        raise ValueError('Proxy balance should be least_conn, round_robin, ip_hash or hash <key> [consistent]')
+    return {**DEFAULT_PROXY_SETTINGS, **settings, 'cache': get_cache_settings(settings.get('cache'))}
+
+
+def get_cache_settings(settings: typing.Union[dict, bool, None]) -> typing.Optional[dict]:
+    # None when caching is disabled
+    if settings is None or settings is False:
+        return None
+    if settings is True:
+        return dict(DEFAULT_CACHE_SETTINGS)
+    if not isinstance(settings, dict):
+        raise ValueError('Proxy cache should be true, false or a mapping of cache settings')
+    unknown = set(settings) - set(DEFAULT_CACHE_SETTINGS)
+    if unknown:
+        raise ValueError('Unknown proxy cache settings {unknown}'.format(unknown=', '.join(sorted(unknown))))
+    valid = settings.get('valid', DEFAULT_CACHE_SETTINGS['valid'])
+    if not isinstance(valid, dict) or not valid:
+        raise ValueError('Proxy cache valid should map status codes to cache times')
+    return {**DEFAULT_CACHE_SETTINGS, **settings, 'valid': {str(k): str(v) for k, v in valid.items()}}
+
+
+def set_cache_time(settings: typing.Optional[dict], cache_time: str) -> typing.Dict[str, typing.Union[str, int, dict]]:
+    # Applies the `--proxy-cache` option to proxy settings: `off` disables caching,
+    # any other value caches successful responses that long (keeping the other cache settings)
+    settings = get_proxy_settings(settings)
+    if cache_time == 'off':
+        settings['cache'] = None
+        return settings
+    cache = settings['cache'] if settings['cache'] is not None else dict(DEFAULT_CACHE_SETTINGS)
+    valid = {k: v for k, v in cache['valid'].items() if k != '200 301 302'}
+    settings['cache'] = {**cache, 'valid': {'200 301 302': cache_time, **valid}}
+    return settings
 
 
 def build_nginx_configuration(base_dir: Path,
@@ -10,26 +106,61 @@ def build_nginx_configuration(base_dir: Path,
                               portal_fname: str,
                               servlist: typing.List[ServerData],
                               overwrite: bool = False,
-                              quiet: bool = False):
+                              quiet: bool = False,
+                              proxy_settings: typing.Dict[str, dict] = None,
+                              upstream_hosts: typing.Container[str] = ()):
+    # proxy_settings per server name
+    # upstream_hosts are the containers that are running: nginx resolves upstream servers when loading its configuration,
+    # so other servers are proxied through a variable until the configuration is generated again after they started
+    # The upstream of a server with replicas contains its running replicas
+    # Next to the sites a variant proxying every server through the docker dns is written (DNS_FALLBACK_DIR), nginx
+    # starts with it when a backend of the upstream blocks is not running (see nginx-template/start-nginx.sh)
     location = base_dir / portal_docker_fullname
     in_fname = location / 'sites-available' / portal_fname
-    out_fname = location / 'sites-enabled' / portal_fname
     with open(in_fname.as_posix(), "r") as f:
         contents = f.readlines()
+    if proxy_settings is None:
+        proxy_settings = {}
+
+    (location / 'sites-enabled' / DNS_FALLBACK_DIR).mkdir(parents=True, exist_ok=True)
+    for out_fname, hosts in ((location / 'sites-enabled' / portal_fname, upstream_hosts),
+                             (location / 'sites-enabled' / DNS_FALLBACK_DIR / portal_fname, ())):
+        with open(out_fname.as_posix(), "w+") as f:
+            f.write(generate_sites(contents, servlist, proxy_settings, hosts))
 
+
+def generate_sites(template: typing.List[str],
+                   servlist: typing.List[ServerData],
+                   proxy_settings: typing.Dict[str, dict],
+                   upstream_hosts: typing.Container[str]) -> str:
+    # The template lines with the locations of the servers, and the upstream blocks and cache zones they use
+    contents = list(template)
     index = find_location_line(contents)
 
-    insert = [generate_location_string(s) for s in servlist]
+    upstreams = {}  # type: typing.Dict[str, str]
+    caches = {}  # type: typing.Dict[str, str]
+    insert = []
+    for s in servlist:
+        settings = get_proxy_settings(proxy_settings.get(s.name))
+        cache = ""
+        if settings['cache'] is not None:
+            caches.setdefault(cache_zone_name(s), generate_cache_path_string(s, settings['cache']))
+            cache = generate_cache_string(s, settings['cache'])
+        endpoints = [e for e in s.get_endpoints() if e in upstream_hosts]
+        if settings['mode'] == 'upstream' and endpoints:
+            upstreams.setdefault(upstream_name(s), generate_upstream_string(s, settings, endpoints))
+            insert.append(generate_upstream_location_string(s, settings, cache))
+        else:
+            insert.append(generate_location_string(s, cache))
 
     contents[index:index] = insert
-
-    try:
-        (location / 'sites-enabled').mkdir(parents=True)
-    except FileExistsError:
-        pass
-    with open(out_fname.as_posix(), "w+") as f:
-        content_str = "".join(contents)
-        f.write(content_str)
+    # upstream blocks, cache zones and the cache log format belong to the http context, in front of the server block
+    server_index = find_server_line(contents)
+    http = [upstreams[name] for name in sorted(upstreams)] + [caches[name] for name in sorted(caches)]
+    if caches:
+        http.append(generate_cache_log_format_string())
+    contents[server_index:server_index] = http
+    return "".join(contents)
 
 
 def find_location_line(contents: typing.List[str]):
@@ -48,9 +179,153 @@ def find_location_line(contents: typing.List[str]):
     return i
 
 
-def generate_location_string(server: ServerData):
+def find_server_line(contents: typing.List[str]) -> int:
+    pattern = re.compile(r"^\s*server\s+\{")
+    return next((i for i, v in enumerate(contents) if pattern.match(v) is not None), 0)
+
+
+def upstream_name(server: ServerData) -> str:
+    return 'backend_{name}'.format(name=re.sub(r'[^A-Za-z0-9_]', '_', '{s.name}_{s.port}'.format(s=server)))
+
+
+def generate_upstream_string(server: ServerData,
+                             settings: typing.Dict[str, typing.Union[str, int]],
+                             endpoints: typing.Sequence[str] = None) -> str:
+    # endpoints are the containers serving the server (the server itself by default)
+    if endpoints is None:
+        endpoints = [server.name]
+    servers = "".join("\tserver {endpoint}:{server.port};\n".format(endpoint=e, server=server) for e in endpoints)
+    # the balancing method has to come before keepalive, round robin is the nginx default
+    balance = "\t{balance};\n".format(balance=settings['balance']) \
+        if len(endpoints) > 1 and settings['balance'] != 'round_robin' else ""
+    return "upstream {upstream} {{\n" \
+           "{servers}" \
+           "{balance}" \
+           "\tkeepalive {settings[keepalive]};\n" \
+           "\tkeepalive_timeout {settings[keepalive_timeout]};\n" \
+           "}}\n\n".format(upstream=upstream_name(server), servers=servers, balance=balance, settings=settings)
+
+
+def generate_upstream_location_string(server: ServerData,
+                                     settings: typing.Dict[str, typing.Union[str, int]],
+                                     cache: str = "") -> str:
+    return "\tlocation {server.path} {{\n" \
+           "{cache}" \
+           "\t\trewrite ^{server.path}/(.*) /$1  break;\n" \
+           "\t\tproxy_pass http://{upstream};\n" \
+           "\t\tproxy_http_version 1.1;\n" \
+           "\t\tproxy_set_header Connection \"\";\n" \
+           "\t\tproxy_buffering {settings[buffering]};\n" \
+           "\t\tproxy_connect_timeout {settings[connect_timeout]};\n" \
+           "\t\tproxy_read_timeout {settings[read_timeout]};\n" \
+           "\t\tproxy_send_timeout {settings[send_timeout]};\n" \
+           "\t}}\n".format(server=server, upstream=upstream_name(server), settings=settings, cache=cache)
+
+
+def generate_location_string(server: ServerData, cache: str = ""):
     return "\tlocation {server.path} {{\n" \
+           "{cache}" \
            "\t\tset $upstream http://{server.name}:{server.port};\n" \
            "\t\trewrite ^{server.path}/(.*) /$1  break;\n" \
            "\t\tproxy_pass $upstream;\n" \
-           "\t}}\n".format(server=server)
+           "\t}}\n".format(server=server, cache=cache)
+
+
+def cache_zone_name(server: ServerData) -> str:
+    return 'proxy_cache_{name}'.format(name=re.sub(r'[^A-Za-z0-9_]', '_', server.name))
+
+
+def generate_cache_path_string(server: ServerData, cache: typing.Dict[str, typing.Union[str, int, dict]]) -> str:
+    return "proxy_cache_path /var/cache/{zone} levels=1:2 keys_zone={zone}:{cache[keys_zone]} " \
+           "max_size={cache[max_size]} inactive={cache[inactive]} use_temp_path=off;\n\n" \
+           .format(zone=cache_zone_name(server), cache=cache)
+
+
+def generate_cache_log_format_string() -> str:
+    # One line per cached route request: `<route> <cache status>`, read by `ls`
+    return "log_format {log_format} '$manager_cache_route $upstream_cache_status';\n\n" \
+        .format(log_format=CACHE_LOG_FORMAT)
+
+
+def generate_cache_string(server: ServerData, cache: typing.Dict[str, typing.Union[str, int, dict]]) -> str:
+    # Cache directives of a location, in front of its rewrite (`break` ends the rewrite directives)
+    valid = "".join("\t\tproxy_cache_valid {status} {time};\n".format(status=status, time=time)
+                    for status, time in cache['valid'].items())
+    return "\t\tset $manager_cache_route {server.path};\n" \
+           "\t\tproxy_cache {zone};\n" \
+           "\t\tproxy_cache_key \"{cache[key]}\";\n" \
+           "\t\tproxy_cache_methods {cache[methods]};\n" \
+           "{valid}" \
+           "\t\tproxy_cache_min_uses {cache[min_uses]};\n" \
+           "\t\tproxy_cache_lock {cache[lock]};\n" \
+           "\t\tproxy_cache_lock_timeout {cache[lock_timeout]};\n" \
+           "\t\tproxy_cache_use_stale {cache[use_stale]};\n" \
+           "\t\tproxy_cache_background_update {cache[background_update]};\n" \
+           "\t\tproxy_cache_bypass {cache[bypass]};\n" \
+           "\t\tproxy_no_cache {cache[bypass]};\n" \
+           "\t\tadd_header X-Cache-Status $upstream_cache_status always;\n" \
+           "\t\taccess_log /var/log/nginx/access.log;\n" \
+           "\t\taccess_log {log} {log_format};\n" \
+           .format(server=server, zone=cache_zone_name(server), cache=cache, valid=valid,
+                   log=CACHE_LOG, log_format=CACHE_LOG_FORMAT)
+
+
+def can_hot_reload(container: str, sites_enabled: str) -> bool:
+    # Whether the container runs with the generated sites mounted, so new routes only need a reload
+    try:
+        state = docker_inspect(container, '{{.State.Running}}{{range .Mounts}} {{.Destination}}{{end}}').split()
+    except subprocess.CalledProcessError:
+        return False
+    return bool(state) and state[0] == 'true' and sites_enabled in state[1:]
+
+
+def reload_nginx(container: str, quiet: bool = False) -> bool:
+    # Checks the configuration inside the running container and reloads nginx when it is valid
+    # Returns False (leaving nginx running on the old configuration) when the check fails
+    test = docker_exec(container, docker_args=['nginx', '-t', '-q'], fail_on_nonzero_exit=False)
+    if test.returncode != 0:
+        return False
+    docker_exec(container, docker_args=['nginx', '-s', 'reload'])
+    if not quiet:
+        print('Reloaded nginx in {container}'.format(container=container))
+    return True
+
+
+# Sums the `<route> <status> <count>` lines of the totals and the `<route> <status>` lines of the cache log
+_CACHE_COUNT_AWK = "awk 'NF == 3 { n[$1 \" \" $2] += $3 } NF == 2 && $2 != \"-\" { n[$1 \" \" $2]++ } " \
+                   "END { for (k in n) print k, n[k] }'"
+
+
+def rotate_cache_log(container: str) -> None:
+    # Folds the cache log into the totals and lets nginx start a new log, so the log does not keep growing
+    # Run by the commands changing the group, `ls` only reads. A log left behind by an interrupted rotation
+    # is folded first. The lock keeps concurrent rotations and reads apart.
+    script = "[ -f {log}.1 ] || {{ [ -s {log} ] && mv {log} {log}.1 && nginx -s reopen && sleep 0.2; }}; " \
+             "[ ! -f {log}.1 ] || {{ cat {totals} {log}.1 2>/dev/null | {awk} > {totals}.new " \
+             "&& mv {totals}.new {totals} && rm -f {log}.1; }}" \
+        .format(log=CACHE_LOG, totals=CACHE_TOTALS, awk=_CACHE_COUNT_AWK)
+    docker_exec(container,
+                docker_args=['flock', '-x', CACHE_LOCK, '-c', script],
+                stdout=subprocess.DEVNULL,
+                fail_on_nonzero_exit=False)
+
+
+def read_cache_statistics(container: str) -> typing.Dict[str, typing.Tuple[int, int]]:
+    # (requests, hits) per cached route, counted inside the container from the totals and the cache log
+    # Requests not eligible for caching (other methods) are not counted
+    script = "cat {totals} {log}.1 {log} 2>/dev/null | {awk}" \
+        .format(log=CACHE_LOG, totals=CACHE_TOTALS, awk=_CACHE_COUNT_AWK)
+    proc = docker_exec(container, docker_args=['flock', '-s', CACHE_LOCK, '-c', script], stdout=subprocess.PIPE,
+                       fail_on_nonzero_exit=False)
+    statistics = {}  # type: typing.Dict[str, typing.Tuple[int, int]]
+    if proc.returncode != 0 or proc.stdout is None:
+        return statistics
+    for line in proc.stdout.decode('utf-8', 'replace').splitlines():
+        try:
+            route, status, count = line.split()
+            count = int(count)
+        except ValueError:
+            continue
+        requests, hits = statistics.get(route, (0, 0))
+        statistics[route] = (requests + count, hits + (count if status in CACHE_HIT_STATES else 0))
+    return statistics
@@ -0,0 +1,87 @@
+import gzip
+import os
+import shutil
+import subprocess
+import time
+import typing
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Writes `.gz` and `.br` siblings of the static files of a frontend build, at maximum compression
+# nginx serves them with `gzip_static`/`brotli_static`, so the proxy does not compress on every request.
+# Brotli uses the `brotli` python package, or the `brotli` command when the package is not installed;
+# without either only `.gz` files are written.
+
+COMPRESSIBLE = {'.html', '.htm', '.css', '.js', '.mjs', '.cjs', '.json', '.map', '.svg', '.xml', '.txt', '.wasm',
+                '.ico', '.webmanifest', '.ttf', '.otf', '.eot'}
+MIN_SIZE = 256
+
+
+def _brotli_command() -> typing.Optional[str]:
+    return shutil.which('brotli')
+
+
+def brotli_available() -> bool:
+    return brotli is not None or _brotli_command() is not None
+
+
+def compress_gzip(data: bytes) -> bytes:
+    # mtime 0 keeps the output identical between builds
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def compress_brotli(data: bytes) -> typing.Optional[bytes]:
+    if brotli is not None:
+        return brotli.compress(data, quality=11)
+    command = _brotli_command()
+    if command is None:
+        return None
+    return subprocess.run([command, '--best', '--stdout', '-'], input=data, stdout=subprocess.PIPE,
+                          check=True).stdout
+
+
+def _write_sibling(fname: Path, suffix: str, data: typing.Optional[bytes], original_size: int) -> int:
+    # Only kept when smaller than the original, nginx then serves the original itself
+    target = fname.with_name(fname.name + suffix)
+    if data is None or len(data) >= original_size:
+        if target.exists():
+            os.remove(target.as_posix())
+        return 0
+    with open(target.as_posix(), 'wb') as f:
+        f.write(data)
+    st = os.stat(fname.as_posix())
+    # gzip_static does not look at the time, but matching it keeps Last-Modified/ETag consistent
+    os.utime(target.as_posix(), ns=(st.st_atime_ns, st.st_mtime_ns))
+    return len(data)
+
+
+def precompress_directory(directory: Path, quiet: bool = False) -> typing.Dict[str, int]:
+    # Returns the number of files and the byte totals (original, gzip, brotli) of the compressed files
+    start = time.perf_counter()
+    use_brotli = brotli_available()
+    totals = {'files': 0, 'original': 0, 'gzip': 0, 'brotli': 0}
+    for root, dirs, names in os.walk(directory.as_posix()):
+        dirs[:] = [d for d in dirs if d != 'node_modules']
+        for name in names:
+            fname = Path(root) / name
+            if fname.suffix.lower() not in COMPRESSIBLE or fname.is_symlink():
+                continue
+            with open(fname.as_posix(), 'rb') as f:
+                data = f.read()
+            if len(data) < MIN_SIZE:
+                continue
+            totals['files'] += 1
+            totals['original'] += len(data)
+            totals['gzip'] += _write_sibling(fname, '.gz', compress_gzip(data), len(data))
+            if use_brotli:
+                totals['brotli'] += _write_sibling(fname, '.br', compress_brotli(data), len(data))
+    if not quiet:
+        print('Precompressed {files} files ({original} bytes -> gzip {gzip}, brotli {brotli}) in {time:.1f}s'
+              .format(**totals, time=time.perf_counter() - start))
+        if not use_brotli:
+            print('brotli is not installed (pip install brotli), only .gz files were written')
+    return totals
@@ -0,0 +1,171 @@
+import re
+import subprocess
+import time
+import typing
+from pathlib import Path
+
+from docker_util import docker_run, docker_exec, docker_remove
+from resources import parse_size, format_size
+
+# Redis configurations of the group cache container, rendered from redis-template/redis.conf
+#   default:    the template as it is
+#   cache:      pure cache, least frequently used keys are evicted at maxmemory, no persistence
+#   cache-lru:  as cache, evicting the least recently used keys
+#   session:    session store, only keys with an expiry are evicted, AOF (fsync every second) with rdb preamble
+#   store:      nothing is evicted (writes fail at maxmemory), AOF and rdb snapshots
+# maxmemory is a share of the memory limit of the container: persistent profiles leave room for the fork
+# of a rewrite/snapshot. io-threads follow the host cores.
+
+TEMPLATE = Path('redis-template/redis.conf')
+CONTAINER_CONF = '/usr/local/etc/redis/redis.conf'
+
+_BASE = {
+    'supervised': 'no',
+    'lazyfree-lazy-eviction': 'yes',
+    'lazyfree-lazy-expire': 'yes',
+    'lazyfree-lazy-server-del': 'yes',
+}
+_PERSISTENT = {
+    **_BASE,
+    # the volume of the redis image, owned by the redis user
+    'dir': '/data',
+    'appendonly': 'yes',
+    'appendfsync': 'everysec',
+    'aof-use-rdb-preamble': 'yes',
+}
+
+REDIS_PROFILES = {
+    'default': {},
+    'cache': {**_BASE, 'maxmemory-policy': 'allkeys-lfu', 'save': '""', 'appendonly': 'no'},
+    'cache-lru': {**_BASE, 'maxmemory-policy': 'allkeys-lru', 'save': '""', 'appendonly': 'no'},
+    'session': {**_PERSISTENT, 'maxmemory-policy': 'volatile-lru', 'save': '""'},
+    'store': {**_PERSISTENT, 'maxmemory-policy': 'noeviction', 'save': '3600 1 300 100 60 10000'},
+}  # type: typing.Dict[str, typing.Dict[str, str]]
+
+MAXMEMORY_SHARE = {'cache': 0.75, 'cache-lru': 0.75, 'session': 0.5, 'store': 0.5}
+
+
+def get_redis_settings(settings: typing.Optional[dict]) -> typing.Dict[str, typing.Union[str, dict]]:
+    # {profile, settings}: settings are redis directives overriding the profile
+    if not settings:
+        return {'profile': 'default', 'settings': {}}
+    unknown = set(settings) - {'profile', 'settings'}
+    if unknown:
+        raise ValueError('Unknown redis settings {unknown}'.format(unknown=', '.join(sorted(unknown))))
+    profile = settings.get('profile', 'default')
+    if profile not in REDIS_PROFILES:
+        raise ValueError('Unknown redis profile {profile}, use one of {profiles}'
+                         .format(profile=profile, profiles=', '.join(REDIS_PROFILES)))
+    overrides = settings.get('settings') or {}
+    if not isinstance(overrides, dict):
+        raise ValueError('Redis settings should map redis directives to values')
+    return {'profile': profile, 'settings': {str(k): str(v) for k, v in overrides.items()}}
+
+
+def default_memory_limit(host_memory: int) -> int:
+    # An eighth of the host, between 256MB and 4GB
+    return min(max(host_memory // 8, 256 * 1024 ** 2), 4 * 1024 ** 3)
+
+
+def memory_limit_of(resources: typing.Dict[str, typing.Union[str, int, float]], host_memory: int) -> int:
+    # The memory limit of the redis container, the default limit when none is set
+    if resources.get('mem_limit'):
+        return parse_size(resources['mem_limit'])
+    return default_memory_limit(host_memory)
+
+
+def io_threads(cores: int) -> int:
+    # Threads only help with four or more cores, the host is shared with the rest of the group: at most half of it
+    if cores < 4:
+        return 1
+    return min(4, cores // 2)
+
+
+def redis_directives(settings: typing.Dict[str, typing.Union[str, dict]],
+                     memory_limit: int,
+                     cores: int) -> typing.Dict[str, str]:
+    profile = settings['profile']
+    directives = dict(REDIS_PROFILES[profile])
+    if profile != 'default':
+        directives['maxmemory'] = format_size(int(memory_limit * MAXMEMORY_SHARE[profile]))
+        threads = io_threads(cores)
+        directives['io-threads'] = str(threads)
+        if threads > 1:
+            directives['io-threads-do-reads'] = 'yes'
+    directives.update(settings['settings'])
+    return directives
+
+
+def render_redis_conf(directives: typing.Dict[str, str], template: Path = TEMPLATE) -> str:
+    # The template with the uncommented lines of the directives removed, followed by the directives
+    with open(template.as_posix(), 'r') as f:
+        lines = f.readlines()
+    names = {name.lower() for name in directives}
+    kept = [line for line in lines if not line.strip() or line.lstrip().startswith('#')
+            or line.split()[0].lower() not in names]
+    if not directives:
+        return ''.join(kept)
+    if kept and not kept[-1].endswith('\n'):
+        kept[-1] += '\n'
+    kept.append('\n# generated by the manager, see redis_profiles.py\n')
+    kept.extend('{name} {value}\n'.format(name=name, value=value) for name, value in directives.items())
+    return ''.join(kept)
+
+
+def write_redis_conf(redis_dir: Path, directives: typing.Dict[str, str]) -> bool:
+    # Returns whether the configuration changed
+    fname = redis_dir / 'redis.conf'
+    contents = render_redis_conf(directives)
+    try:
+        if fname.read_text() == contents:
+            return False
+    except FileNotFoundError:
+        pass
+    fname.write_text(contents)
+    return True
+
+
+def redis_image(redis_dir: Path) -> str:
+    # Base image of the redis Dockerfile
+    with open((redis_dir / 'Dockerfile').as_posix(), 'r') as f:
+        for line in f:
+            m = re.match(r'^\s*FROM\s+(\S+)', line, re.IGNORECASE)
+            if m is not None:
+                return m.group(1)
+    raise ValueError('No base image in {dockerfile}'.format(dockerfile=redis_dir / 'Dockerfile'))
+
+
+def smoke_test(redis_dir: Path,
+               requests: int = 20000,
+               memory_limit: str = None,
+               timeout: float = 10) -> typing.Dict[str, typing.Union[str, float]]:
+    # Starts redis with the generated configuration and runs redis-benchmark against it
+    # Returns requests per second per test and the effective settings (CONFIG GET), raises when redis does not start
+    volume = '{conf}:{target}:ro'.format(conf=(redis_dir / 'redis.conf').resolve().as_posix(), target=CONTAINER_CONF)
+    kwargs = {'memory': memory_limit} if memory_limit else {}
+    run = docker_run(redis_image(redis_dir), '-d', volume=volume,
+                     docker_args=['redis-server', CONTAINER_CONF], **kwargs)
+    try:
+        deadline = time.monotonic() + timeout
+        while docker_exec(run.container, docker_args=['redis-cli', 'ping'], stdout=subprocess.PIPE,
+                          fail_on_nonzero_exit=False).stdout.strip() != b'PONG':
+            if time.monotonic() > deadline:
+                raise RuntimeError('redis did not start with {conf}'.format(conf=redis_dir / 'redis.conf'))
+            time.sleep(0.2)
+        bench = docker_exec(run.container, docker_args=['redis-benchmark', '-q', '-n', str(requests), '-P', '16',
+                                                   '-t', 'set,get,incr,lpush'], stdout=subprocess.PIPE)
+        results = {}  # type: typing.Dict[str, typing.Union[str, float]]
+        for line in bench.stdout.decode('utf-8', 'replace').replace('\r', '\n').splitlines():
+            m = re.match(r'^\s*(\S+): ([\d.]+) requests per second', line)
+            if m is not None:
+                results[m.group(1)] = float(m.group(2))
+        for name in ('maxmemory', 'maxmemory-policy', 'appendonly', 'io-threads'):
+            value = docker_exec(run.container, docker_args=['redis-cli', 'config', 'get', name],
+                                stdout=subprocess.PIPE).stdout.decode('utf-8').split()
+            results[name] = value[1] if len(value) > 1 else ''
+        return results
+    finally:
+        try:
+            docker_remove(run.container, True)
+        except subprocess.CalledProcessError:
+            pass
@@ -0,0 +1,148 @@
+import os
+import re
+import typing
+
+# Resource profiles of services, stored in x-meta and written into the compose service definition
+#   cpus/cpuset:                  cpu time limit and the cpus the containers may run on
+#   mem_limit/mem_reservation:    hard memory limit and the memory docker tries to keep available under pressure
+#   pids_limit:                   maximum number of processes/threads
+#   nofile:                       open files limit (soft and hard)
+# The keys are those of the compose specification (docker-compose 1.27 or later)
+
+RESOURCE_KEYS = ('cpus', 'cpuset', 'mem_limit', 'mem_reservation', 'pids_limit', 'nofile')
+# keys of a service definition managed by the resource profile
+COMPOSE_KEYS = ('cpus', 'cpuset', 'mem_limit', 'mem_reservation', 'pids_limit')
+
+# Limits of the builder containers of compile_javascript, empty to run builds without limits, `auto` to size them
+builder_cpus = os.environ.get('MANAGER_BUILDER_CPUS', 'auto')
+builder_memory = os.environ.get('MANAGER_BUILDER_MEMORY', 'auto')
+
+_SIZE_UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+def parse_size(value: typing.Union[str, int]) -> int:
+    # docker sizes (512m, 2g, 1.5g, bytes) in bytes
+    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([bkmgt]?)b?\s*$', str(value), re.IGNORECASE)
+    if m is None:
+        raise ValueError('Invalid size {value}'.format(value=value))
+    return int(float(m.group(1)) * _SIZE_UNITS[m.group(2).lower()])
+
+
+def format_size(size: int) -> str:
+    # In megabytes, which docker and compose accept everywhere
+    return '{size}m'.format(size=max(1, size // 1024 ** 2))
+
+
+def get_resource_settings(settings: typing.Optional[dict]) -> typing.Dict[str, typing.Union[str, int, float]]:
+    # Validated resource profile, only the keys that are set
+    if not settings:
+        return {}
+    unknown = set(settings) - set(RESOURCE_KEYS)
+    if unknown:
+        raise ValueError('Unknown resource settings {unknown}'.format(unknown=', '.join(sorted(unknown))))
+    resources = {}  # type: typing.Dict[str, typing.Union[str, int, float]]
+    for key, value in settings.items():
+        if value is None or value == '':
+            continue
+        if key == 'cpus':
+            resources[key] = float(value)
+            if resources[key] <= 0:
+                raise ValueError('cpus should be positive')
+        elif key == 'cpuset':
+            if re.match(r'^\d+(-\d+)?(,\d+(-\d+)?)*$', str(value)) is None:
+                raise ValueError('Invalid cpuset {value}, expected a list like 0-3,6'.format(value=value))
+            resources[key] = str(value)
+        elif key in ('mem_limit', 'mem_reservation'):
+            resources[key] = format_size(parse_size(value))
+        else:
+            resources[key] = int(value)
+    if 'mem_limit' in resources and 'mem_reservation' in resources \
+            and parse_size(resources['mem_reservation']) > parse_size(resources['mem_limit']):
+        raise ValueError('mem_reservation should not be larger than mem_limit')
+    return resources
+
+
+def parse_resource_arguments(arguments: typing.Sequence[str]) -> typing.Dict[str, str]:
+    # KEY=VALUE pairs of the command line
+    settings = {}
+    for argument in arguments:
+        key, sep, value = argument.partition('=')
+        if not sep:
+            raise ValueError('Resource settings are given as KEY=VALUE, not {argument}'.format(argument=argument))
+        settings[key.strip().replace('-', '_')] = value.strip()
+    return settings
+
+
+def compose_resources(resources: typing.Dict[str, typing.Union[str, int, float]]) -> dict:
+    # The service definition keys of a resource profile
+    data = {key: resources[key] for key in COMPOSE_KEYS if key in resources}
+    if 'nofile' in resources:
+        data['ulimits'] = {'nofile': {'soft': resources['nofile'], 'hard': resources['nofile']}}
+    return data
+
+
+def host_resources() -> (int, int):
+    # (cpu cores, memory in bytes) of the host running docker
+    cores = os.cpu_count() or 1
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        memory = 2 * 1024 ** 3
+    return cores, memory
+
+
+def reserved_cpus(cores: int) -> typing.Optional[str]:
+    # With four or more cores the first core is kept free of backends and builds, for the proxy and the host
+    if cores < 4:
+        return None
+    return '1-{last}'.format(last=cores - 1)
+
+
+def auto_resources(services: typing.Sequence[typing.Tuple[str, str, int]],
+                   cores: int,
+                   memory: int) -> typing.Dict[str, typing.Dict[str, typing.Union[str, int, float]]]:
+    # Profiles for (name, kind, containers) of a group, kind is proxy, backend or service
+    # Memory: a tenth of the host (at least 512MB) is left to the host, the rest is reserved per container
+    # by weight (proxy and backends 2, other services 1); limits are twice the reservation, so idle neighbours
+    # leave room for a busy one. Cpu limits follow the same weights, the proxy gets at least one core.
+    weights = {'proxy': 2, 'backend': 2, 'service': 1}
+    total = sum(weights[kind] * containers for _, kind, containers in services) or 1
+    usable = max(memory - max(512 * 1024 ** 2, memory // 10), 256 * 1024 ** 2)
+    profiles = {}
+    for name, kind, containers in services:
+        share = weights[kind] / total
+        reservation = max(int(usable * share), 64 * 1024 ** 2)
+        cpus = min(float(cores), max(0.5, round(cores * min(1.0, 2 * share), 1)))
+        if kind == 'proxy':
+            cpus = max(cpus, min(1.0, float(cores)))
+        profile = {
+            'cpus': cpus,
+            'mem_reservation': format_size(reservation),
+            'mem_limit': format_size(min(usable, 2 * reservation)),
+            'pids_limit': 1024 if kind == 'backend' else 256,
+            'nofile': 10240 if kind == 'service' else 65536,
+        }
+        pinned = reserved_cpus(cores)
+        if kind == 'backend' and pinned is not None:
+            profile['cpuset'] = pinned
+        profiles[name] = profile
+    return profiles
+
+
+def builder_limits() -> typing.Dict[str, str]:
+    # docker run options limiting a builder container
+    # auto: all cores but the one kept for the proxy, half of the memory (at least 1GB)
+    cores, memory = host_resources()
+    limits = {}
+    if builder_cpus:
+        limits['cpus'] = str(max(1, cores - 1)) if builder_cpus == 'auto' else builder_cpus
+        pinned = reserved_cpus(cores)
+        if builder_cpus == 'auto' and pinned is not None:
+            limits['cpuset-cpus'] = pinned
+    if builder_memory:
+        limits['memory'] = format_size(max(1024 ** 3, memory // 2)) if builder_memory == 'auto' \
+            else format_size(parse_size(builder_memory))
+    if limits:
+        limits['pids-limit'] = '4096'
+        limits['ulimit'] = 'nofile=65536:65536'
+    return limits
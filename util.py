@@ -1,7 +1,9 @@
 import subprocess
+import typing
 from pathlib import Path
 import yaml
 import DockerCompose
+import compose_cache
 
 
 def chown_as_sudo(file: Path, owner: str, group: str = None, *args, **kwargs):
@@ -32,15 +34,35 @@ def test_location(location: Path, overwrite: bool = False, no_overwrite: bool =
     return False
 
 
+# libyaml based loader when PyYAML was built with it, it parses the same documents
+# Files are written with the python dumper: libyaml wraps long and non-ascii scalars differently, which would
+# change every line of existing compose files
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
 def yaml_load(filename: Path) -> dict:
     with open(filename.as_posix(), 'r') as file:
-        data = yaml.safe_load(file)
+        data = yaml.load(file, Loader=YamlLoader)
     return data
 
 
+def yaml_dump(data: dict, file: typing.IO) -> None:
+    # Same output as yaml.safe_dump
+    yaml.dump(data, file, Dumper=yaml.SafeDumper)
+
+
 def load(filename: Path, main_name: str):
-    data = yaml_load(filename)
+    data = compose_cache.load_compose_data(filename)
     out = DockerCompose.DockerCompose(data, main_name)
     return out
 
 
+
+
+def pop_deploy_replicas(service_yaml: typing.Optional[dict]) -> typing.Optional[int]:
+    # `deploy.replicas` of service settings, removed since docker-compose cannot scale named containers
+    # the replicas are created as containers of their own instead (see DockerCompose.set_replicas)
+    if not service_yaml or not isinstance(service_yaml.get('deploy'), dict):
+        return None
+    replicas = service_yaml['deploy'].pop('replicas', None)
+    return int(replicas) if replicas is not None else None